@@ -8,6 +8,7 @@ mongodb_user = os.getenv('mongodb_user')
 mongodb_pass = os.getenv('mongodb_pass')
 mongodb_uri = os.getenv('mongodb_uri')
 mongodb_appname = os.getenv('mongodb_appname')
+mongodb_url = os.getenv('mongodb_url')
 clerk_secret_key = os.getenv('clerk_secret_key')
 
 if clerk_secret_key == "" or clerk_secret_key is None:
@@ -19,6 +20,7 @@ if clerk_secret_key == "" or clerk_secret_key is None:
     mongodb_pass = os.getenv('mongodb_pass')
     mongodb_uri = os.getenv('mongodb_uri')
     mongodb_appname = os.getenv('mongodb_appname')
+    mongodb_url = os.getenv('mongodb_url')
     clerk_secret_key = os.getenv('clerk_secret_key')
 
 
@@ -26,10 +28,18 @@ if clerk_secret_key == "" or clerk_secret_key is None:
 
 from flask import Flask, jsonify, request, g
 import exceptions as exc
+from encoder import MongoJSONProvider
 import datetime
 import numpy as np
+import csv
+import io
+import json
+import base64
+import re
+import hashlib
 
 app = Flask(__name__)
+app.json = MongoJSONProvider(app)
 
 from flask_cors import CORS, cross_origin
 
@@ -37,63 +47,316 @@ cors = CORS(app) # allow CORS for all domains on all routes.
 app.config['CORS_HEADERS'] = 'Content-Type'
 
 
+""" Instrumentation Setup """
+
+from instrumentation import (Metrics, RequestTimings, CommandMetricsListener, PoolMetricsListener,
+                             current_timings, track, prometheus_samples)
+
+# Request latencies, MongoDB commands and pool statistics, exposed at GET /metrics
+request_metrics = Metrics()
+
+# Setting server_timing to true adds a Server-Timing header with the auth, db and
+# serialization time of each request (off by default, it shows timings to clients)
+server_timing = os.getenv('server_timing', 'false').lower() == 'true'
+
+@app.before_request
+def start_request_timings():
+    g.timings_token = current_timings.set(RequestTimings())
+
+@app.after_request
+def record_request_timings(response):
+    timings = current_timings.get()
+    if timings is not None:
+        # Label by the route pattern, not the path, to keep the number of series bounded
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        request_metrics.observe_request(route, request.method, response.status_code, timings)
+        if server_timing:
+            response.headers["Server-Timing"] = timings.server_timing()
+    return response
+
+@app.teardown_request
+def reset_request_timings(error=None):
+    token = g.pop("timings_token", None)
+    if token is not None:
+        current_timings.reset(token)
+
+
+""" Logging Setup """
+
+import logging
+from flask.logging import default_handler
+from request_logging import configure_logging, current_request, request_id_from, SampleRates, CommandLogListener
+
+# Log records are written as JSON lines (log_format=json) or text (text) by a
+# background thread, log_format=off keeps Flask's default logging. The info and
+# debug records of a request are kept for log_sample_rate of requests, or the
+# rate of its route in log_sample_rates (e.g. "GET /farms=0.05,GET /farms/<farmId>=0.1")
+log_format = os.getenv('log_format', 'json')
+log_sampling = SampleRates.parse(float(os.getenv('log_sample_rate', 1)), os.getenv('log_sample_rates'))
+
+log_handler = None
+
+def setup_logging():
+    """
+        Configure logging once per process, from create_app, so importing the
+        app (e.g. in tests or scripts) leaves the root logger alone
+    """
+    global log_handler
+    if log_format == "off" or log_handler is not None:
+        return
+    log_handler = configure_logging(
+        level=os.getenv('log_level', 'INFO').upper(),
+        log_format=log_format,
+        max_length=int(os.getenv('log_max_length', 2000)),
+        queue_size=int(os.getenv('log_queue_size', 10000))
+    )
+    app.logger.removeHandler(default_handler)
+
+# MongoDB commands slower than this are logged with the request that ran them
+command_log_listener = CommandLogListener(slow_ms=float(os.getenv('log_slow_command_ms', 100)))
+
+@app.before_request
+def start_request_log():
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    g.request_log_token = current_request.set({
+        "id": request_id_from(request.headers.get("X-Request-ID")),
+        "route": route,
+        "sampled": log_sampling.sample(request.method, route)
+    })
+
+@app.after_request
+def log_request(response):
+    context = current_request.get()
+    if context is None:
+        return response
+
+    timings = current_timings.get()
+    fields = {"method": request.method, "status": response.status_code}
+    if timings is not None:
+        fields.update(
+            durationMs=round(timings.elapsed() * 1e3, 2),
+            dbMs=round(timings.durations.get("db", 0) * 1e3, 2),
+            commands=timings.commands
+        )
+    app.logger.info("Request handled", extra={"fields": fields})
+    response.headers["X-Request-ID"] = context["id"]
+    return response
+
+@app.teardown_request
+def reset_request_log(error=None):
+    token = g.pop("request_log_token", None)
+    if token is not None:
+        current_request.reset(token)
+
+
 """ MongoDB Setup """
 
 from pymongo.mongo_client import MongoClient
 from bson import ObjectId
 from pymongo.server_api import ServerApi
+from pymongo.errors import BulkWriteError
+from pymongo import ReturnDocument
 
-uri = f"mongodb+srv://{mongodb_user}:{mongodb_pass}@{mongodb_uri}/?retryWrites=true&w=majority&appName={mongodb_appname}"
+# A full connection string in mongodb_url (e.g. a local mongod) replaces the Atlas one
+uri = mongodb_url or f"mongodb+srv://{mongodb_user}:{mongodb_pass}@{mongodb_uri}/?retryWrites=true&w=majority&appName={mongodb_appname}"
+
+from clients import LazyClient
+
+# The client is created on first use (see warm_up), and again in forked workers
+client = LazyClient(lambda: MongoClient(
+    uri,
+    server_api=ServerApi('1'),
+    event_listeners=[CommandMetricsListener(request_metrics), PoolMetricsListener(request_metrics), command_log_listener]
+), "MongoDB")
+
+from concurrent.futures import ThreadPoolExecutor
+
+# Independent queries of a request run at the same time on this pool, see run_concurrently
+lookup_executor = ThreadPoolExecutor(max_workers=int(os.getenv('lookup_threads', 16)), thread_name_prefix="lookup")
+
+# Maximum number of farms accepted by POST /farms/bulk
+bulk_import_limit = int(os.getenv('bulk_import_limit', 5000))
+
+# Seconds clients may reuse GET /categories without revalidating
+categories_max_age = int(os.getenv('categories_max_age', 300))
+
+
+""" Geocoder Setup """
+
+from geocoder import Geocoder, MATCH_LEVELS, match_levels
+
+# Path prefix of the index built with `python geocoder.py build ...`, if it is not
+# set addresses are geocoded against the national_address_file collection
+geocoder_index = os.getenv('geocoder_index')
+
+geocoder = None
+if geocoder_index:
+    try:
+        geocoder = Geocoder(geocoder_index)
+        app.logger.info("Loaded geocoder index with %s addresses", len(geocoder))
+    except OSError as e:
+        app.logger.warning("Could not load geocoder index, %s", e)
+
+
+""" Search Setup """
+
+from search import create_search_backend, category_list
+
+# GET /farms uses Atlas Search by default ("atlas"), setting search_backend to
+# "local" searches an in-process index instead so it can run without Atlas
+search_backend = create_search_backend(os.getenv('search_backend', 'atlas'))
+
+from cache import create_cache, GenerationalCache, LatencyHistogram
+from encoder import dumps_bytes
+
+# GET /farms responses are cached by their normalized query. Every farm or
+# produce write moves the cache to a new generation. Setting farms_cache_url
+# to a Redis compatible server shares the cache between worker processes,
+# otherwise each process keeps its own and other processes' writes are only
+# seen once entries expire. A farms_cache_ttl of 0 disables the cache
+farms_cache = GenerationalCache(create_cache(
+    os.getenv('farms_cache_url'),
+    maxsize=int(os.getenv('farms_cache_size', 1024)),
+    ttl=int(os.getenv('farms_cache_ttl', 30)),
+    prefix="farms:"
+), "farms")
+farms_cache_latency = {"hit": LatencyHistogram(), "miss": LatencyHistogram()}
+
+
+""" Farm Metrics Setup """
+
+from counters import MetricsAggregator, METRIC_FIELDS, METRIC_GRANULARITIES, bucket_start, utc_now
+
+# Profile view and contact form counters are buffered and written in batches,
+# every metrics_flush_interval_ms or after metrics_flush_max_events events.
+# They are also added to hourly buckets in farm_metrics for the owner analytics
+metrics_aggregator = MetricsAggregator(
+    lambda: client.farm_details.farms,
+    flush_interval=int(os.getenv('metrics_flush_interval_ms', 1000)) / 1000,
+    max_events=int(os.getenv('metrics_flush_max_events', 1000)),
+    history_getter=lambda: client.farm_details.farm_metrics
+)
 
-# Create a new client and connect to the server
-client = MongoClient(uri, server_api=ServerApi('1'))
 
-# Send a ping to confirm a successful connection
-try:
-    client.admin.command('ping')
-    app.logger.info("Pinged your deployment. You successfully connected to MongoDB!")
-except Exception as e:
-    app.logger.info(e)
-    
-  
 """ Clerk Authentication """
 
-from clerk_backend_api import Clerk
-from clerk_backend_api.security.types import AuthenticateRequestOptions
 from functools import wraps
+from cache import TTLCache
+from jwks import JWKSKeySet
+import jwt
+import time
+import contextvars
+
+def create_clerk():
+    # Imported here as the Clerk SDK is slow to import and unused in jwks mode
+    from clerk_backend_api import Clerk
+    return Clerk(bearer_auth=clerk_secret_key)
+
+clerk = LazyClient(create_clerk, "Clerk")
+
+# Session tokens are verified by Clerk by default ("clerk"). Setting clerk_auth_mode
+# to "jwks" verifies them locally against a cached JWKS key set instead, loaded from
+# clerk_jwks_file if set, otherwise fetched from clerk_jwks_url
+clerk_auth_mode = os.getenv('clerk_auth_mode', 'clerk')
+
+jwks_key_set = None
+if clerk_auth_mode == "jwks":
+    clerk_authorized_parties = os.getenv('clerk_authorized_parties')
+
+    jwks_key_set = JWKSKeySet(
+        jwks_url=os.getenv('clerk_jwks_url', 'https://api.clerk.com/v1/jwks'),
+        jwks_file=os.getenv('clerk_jwks_file'),
+        secret_key=clerk_secret_key,
+        audience=os.getenv('clerk_audience'),
+        authorized_parties=clerk_authorized_parties.split(',') if clerk_authorized_parties else None
+    )
+
+# Verified session claims and clerkId -> user_id lookups are cached in process so
+# repeated calls from the same session skip the Clerk round trip and the user query
+auth_cache_ttl = int(os.getenv('auth_cache_ttl', 60))
+auth_cache_size = int(os.getenv('auth_cache_size', 4096))
+
+claims_cache = TTLCache(maxsize=auth_cache_size, ttl=auth_cache_ttl)
+user_id_cache = TTLCache(maxsize=auth_cache_size, ttl=auth_cache_ttl)
+
+def get_session_token():
+    """
+        Get the raw session token from the Authorization header, falling back to
+        the __session cookie in the same way Clerk does.
+    """
+    auth_header = request.headers.get("Authorization", "")
+    if auth_header.startswith("Bearer "):
+        return auth_header[len("Bearer "):].strip() or None
+    return request.cookies.get("__session")
+
+def invalidate_auth_cache(clerk_id):
+    """
+        Drop all cached authentication state for a Clerk user
+    """
+    user_id_cache.pop(clerk_id)
+    claims_cache.pop_matching(lambda claims: claims.get("sub") == clerk_id)
+
+def verify_session_token(token):
+    """
+        Verify the session token for the current request and return its claims
+    """
+    if jwks_key_set is not None:
+        if not token:
+            raise exc.Unauthorized("No session token was sent to an authenticated endpoint.")
+        try:
+            return jwks_key_set.verify(token)
+        except jwt.InvalidTokenError as e:
+            raise exc.Unauthorized(f"Invalid session token, {e}")
+
+    from clerk_backend_api.security.types import AuthenticateRequestOptions
+
+    claims_state = clerk.authenticate_request(
+        request,
+        AuthenticateRequestOptions()
+    )
 
-clerk = Clerk(bearer_auth=clerk_secret_key)
+    if claims_state.payload is None:
+        raise exc.Unauthorized("Invalid authentication data was set to an authenticated endpoint.")
+
+    return claims_state.payload
 
 # This decorator protects routes by verifying the Clerk session token
 def clerk_auth_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         try:
-            claims_state = clerk.authenticate_request(
-                request,
-                AuthenticateRequestOptions()
-            )
+            with track("auth"):
+                token = get_session_token()
 
-            app.logger.info(" Headers: ", request.headers)
-            app.logger.info(" Payload: ", claims_state)
+                # Only verify the token with Clerk if we have not seen it recently
+                claims = claims_cache.get(token) if token else None
+                if claims is None:
+                    claims = verify_session_token(token)
 
-            # Get the our id for this user
-            db = client.authentication
+                    # Never cache the claims for longer than the token is valid
+                    if token:
+                        ttl = min(auth_cache_ttl, claims.get("exp", 0) - time.time())
+                        claims_cache.set(token, claims, ttl=ttl)
 
-            if claims_state.payload is None:
-                raise exc.Unauthorized("Invalid authentication data was set to an authenticated endpoint.")
-            
-            g.clerk_id = claims_state.payload.get("sub")
+                g.clerk_id = claims.get("sub")
 
-            user = db.users.find_one({"clerkId": g.clerk_id})
-            if user is None:
-                raise exc.BadRequest(f"User not found, {g.clerk_id}")
-            
-            # Access the user ID via the .payload attribute.
-            g.user_id = str(user["_id"])
-            app.logger.info(f"Authenticated {g.clerk_id} as {g.user_id}")
+                # Get the our id for this user
+                user_id = user_id_cache.get(g.clerk_id)
+                if user_id is None:
+                    db = client.authentication
+
+                    user = db.users.find_one({"clerkId": g.clerk_id}, {"_id": 1})
+                    if user is None:
+                        raise exc.Unauthorized(f"User not found, {g.clerk_id}")
+
+                    user_id = str(user["_id"])
+                    user_id_cache.set(g.clerk_id, user_id)
+
+                # Access the user ID via the .payload attribute.
+                g.user_id = user_id
+            app.logger.info("Authenticated %s as %s", g.clerk_id, g.user_id)
         except exc.Unauthorized as e:
-            app.logger.warning(f"Authentication error: {e.message}")
+            app.logger.warning("Authentication error: %s", e.message)
             return jsonify({
                 "success": False, 
                 "error": {
@@ -108,45 +371,434 @@ def clerk_auth_required(f):
 
 """ Helper Functions """
 
-def mongo_to_dict(obj, id_name="id", exclusion_list=[]):
+# Fields stored for the server's own use, never returned by the API
+INTERNAL_FIELDS = ("version",)
+
+def mongo_to_dict(obj, id_name="id", exclusion_list=INTERNAL_FIELDS):
     """
-        Recursively traverses a dictionary or list, converting MongoDB BSON types
-        to JSON-serializable Python types.
+        Recursively traverses a dictionary or list, renaming MongoDB '_id' keys
+        so the document is ready to be returned by jsonify.
 
-        - Renames '_id' to a specified name (default: 'id').
-        - Converts any value that is an ObjectId to its string representation.
-        - Converts any datetime object to a Unix timestamp (float).
+        - Renames '_id' to a specified name (default: 'id') and converts its value to a string.
+        - Removes the keys in exclusion_list (default: the internal ETag version).
         - Works on nested dictionaries and lists of dictionaries.
+        - Documents are updated in place, pymongo returns a new dict for every result.
+
+        Any other ObjectId or datetime values are left as they are and converted
+        by the JSON provider (see encoder.py) when the response is serialized.
     """
     if isinstance(obj, list):
         # If the object is a list, recursively call this function for each item
-        return [mongo_to_dict(item, id_name, exclusion_list) for item in obj]
+        for item in obj:
+            mongo_to_dict(item, id_name, exclusion_list)
+        return obj
 
     if not isinstance(obj, dict):
         # If it's not a list or a dict, return it as is
         return obj
 
-    # Create a new dictionary to hold the results to avoid issues with changing
-    # the dictionary while iterating over it.
-    new_doc = {}
-    for key, value in obj.items():
-        if key == '_id':
-            # Rename '_id' and convert its value
-            new_doc[id_name] = str(value)
-        elif isinstance(value, ObjectId):
-            # Convert any other ObjectId value to a string
-            new_doc[key] = str(value)
-        elif isinstance(value, datetime.datetime):
-            # Convert datetime to a timestamp
-            new_doc[key] = value.timestamp()
-        elif isinstance(value, (dict, list)):
+    if '_id' in obj:
+        # Rename '_id' and convert its value, an existing key with the new name is kept
+        obj.setdefault(id_name, str(obj.pop('_id')))
+
+    for key in exclusion_list:
+        obj.pop(key, None)
+
+    for value in obj.values():
+        if isinstance(value, (dict, list)):
             # If the value is a dict or list, recurse
-            new_doc[key] = mongo_to_dict(value, id_name, exclusion_list)
-        else:
-            # Otherwise, just copy the value
-            new_doc[key] = value
+            mongo_to_dict(value, id_name, exclusion_list)
             
-    return new_doc
+    return obj
+
+
+def farm_to_dict(farm):
+    """
+        Convert a farm search result, naming the ids of its joined produce produceId
+    """
+    mongo_to_dict(farm.get("produce", []), "produceId")
+    return mongo_to_dict(farm, "farmId")
+
+
+def normalize_address(address):
+    """
+        Uppercase the address fields and create zipCodeInt for indexing
+    """
+    if 'street' in address:
+        address['street'] = str(address.get('street', '')).upper()
+    if 'city' in address:
+        address['city'] = str(address.get('city', '')).upper()
+    if 'state' in address:
+        address['state'] = str(address.get('state', '')).upper()
+    
+    try:
+        address['zipCodeInt'] = int(address.get('zipCode'))
+    except (ValueError, TypeError, AttributeError):
+        address['zipCodeInt'] = None
+
+    return address
+
+def locate_address(db, street, city, zipcode, state):
+    """
+        Find the location of an address in the national address register.
+
+        Tries the full address first, then drops the street, city and zipcode
+        in turn, skipping the levels with a missing field (see
+        geocoder.match_levels). Uses the in-process geocoder index when one is
+        configured, otherwise queries the national_address_file collection.
+
+        Returns a tuple of the GeoJSON point and the match level, or (None, None).
+    """
+    if geocoder is not None:
+        return geocoder.geocode(street, city, zipcode, state)
+
+    for level, location_query in match_levels(state, zipcode, city, street):
+        center_point_doc = db.national_address_file.find_one(location_query)
+        if center_point_doc:
+            return center_point_doc['location'], level
+    return None, None
+
+def geocode_address(db, street, city, zipcode, state):
+    """
+        Find the location of an address, see locate_address.
+
+        Returns a GeoJSON point, [0, 0] if the address could not be found.
+    """
+    center_point, match_level = locate_address(db, street, city, zipcode, state)
+    app.logger.info("Geocoded address at %s level", match_level)
+
+    if center_point is None:
+        app.logger.warning("Address not found!")
+        center_point = {"type": "Point", "coordinates": [0.0,0.0]}
+
+    return center_point
+
+
+def locate_addresses(db, addresses):
+    """
+        Find the locations of many addresses at once.
+
+        Each address is a dict with street, city, zipcode and state keys. Uses
+        the same fallback levels as locate_address, but resolves every address
+        still unmatched at a level with a single aggregation over the batch.
+
+        Returns a list of (GeoJSON point, match level) tuples in the same
+        order, (None, None) if the address could not be found.
+    """
+    if geocoder is not None:
+        return [locate_address(db, a.get("street"), a.get("city"), a.get("zipcode"), a.get("state")) for a in addresses]
+
+    levels = [dict(match_levels(a.get("state"), a.get("zipcode"), a.get("city"), a.get("street"))) for a in addresses]
+    results = [(None, None)] * len(addresses)
+
+    # Full address first, then drop the street, city and zipcode in turn
+    for level in MATCH_LEVELS:
+        # Group the unmatched addresses by their values at this level
+        pending = {}
+        for i, address_levels in enumerate(levels):
+            if results[i][0] is None and level in address_levels:
+                pending.setdefault(tuple(address_levels[level].items()), []).append(i)
+
+        if not pending:
+            continue
+
+        level_fields = [field for field, _ in next(iter(pending))]
+        pipeline = [
+            {"$match": {"$or": [dict(key) for key in pending]}},
+            {"$group": {
+                "_id": {field: f"${field}" for field in level_fields},
+                "location": {"$first": "$location"}
+            }}
+        ]
+
+        for doc in db.national_address_file.aggregate(pipeline):
+            key = tuple((field, doc["_id"].get(field)) for field in level_fields)
+            for i in pending.get(key, []):
+                results[i] = (doc["location"], level)
+
+    return results
+
+def geocode_addresses(db, addresses):
+    """
+        Find the locations of many addresses at once, see locate_addresses.
+
+        Returns a list of GeoJSON points in the same order, [0, 0] if the
+        address could not be found.
+    """
+    return [point if point is not None else {"type": "Point", "coordinates": [0.0,0.0]}
+            for point, _ in locate_addresses(db, addresses)]
+
+
+def nest_fields(row):
+    """
+        Convert a flat row with dotted keys (e.g. from a csv file) into a nested
+        dict, skipping empty values. {"address.city": "CAIRNS"} -> {"address": {"city": "CAIRNS"}}
+    """
+    doc = {}
+    for key, value in row.items():
+        if key is None or value is None or value == "":
+            continue
+        parts = key.strip().split(".")
+        target = doc
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return doc
+
+
+# Counts for keyset pagination are only computed when asked for and then cached
+# for a short time, so paging through results does not recount every page
+count_cache = TTLCache(maxsize=4096, ttl=int(os.getenv('count_cache_ttl', 60)))
+
+def encode_cursor(sort_value, last_id):
+    """
+        Create an opaque continuation token from the sort key of the last item on a page
+    """
+    return base64.urlsafe_b64encode(json.dumps([sort_value, str(last_id)]).encode()).decode()
+
+def decode_cursor(token):
+    """
+        Get the (sort value, _id) pair back from a continuation token
+    """
+    try:
+        sort_value, last_id = json.loads(base64.urlsafe_b64decode(token.encode()))
+        if sort_value is not None and not isinstance(sort_value, (int, float)):
+            raise ValueError("Invalid sort value")
+        return sort_value, ObjectId(last_id)
+    except Exception:
+        raise exc.BadRequest(f"Invalid cursor, {token}")
+
+def cached_count(key, count_function):
+    """
+        Get a count from the count cache, or compute and cache it
+    """
+    count = count_cache.get(key)
+    if count is None:
+        count = count_function()
+        count_cache.set(key, count)
+    return count
+
+def find_page_after(collection, filter, token, limit, include_total, fields=None):
+    """
+        Get a keyset page of documents sorted by _id, continuing after the
+        continuation token (an empty token starts at the beginning).
+
+        Returns the documents, the token for the next page (None on the last
+        page) and the total number of documents if include_total is set.
+    """
+    query = dict(filter)
+    if token:
+        _, after_id = decode_cursor(token)
+        query["_id"] = {"$gt": after_id}
+
+    # Fetch one extra document to know if there is another page, and count at the same time
+    docs, total = run_concurrently(
+        lambda: list(collection.find(query, projection(fields), sort=[("_id", 1)], limit=limit + 1)),
+        lambda: cached_count((collection.full_name, repr(filter)), lambda: collection.count_documents(filter))
+                if include_total else None
+    )
+    next_token = encode_cursor(None, docs[limit - 1]["_id"]) if len(docs) > limit else None
+
+    return docs[:limit], next_token, total
+
+def keyset_pagination(next_token, total, limit):
+    """
+        Create the pagination information for a keyset page
+    """
+    return {
+        "nextCursor": next_token,
+        "totalPages": int(np.ceil(total / limit)) if total else (0 if total == 0 else None),
+        "totalItems": total,
+        "itemsPerPage": limit
+    }
+
+
+FIELD_PATTERN = re.compile(r"^[A-Za-z][A-Za-z0-9_]*(\.[A-Za-z][A-Za-z0-9_]*)*$")
+
+def parse_fields(value, id_name):
+    """
+        Parse a comma separated sparse fieldset (e.g. fields=name,location,produceCategories)
+        into a list of dotted paths for a Mongo projection. The id is always returned.
+
+        Returns None when no fieldset was requested.
+    """
+    if value is None:
+        return None
+
+    fields = []
+    for field in value.split(","):
+        field = field.strip()
+        if not field or field in (id_name, "_id"):
+            continue
+        if not FIELD_PATTERN.match(field):
+            raise exc.BadRequest(f"Invalid field, {field}")
+        fields.append(field)
+
+    # Mongo rejects a path together with one of its parents, the parent already includes it
+    return [
+        field for field in dict.fromkeys(fields)
+        if not any(field.startswith(other + ".") for other in fields)
+    ]
+
+def projection(fields, *extra_fields):
+    """
+        Create a Mongo projection from a sparse fieldset, None returns every field
+    """
+    if fields is None:
+        return None
+    return {field: 1 for field in [*fields, *extra_fields]}
+
+
+# Fields read to build the validators of a document, see document_validators
+VALIDATOR_FIELDS = ("version", "modifiedAt", "createdAt")
+
+def document_validators(*docs):
+    """
+        Get the version key and last modified time of a response built from documents.
+
+        Writes that change what a GET returns $inc the document's version in the
+        same update (farms are also bumped when their produce changes, see
+        touch_farms). The tracked metrics counters do not bump the version.
+    """
+    versions = tuple((str(doc.get("_id")), doc.get("version", 0)) for doc in docs)
+    times = [doc.get("modifiedAt") or doc.get("createdAt") for doc in docs]
+    times = [t for t in times if isinstance(t, datetime.datetime)]
+    # The timestamps are stored as naive local times, see datetime.datetime.now() in the writers
+    last_modified = max(times).astimezone(datetime.timezone.utc).replace(microsecond=0) if times else None
+    return versions, last_modified
+
+def make_etag(*parts):
+    """
+        Create a strong entity tag from the parts of a response, the query string
+        is included as it selects the fields returned
+    """
+    return hashlib.sha1(repr((parts, request.query_string)).encode()).hexdigest()
+
+def not_modified_response(etag, last_modified=None, cache_control="no-cache"):
+    """
+        Get a 304 response if the request's If-None-Match or If-Modified-Since
+        validators still match, otherwise None
+    """
+    if request.if_none_match:
+        # If-None-Match takes precedence over If-Modified-Since
+        matched = request.if_none_match.contains_weak(etag)
+    else:
+        matched = bool(last_modified and request.if_modified_since and last_modified <= request.if_modified_since)
+
+    if not matched:
+        return None
+    return set_validators(app.response_class(status=304), etag, last_modified, cache_control)
+
+def set_validators(response, etag, last_modified=None, cache_control="no-cache"):
+    """
+        Add the ETag, Last-Modified and Cache-Control headers to a response
+    """
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers["Cache-Control"] = cache_control
+    return response
+
+def strip_validator_fields(doc, fields):
+    """
+        Remove the validator fields added to a sparse fieldset projection
+    """
+    if fields is not None:
+        for field in VALIDATOR_FIELDS:
+            if field not in fields:
+                doc.pop(field, None)
+    return doc
+
+# Fields the server sets. Clients send back the documents they were given,
+# so these are dropped from request bodies rather than written
+SERVER_FARM_FIELDS = ("_id", "farmId", "ownerId", "createdAt", "modifiedAt", "version", "metrics", "produceCategories")
+SERVER_PRODUCE_FIELDS = ("_id", "produceId", "createdAt", "modifiedAt", "version")
+
+def strip_server_fields(data, server_fields):
+    """
+        Remove the fields the server sets from a request body
+    """
+    for field in server_fields:
+        if field in data:
+            app.logger.info("    %s: %s ignored", request.remote_addr, field)
+            del data[field]
+    return data
+
+def touch_farms(db, farm_ids, session=None):
+    """
+        Bump the version of farms whose produce changed, GET /farms/<id> includes it
+    """
+    db.farms.update_many(
+        {"_id": {"$in": list(set(farm_ids))}},
+        {"$inc": {"version": 1}, "$set": {"modifiedAt": datetime.datetime.now()}},
+        session=session
+    )
+
+
+def run_concurrently(*calls):
+    """
+        Run independent database calls at the same time and return their results
+        in order. The first call runs on the request thread, the others on the
+        lookup pool, so the calls must not use the request context. They run in a
+        copy of the request's context so their commands count towards its timings.
+    """
+    futures = [lookup_executor.submit(contextvars.copy_context().run, call) for call in calls[1:]]
+    return [calls[0](), *[future.result() for future in futures]]
+
+# Search centres of city and zipcode queries, the address register rarely changes
+center_cache = TTLCache(maxsize=4096, ttl=int(os.getenv('center_cache_ttl', 3600)))
+
+
+def run_in_transaction(callback):
+    """
+        Run callback(session) in a transaction, retrying on transient errors
+    """
+    with client.start_session() as session:
+        return session.with_transaction(callback)
+
+def sync_produce_categories(db, farm_ids, session=None):
+    """
+        Recompute the denormalized produceCategories array of farms from their
+        produce, and bump their version as their produce changed
+    """
+    for farm_id in set(farm_ids):
+        categories = db.produce.distinct("category", {"farmId": farm_id}, session=session)
+        db.farms.update_one(
+            {"_id": farm_id},
+            {
+                "$set": {
+                    "produceCategories": sorted(c for c in categories if isinstance(c, str) and c),
+                    "modifiedAt": datetime.datetime.now()
+                },
+                "$inc": {"version": 1}
+            },
+            session=session
+        )
+
+def raise_farm_write_error(db, farmId):
+    """
+        Raise the error for an ownership-scoped farm write that matched nothing.
+        Only the error path pays for this extra query.
+    """
+    if db.farms.find_one({"_id": ObjectId(farmId)}, {"_id": 1}) is None:
+        raise exc.BadRequest(f"Farm not found, {farmId}")
+    raise exc.Unauthorized(f"User does not own farm, {g.user_id}")
+
+def owned_farm_ids(db):
+    """
+        The ids of the authenticated user's farms, produce writes are filtered
+        on them so the ownership check is part of the write
+    """
+    return [farm["_id"] for farm in db.farms.find({"ownerId": ObjectId(g.user_id)}, {"_id": 1})]
+
+def raise_produce_write_error(db, produceId):
+    """
+        Raise the error for an ownership-scoped produce write that matched
+        nothing. Only the error path pays for this extra query.
+    """
+    if db.produce.find_one({"_id": ObjectId(produceId)}, {"_id": 1}) is None:
+        raise exc.BadRequest(f"Produce not found, {produceId}")
+    raise exc.Unauthorized(f"User does not own associated farm, {g.user_id}")
 
 
 """ Authentication Endpoints """
@@ -166,7 +818,7 @@ def auth_register():
 
         # Try to get the request body and make sure it is valid
         data = request.json.get("data")
-        app.logger.info(f"{request.remote_addr}: Request body received, {data}")
+        app.logger.debug("%s: Request body received, %s", request.remote_addr, data)
             
         phone_number = ""
         try:
@@ -182,7 +834,7 @@ def auth_register():
         # Check if the user email is already registered
         existing_user = db.users.find_one({"email": email_address})
         if existing_user is not None:
-            app.logger.info(f"    {request.remote_addr}: Email is already registered, {email_address}")
+            app.logger.info("    %s: Email is already registered, %s", request.remote_addr, email_address)
             raise exc.BadRequest(f"Email is already registered, {email_address}")
         
         birthday = None
@@ -209,7 +861,7 @@ def auth_register():
             "createdAt": dt_object,
             "modifiedAt": dt_object
         }).inserted_id
-        app.logger.info(f"    {request.remote_addr}: user_id created, {user_id}")
+        app.logger.info("    %s: user_id created, %s", request.remote_addr, user_id)
 
         return jsonify({
             "success": True,
@@ -241,7 +893,7 @@ def auth_update():
 
         # Try to get the request body and make sure it is valid
         data = request.json.get("data")
-        app.logger.info(f"{request.remote_addr}: Request body received, {data}")
+        app.logger.debug("%s: Request body received, %s", request.remote_addr, data)
             
         phone_number = ""
         try:
@@ -257,7 +909,7 @@ def auth_update():
         # Check if the user email is already registered
         existing_user = db.users.find_one({"email": email_address})
         if existing_user is not None:
-            app.logger.info(f"    {request.remote_addr}: Email is already registered, {email_address}")
+            app.logger.info("    %s: Email is already registered, %s", request.remote_addr, email_address)
             raise exc.BadRequest(f"Email is already registered, {email_address}")
         
         birthday = None
@@ -282,7 +934,8 @@ def auth_update():
             "profileImage": data.get("profile_image_url"),
             "modifiedAt": dt_object
         }})
-        app.logger.info(f"    {request.remote_addr}: user_id updated, {data.get("id")}")
+        invalidate_auth_cache(data.get("id"))
+        app.logger.info("    %s: user_id updated, %s", request.remote_addr, data.get("id"))
 
         return jsonify({
             "success": True,
@@ -313,18 +966,19 @@ def auth_delete():
 
         # Try to get the request body and make sure it is valid
         data = request.json.get("data")
-        app.logger.info(f"{request.remote_addr}: Request body received, {data}")
+        app.logger.debug("%s: Request body received, %s", request.remote_addr, data)
         clerk_id = data.get("id")
 
         # Check if the user exists
         existing_user = db.users.find_one({"clerkId": clerk_id})
         if existing_user is None:
-            app.logger.info(f"    {request.remote_addr}: User ID does not exist, {clerk_id}")
+            app.logger.info("    %s: User ID does not exist, %s", request.remote_addr, clerk_id)
             raise exc.BadRequest(f"User ID does not exist, {clerk_id}")
 
         # Deleted the user
         db.users.delete_one({"clerkId": clerk_id})
-        app.logger.info(f"    {request.remote_addr}: user deleted, {clerk_id}")
+        invalidate_auth_cache(clerk_id)
+        app.logger.info("    %s: user deleted, %s", request.remote_addr, clerk_id)
 
         return jsonify({
             "success": True,
@@ -354,7 +1008,7 @@ def auth_profile():
         # Get the the user if it exists
         existing_user = db.users.find_one({"_id": ObjectId(user_id)})
         if existing_user is None:
-            app.logger.info(f"    {request.remote_addr}: User ID does not exist, {user_id}")
+            app.logger.info("    %s: User ID does not exist, %s", request.remote_addr, user_id)
             raise exc.BadRequest(f"User ID does not exist, {user_id}")
 
         # Return the user profile
@@ -366,6 +1020,84 @@ def auth_profile():
         app.logger.warning(e)
         return exc.handle_error(e)
 
+# The cache stats endpoints show the app's internal counters, they answer 403
+# unless internal_endpoints is "on", e.g. on a worker behind a private port
+internal_endpoints = os.getenv('internal_endpoints', 'off') == 'on'
+
+def internal_only(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not internal_endpoints:
+            return exc.handle_error(exc.Forbidden("Internal endpoints are disabled"))
+        return f(*args, **kwargs)
+    return decorated_function
+
+@app.route('/auth/cache-stats', methods=["GET"])
+@cross_origin()
+@internal_only
+def auth_cache_stats():
+    """
+        Get hit and miss counters for the authentication caches
+
+        Endpoint: GET /auth/cache-stats
+
+        Response (200 OK)
+    """
+    return jsonify({
+        "success": True,
+        "data": {
+            "claims": claims_cache.stats(),
+            "users": user_id_cache.stats()
+        }
+    }), 200
+
+@app.route('/farms/cache-stats', methods=["GET"])
+@cross_origin()
+@internal_only
+def farms_cache_stats():
+    """
+        Get hit ratio and response time counters for the GET /farms cache
+
+        Endpoint: GET /farms/cache-stats
+
+        Response (200 OK)
+    """
+    return jsonify({
+        "success": True,
+        "data": {
+            "cache": farms_cache.stats(),
+            "latency": {result: histogram.stats() for result, histogram in farms_cache_latency.items()}
+        }
+    }), 200
+
+@app.route('/metrics', methods=["GET"])
+def metrics():
+    """
+        Get request latency, MongoDB command, connection pool and cache metrics
+        of this process in the Prometheus text format
+
+        Endpoint: GET /metrics
+
+        Response (200 OK)
+    """
+    lines = []
+
+    caches = {"farms": farms_cache.stats(), "claims": claims_cache.stats(), "users": user_id_cache.stats()}
+    for result in ["hits", "misses"]:
+        prometheus_samples(lines, f"cache_{result}_total", f"Cache {result} by cache", "counter",
+                           [({"cache": name}, stats[result]) for name, stats in caches.items()])
+
+    aggregator = metrics_aggregator.stats()
+    prometheus_samples(lines, "farm_metrics_buffered_events", "Farm metric events waiting to be written", "gauge",
+                       [({}, aggregator["bufferedEvents"])])
+    prometheus_samples(lines, "farm_metrics_flushed_events_total", "Farm metric events written", "counter",
+                       [({}, aggregator["flushedEvents"])])
+    if log_handler is not None:
+        prometheus_samples(lines, "log_records_dropped_total", "Log records dropped as the log queue was full", "counter",
+                           [({}, log_handler.dropped)])
+
+    return app.response_class(request_metrics.render(lines), mimetype="text/plain; version=0.0.4"), 200
+
 """ Farm Endpoints """
 
 @app.route('/my_farms', methods=["GET"])
@@ -383,6 +1115,10 @@ def get_my_farms():
             categories (optional): Filter by produce categories
             page (optional): Page number for pagination (default: 1)
             limit (optional): Items per page (default: 20)
+            cursor (optional): Continuation token from the previous page, an empty
+                               value starts keyset pagination instead of page numbers
+            includeTotal (optional): Count the total items with keyset pagination (default: false)
+            fields (optional): Comma separated farm fields to return (default: all)
 
         Response (200 OK)
     """
@@ -390,13 +1126,16 @@ def get_my_farms():
         db = client.farm_details
 
         data = request.args
-        app.logger.info(f"{request.remote_addr}: Request args received, {data}")
+        app.logger.debug("%s: Request args received, %s", request.remote_addr, data)
 
         filter = {"ownerId": ObjectId(g.user_id)}
 
         # Set the default page and limit
         page = 1
         limit = 20
+        token = None
+        include_total = False
+        fields = None
 
         # Create the filter, and fill the page and limit if they have been provided
         for key in list(data.keys()):
@@ -405,17 +1144,35 @@ def get_my_farms():
             elif key == "page":
                 page = int(data.get(key))
             elif key == "limit":
-                limit = np.clip(int(data.get(key)),1,100)
+                limit = int(np.clip(int(data.get(key)),1,100))
+            elif key == "cursor":
+                token = data.get(key)
+            elif key == "includeTotal":
+                include_total = data.get(key).lower() == "true"
+            elif key == "fields":
+                fields = parse_fields(data.get(key), "farmId")
             else:
-                app.logger.info(f"    {request.remote_addr}: {key} ignored")
+                app.logger.info("    %s: %s ignored", request.remote_addr, key)
+
+        # Keyset pagination
+        if token is not None:
+            farms, next_token, farm_count = find_page_after(db.farms, filter, token, limit, include_total, fields)
+
+            return jsonify({
+                "success": True,
+                "data": {
+                    "farms": [mongo_to_dict(farm, "farmId") for farm in farms],
+                    "pagination": keyset_pagination(next_token, farm_count, limit)
+                }
+            }), 200
         
         # Create the pagination information
         farm_count = int(db.farms.count_documents(filter))
-        page_count = int(np.ceil(limit/farm_count) if farm_count > 0 else 0)
+        page_count = int(np.ceil(farm_count/limit) if farm_count > 0 else 0)
         page = int(np.clip(page,1,page_count if page_count > 0 else 1))
         first_item = int((page-1)*limit+1)
 
-        cursor = db.farms.find(filter,skip=first_item-1,limit=limit)
+        cursor = db.farms.find(filter,projection(fields),skip=first_item-1,limit=limit)
         farm_list = [mongo_to_dict(farm, "farmId") for farm in cursor]
 
         return jsonify({
@@ -459,41 +1216,21 @@ def create_farm():
         app.logger.info("Request was malformed but we recovered")
         data = data.get("data")
     
-    app.logger.info(f"Request data, {data}")
+    app.logger.debug("Request data, %s", data)
+    strip_server_fields(data, SERVER_FARM_FIELDS)
 
     # Uppercase address fields and create zipCodeInt for indexing
     if 'address' in data and isinstance(data.get('address'), dict):
-        address = data['address']
-        if 'street' in address:
-            address['street'] = str(address.get('street', '')).upper()
-        if 'city' in address:
-            address['city'] = str(address.get('city', '')).upper()
-        if 'state' in address:
-            address['state'] = str(address.get('state', '')).upper()
-        
-        try:
-            address['zipCodeInt'] = int(address.get('zipCode'))
-        except (ValueError, TypeError, AttributeError):
-            address['zipCodeInt'] = None
+        address = normalize_address(data['address'])
     
     # Search for the address in the register
-    # Attempt 1, full address:
-    location_query = {}
-    location_query["street"] = address['street']
-    location_query["city"] = address["city"]
-    location_query["zipcode"] = address["zipCodeInt"]
-    location_query["state"] = address["state"]
-
-    center_point_doc = None
-    while not center_point_doc or list(location_query.keys()) == []:
-        center_point_doc = db.national_address_file.find_one(location_query)
-        location_query.pop(list(location_query.keys())[0])
-    
-    if not center_point_doc:
-        app.logger.warning("Address not found!")
-        center_point = {"type": "Point", "coordinates": [0.0,0.0]}
-    else:
-        center_point = center_point_doc['location']
+    center_point = geocode_address(
+        db,
+        address.get("street"),
+        address.get("city"),
+        address.get("zipCodeInt"),
+        address.get("state")
+    )
 
     # Add the additional fields
     data["ownerId"] = ObjectId(g.user_id)
@@ -505,12 +1242,14 @@ def create_farm():
         "lastProfileView": None,
         "lastContactForm": None
     }
+    data["produceCategories"] = []
 
     # Add the farm
-    farmId = db.farms.insert_one(data).inserted_id
-
-    # Get the farm data from mongodb
-    farm = db.farms.find_one({"_id":farmId})
+    # Add the farm, insert_one sets its _id on the data
+    db.farms.insert_one(data)
+    farm = data
+    search_backend.farm_saved(farm)
+    farms_cache.invalidate()
     
     # Convert to dict and replace ownerId with clerkId for the frontend
     farm_doc = mongo_to_dict(farm, "farmId")
@@ -524,6 +1263,115 @@ def create_farm():
     }), 201
 
 
+@app.route('/farms/bulk', methods=["POST"])
+@cross_origin()
+def farms_bulk():
+    try:
+        return create_farms_bulk()
+    except Exception as e:
+        app.logger.warning(e)
+        return exc.handle_error(e)
+
+@clerk_auth_required
+def create_farms_bulk():
+    """
+        Register many farms at once
+
+        Endpoint: POST /farms/bulk
+
+        Request Body:
+            A JSON array of farms (optionally wrapped in a data key), or a csv
+            file uploaded as "file" with one farm per row. Nested csv fields use
+            dotted column names, e.g. address.street, address.city
+
+        Response (201 Created)
+    """
+    # Get the farm_details database
+    db = client.farm_details
+
+    # Get the farms from the uploaded csv or the request body
+    if "file" in request.files:
+        text = request.files["file"].read().decode("utf-8-sig")
+        rows = [nest_fields(row) for row in csv.DictReader(io.StringIO(text))]
+    else:
+        rows = request.json
+        if isinstance(rows, dict):
+            rows = rows.get("data")
+
+    if not isinstance(rows, list) or len(rows) == 0:
+        raise exc.BadRequest("Expected a non-empty list of farms")
+
+    if len(rows) > bulk_import_limit:
+        raise exc.BadRequest(f"At most {bulk_import_limit} farms can be imported at once")
+
+    app.logger.info("%s: Bulk import of %s farms", request.remote_addr, len(rows))
+
+    # Validate the rows, keeping track of which input row each farm came from
+    errors = []
+    farms = []
+    row_numbers = []
+    for i, data in enumerate(rows):
+        if not isinstance(data, dict) or not isinstance(data.get("address"), dict):
+            errors.append({"row": i, "error": "Farm must be an object with an address"})
+            continue
+        strip_server_fields(data, SERVER_FARM_FIELDS)
+
+        normalize_address(data["address"])
+        farms.append(data)
+        row_numbers.append(i)
+
+    # Geocode every address with one query per fallback level
+    center_points = geocode_addresses(db, [{
+        "street": farm["address"].get("street"),
+        "city": farm["address"].get("city"),
+        "zipcode": farm["address"].get("zipCodeInt"),
+        "state": farm["address"].get("state")
+    } for farm in farms])
+
+    # Add the additional fields
+    now = datetime.datetime.now()
+    for farm, center_point in zip(farms, center_points):
+        farm["ownerId"] = ObjectId(g.user_id)
+        farm["createdAt"] = now
+        farm["location"] = center_point
+        farm["metrics"] = {
+            "profileViews": 0,
+            "contactForms": 0,
+            "lastProfileView": None,
+            "lastContactForm": None
+        }
+        farm["produceCategories"] = []
+
+    # Add the farms, an unordered insert keeps going past rows that fail
+    failed = {}
+    if farms:
+        try:
+            db.farms.insert_many(farms, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                failed[write_error["index"]] = write_error.get("errmsg", "Insert failed")
+
+    results = []
+    for index, (row, farm) in enumerate(zip(row_numbers, farms)):
+        if index in failed:
+            errors.append({"row": row, "error": failed[index]})
+        else:
+            search_backend.farm_saved(farm)
+            results.append({"row": row, "farmId": str(farm["_id"]), "location": farm["location"]})
+
+    if results:
+        farms_cache.invalidate()
+    errors.sort(key=lambda error: error["row"])
+
+    return jsonify({
+        "success": len(errors) == 0,
+        "message": f"{len(results)} of {len(rows)} farms registered successfully",
+        "data": {
+            "farms": results,
+            "errors": errors
+        }
+    }), 201 if results else 400
+
 def get_farms():
     """
         Get list of all registered farms with optional filtering
@@ -539,12 +1387,20 @@ def get_farms():
             categories (optional): Filter by produce categories
             page (optional): Page number for pagination (default: 1)
             limit (optional): Items per page (default: 20)
+            cursor (optional): Continuation token from the previous page, an empty
+                               value starts keyset pagination instead of page numbers
+            includeTotal (optional): Count the total items with keyset pagination (default: false)
+            fields (optional): Comma separated farm fields to return, include "produce"
+                               for the farm's produce (default: all)
+            produceFields (optional): Comma separated produce fields to return (default: all)
+
+        Each farm includes at most PRODUCE_LOOKUP_LIMIT (see search.py) of its produce.
 
         Response (200 OK)
     """
     db = client.farm_details
     args = request.args
-    app.logger.debug(f"{request.remote_addr}: Request args received, {args}")
+    app.logger.debug("%s: Request args received, %s", request.remote_addr, args)
 
     # Parse and sanitize input parameters
     try:
@@ -580,20 +1436,54 @@ def get_farms():
     categories_str = args.get('categories')
     query_str = args.get('q')
 
-    pipeline = []
-    
-    # Get farm IDs for category filter to apply later
-    farm_ids_from_category = None
-    if categories_str:
-        categories = [cat.strip() for cat in categories_str.split(',')]
-        produce_in_categories = db.produce.find(
-            {"category": {"$in": categories}},
-            {"farmId": 1}
-        )
-        farm_ids_from_category = {p['farmId'] for p in produce_in_categories}
+    categories = [cat.strip() for cat in categories_str.split(',')] if categories_str else None
+
+    fields = parse_fields(args.get('fields'), 'farmId')
+    produce_fields = parse_fields(args.get('produceFields'), 'produceId')
+
+    # Keyset pagination is used when a cursor is provided, even an empty one
+    token = args.get('cursor')
+    include_total = args.get('includeTotal', 'false').lower() == 'true'
+
+    # Cache the response by the normalized query
+    search_params = {
+        "city": s_city,
+        "state": s_state,
+        "zipcode": s_zipcode,
+        "distance_km": distance_km,
+        "categories": sorted(set(categories)) if categories else None,
+        "text": " ".join(query_str.lower().split()) or None if query_str else None,
+        "page": page,
+        "limit": limit,
+        "token": token,
+        "include_total": include_total,
+        "fields": fields,
+        "produce_fields": produce_fields
+    }
+    cache_key = repr(sorted(search_params.items()))
+
+    start = time.perf_counter()
+    generation = farms_cache.generation()
+    body = farms_cache.get(cache_key, generation=generation)
+    result = "hit"
+    if body is None:
+        body = dumps_bytes(search_farms(db, **search_params))
+        farms_cache.set(cache_key, body, generation=generation)
+        result = "miss"
+    farms_cache_latency[result].observe(time.perf_counter() - start)
+
+    return app.response_class(body, mimetype="application/json"), 200
+
+def search_farms(db, city, state, zipcode, distance_km, categories, text, page, limit, token, include_total,
+                 fields, produce_fields):
+    """
+        Run a GET /farms search and create its response
+    """
+    s_city, s_state, s_zipcode, query_str = city, state, zipcode, text
+    keyset = token is not None
 
-    target_collection = db.farms
     # Path A: Location-based search
+    center = None
     if s_city or s_zipcode:
         location_query = {}
         if s_city:
@@ -601,125 +1491,77 @@ def get_farms():
         if s_zipcode:
             location_query["zipcode"] = s_zipcode
 
-        center_point_doc = db.national_address_file.find_one(location_query)
+        center_key = repr(sorted(location_query.items()))
+        center_point_doc = center_cache.get(center_key)
+        if center_point_doc is None:
+            center_point_doc = db.national_address_file.find_one(location_query, {"location": 1}) or {}
+            center_cache.set(center_key, center_point_doc)
         
         if not (center_point_doc and 'location' in center_point_doc):
-            return jsonify({"success": True, "data": {"farms": [], "pagination": {
+            return {"success": True, "data": {"farms": [], "pagination": {
                 "currentPage": 1, "totalPages": 0, "totalItems": 0, "itemsPerPage": limit
-            }}}), 200
-
-        # Search for any farms matching the distance criteria
-        search_stage = {
-            "$search": {
-                "index": "farm_text",
-                "compound": {
-                    "filter": [{
-                        "geoWithin": {
-                            "circle": {
-                                "center": {
-                                    "type": "Point",
-                                    "coordinates": center_point_doc['location']['coordinates']
-                                },
-                                "radius": distance_km * 1000
-                            },
-                            "path": "location"
-                        }
-                    }]
-                }
-            }
-        }
-
-        # Add the query to match on the query string if provided
-        if query_str:
-            search_stage["$search"]["compound"]["must"] = [{
-                "text": {
-                    "query": query_str,
-                    "path": {"wildcard": "*"}
-                }
-            }]
-
-        pipeline.append(search_stage)
-
-        # Record the distance between the farm and the provided location
-        pipeline.append({
-            "$addFields": {
-                "distance": {
-                    "$sqrt": {
-                        "$add": [
-                            { "$pow": [ { "$subtract": [ { "$arrayElemAt": [ "$location.coordinates", 0 ] }, { "$arrayElemAt": [ center_point_doc['location']['coordinates'], 0 ] } ] }, 2 ] },
-                            { "$pow": [ { "$subtract": [ { "$arrayElemAt": [ "$location.coordinates", 1 ] }, { "$arrayElemAt": [ center_point_doc['location']['coordinates'], 1 ] } ] }, 2 ] }
-                        ]
-                    }
-                }
-            }
-        })
-
-        pipeline.append({
-            "$sort": {"distance": 1}
-        })
-
-    # Path B: Search-only
-    elif query_str:
-        pipeline.append({
-            '$search': {
-                "index": "farm_text",
-                "text": {
-                    "query": query_str,
-                    "path": {"wildcard": "*"}
-                }
-            }
-        })
-    
-    # Path C: No location, no search
-    else:
-        pass
+            }}}
 
-    # Apply category filter after main search/geo logic
-    match_filter = {}
-    if farm_ids_from_category is not None:
-        match_filter['_id'] = {'$in': list(farm_ids_from_category)}
+        center = center_point_doc['location']['coordinates']
 
-    if s_state and not s_city and not s_zipcode:
-        match_filter['address.state'] = s_state
+    search_query = {
+        "center": center,
+        "distance_km": distance_km,
+        "text": query_str,
+        "categories": categories,
+        "state": s_state if s_state and not s_city and not s_zipcode else None
+    }
 
-    if match_filter:
-        pipeline.append({'$match': match_filter})
+    if keyset:
+        after = decode_cursor(token) if token else None
+
+        # The cursor must come from the same kind of search
+        if after is not None and (after[0] is None) != (center is None and not query_str):
+            raise exc.BadRequest(f"Invalid cursor, {token}")
+
+        # Only count when asked to, and reuse a recent count for the same search
+        count_key = ("farms", repr(sorted(search_query.items())))
+        total_items = count_cache.get(count_key) if include_total else None
+
+        total, farms, next_after = search_backend.search(
+            db,
+            keyset=True,
+            after=after,
+            count=include_total and total_items is None,
+            limit=limit,
+            fields=fields,
+            produce_fields=produce_fields,
+            **search_query
+        )
+        if total is not None:
+            count_cache.set(count_key, total)
+            total_items = total
 
-    # Add lookup for produce
-    pipeline.append({'$lookup': {
-        'from': 'produce', 'localField': '_id', 'foreignField': 'farmId', 'as': 'produce'
-    }})
+        next_token = encode_cursor(*next_after) if next_after else None
 
-    # Add sort for location-based queries
-    if s_city or s_zipcode:
-        pipeline.append({'$sort': {'distance.meters': 1}})
-
-    # Add pagination
-    skip_amount = (page - 1) * limit
-    pipeline.append({
-        '$facet': {
-            'metadata': [{'$count': 'totalItems'}],
-            'data': [{'$skip': skip_amount}, {'$limit': limit}]
+        return {
+            "success": True,
+            "data": {
+                "farms": [farm_to_dict(farm) for farm in farms],
+                "pagination": keyset_pagination(next_token, total_items, limit)
+            }
         }
-    })
 
-    print(pipeline)
-
-    # Execute the aggregation
-    result = list(target_collection.aggregate(pipeline, allowDiskUse=True))
-
-    # Format and return the response
-    if not result or not result[0]['metadata']:
-        total_items = 0
-        farm_list = []
-    else:
-        total_items = result[0]['metadata'][0]['totalItems']
-        farm_list = [mongo_to_dict(farm, 'farmId') for farm in result[0]['data']]
+    # Run the search on the configured backend
+    total_items, farms, _ = search_backend.search(
+        db,
+        skip=(page - 1) * limit,
+        limit=limit,
+        fields=fields,
+        produce_fields=produce_fields,
+        **search_query
+    )
+    farm_list = [farm_to_dict(farm) for farm in farms]
 
     total_pages = int(np.ceil(total_items / limit)) if total_items > 0 else 0
     page = min(page, total_pages) if total_pages > 0 else 1
 
-    return jsonify({
+    return {
         "success": True,
         "data": {
             "farms": farm_list,
@@ -730,7 +1572,7 @@ def get_farms():
                 "itemsPerPage": limit
             }
         }
-    }), 200
+    }
 
 @app.route('/farms/<farmId>', methods=["PUT", "DELETE", "GET"])
 @cross_origin()
@@ -751,17 +1593,6 @@ def update_farm(farmId : str):
     # Get the farm_details database
     db = client.farm_details
 
-    # Find the farm
-    farm = db.farms.find_one({"_id": ObjectId(farmId)})
-
-    # If no farm was found return an error
-    if farm is None:
-        raise exc.BadRequest(f"Farm not found, {farmId}")
-
-    # Check that the authenticated user owns the farm
-    if g.user_id != str(farm["ownerId"]):
-        raise exc.Unauthorized(f"User does not own farm, {g.user_id}")
-    
     # Get the data from the request
     data = request.json
 
@@ -770,7 +1601,8 @@ def update_farm(farmId : str):
         app.logger.info("Request was malformed but we recovered")
         data = data.get("data")
     
-    app.logger.info(f"Request data, {data}")
+    app.logger.debug("Request data, %s", data)
+    strip_server_fields(data, SERVER_FARM_FIELDS)
     
     # Create the set data dictionary for the update
     set_data = {}
@@ -790,39 +1622,30 @@ def update_farm(farmId : str):
                     set_data[f'address.{addr_key}'] = addr_value
                     
             # Search for the address in the register
-            # Attempt 1, full address:
-            location_query = {}
-            location_query["street"] = set_data['address.street']
-            location_query["city"] = set_data["address.city"]
-            location_query["zipcode"] = set_data["address.zipCodeInt"]
-            location_query["state"] = set_data["address.state"]
-
-            center_point_doc = None
-            while not center_point_doc or list(location_query.keys()) == []:
-                center_point_doc = db.national_address_file.find_one(location_query)
-                location_query.pop(list(location_query.keys())[0])
-            
-            if not center_point_doc:
-                app.logger.warning("Address not found!")
-                center_point = {"type": "Point", "coordinates": [0.0,0.0]}
-            else:
-                center_point = center_point_doc['location']
-            
-            set_data['location'] = center_point
+            set_data['location'] = geocode_address(
+                db,
+                set_data.get("address.street"),
+                set_data.get("address.city"),
+                set_data.get("address.zipCodeInt"),
+                set_data.get("address.state")
+            )
         else:
             # Handle top-level fields
             set_data[key] = value
 
     set_data["modifiedAt"] = datetime.datetime.now()
 
-    # Update the farm item
-    db.farms.update_one(
-        {"_id": ObjectId(farmId)},
-        {'$set': set_data}
+    # Update the farm item if the authenticated user owns it, bump its version
+    # for the ETag and get the updated farm back
+    farm = db.farms.find_one_and_update(
+        {"_id": ObjectId(farmId), "ownerId": ObjectId(g.user_id)},
+        {'$set': set_data, '$inc': {'version': 1}},
+        return_document=ReturnDocument.AFTER
     )
-
-    # Get the farm data from mongodb
-    farm = db.farms.find_one({"_id": ObjectId(farmId)})
+    if farm is None:
+        raise_farm_write_error(db, farmId)
+    search_backend.farm_saved(farm)
+    farms_cache.invalidate()
 
     # Convert to dict and replace ownerId with clerkId for the frontend
     farm_doc = mongo_to_dict(farm, "farmId")
@@ -847,19 +1670,12 @@ def delete_farm(farmId : str):
     # Get the farm_details database
     db = client.farm_details
 
-    # Find the farm
-    farm = db.farms.find_one({"_id": ObjectId(farmId)})
-
-    # If no farm was found return an error
-    if farm is None:
-        raise exc.BadRequest(f"Farm not found, {farmId}")
-
-    # Check that the authenticated user owns the farm
-    if g.user_id != str(farm["ownerId"]):
-        raise exc.Unauthorized(f"User does not own farm, {g.user_id}")
-    
-    # Delete the farm
-    db.farms.delete_one({"_id": ObjectId(farmId)})
+    # Delete the farm if the authenticated user owns it
+    result = db.farms.delete_one({"_id": ObjectId(farmId), "ownerId": ObjectId(g.user_id)})
+    if result.deleted_count == 0:
+        raise_farm_write_error(db, farmId)
+    search_backend.farm_deleted(ObjectId(farmId))
+    farms_cache.invalidate()
 
     # Return the success message
     return jsonify({
@@ -874,29 +1690,52 @@ def get_farm(farmId : str):
 
         Endpoint: GET /farms/:farmId
 
+        Query Parameters:
+            fields (optional): Comma separated farm fields to return, include "produce"
+                               for the farm's produce (default: all)
+            produceFields (optional): Comma separated produce fields to return (default: all)
+
         Response (200 OK)
     """
     # Get the farm_details database
     db = client.farm_details
 
-    # Find the farm
-    farm = db.farms.find_one({"_id": ObjectId(farmId)})
+    fields = parse_fields(request.args.get("fields"), "farmId")
+    produce_fields = parse_fields(request.args.get("produceFields"), "produceId")
+
+    find_farm = lambda: db.farms.find_one({"_id": ObjectId(farmId)}, projection(fields, *VALIDATOR_FIELDS))
+    find_produce = lambda: list(db.produce.find({"farmId": ObjectId(farmId)}, projection(produce_fields)))
+    include_produce = fields is None or "produce" in fields
+
+    # Find the farm and its produce together, conditional requests are likely
+    # to be answered from the farm alone so they load the produce afterwards
+    if include_produce and not (request.if_none_match or request.if_modified_since):
+        farm, produce_list = run_concurrently(find_farm, find_produce)
+    else:
+        farm, produce_list = find_farm(), None
 
     # If no farm was found return an error
     if farm is None:
         raise exc.BadRequest(f"Farm not found, {farmId}")
-    
-    farm = mongo_to_dict(farm, "farmId") 
 
-    # Get the produce for the farm and add it in
-    produce_list = db.produce.find({"farmId":ObjectId(farm["farmId"])})
-    produce_list = [mongo_to_dict(produce, "produceId") for produce in produce_list]
-    farm["produce"] = produce_list
+    # Answer conditional requests before loading the produce
+    versions, last_modified = document_validators(farm)
+    etag = make_etag("farm", versions)
+    if (response := not_modified_response(etag, last_modified)) is not None:
+        return response
 
-    return jsonify({
+    farm = mongo_to_dict(strip_validator_fields(farm, fields), "farmId")
+
+    # Add the produce for the farm
+    if include_produce:
+        if produce_list is None:
+            produce_list = find_produce()
+        farm["produce"] = [mongo_to_dict(produce, "produceId") for produce in produce_list]
+
+    return set_validators(jsonify({
         "success": True,
         "data": farm
-    }), 200
+    }), etag, last_modified), 200
 
 @app.route('/farms/<farmId>/produce', methods=["POST", "GET"])
 @cross_origin()
@@ -917,12 +1756,19 @@ def get_farm_produce(farmId : str):
 
         Endpoint: GET /farms/:farmId/produce
 
+        Query Parameters:
+            page (optional): Page number for pagination (default: 1)
+            limit (optional): Items per page (default: 20)
+            cursor (optional): Continuation token from the previous page, an empty
+                               value starts keyset pagination instead of page numbers
+            includeTotal (optional): Count the total items with keyset pagination (default: false)
+
         Response (200 OK)
     """
     db = client.farm_details
     
     data = request.args
-    app.logger.info(f"{request.remote_addr}: Request args received, {data}")
+    app.logger.debug("%s: Request args received, %s", request.remote_addr, data)
 
     # Create the farm filter
     filter = {"farmId":ObjectId(farmId)}
@@ -930,26 +1776,45 @@ def get_farm_produce(farmId : str):
     # Get the farm details
     farm = db.farms.find_one({"_id":ObjectId(farmId)})
     if farm is None:
-        app.logger.info(f"    {request.remote_addr}: Farm does not exist, {farmId}")
+        app.logger.info("    %s: Farm does not exist, %s", request.remote_addr, farmId)
         raise exc.BadRequest(f"Farm does not exist, {farmId}")
 
     # Set the default page and limit
     page = 1
     limit = 20
+    token = None
+    include_total = False
 
     # Create the filter, and fill the page and limit if they have been provided
     for key in list(data.keys()):
-        app.logger.info(key)
         if key == "page":
             page = int(data.get(key))
         elif key == "limit":
-            limit = np.clip(int(data.get(key)),1,100)
+            limit = int(np.clip(int(data.get(key)),1,100))
+        elif key == "cursor":
+            token = data.get(key)
+        elif key == "includeTotal":
+            include_total = data.get(key).lower() == "true"
         else:
-            app.logger.info(f"    {request.remote_addr}: {key} ignored")
+            app.logger.info("    %s: %s ignored", request.remote_addr, key)
+
+    # Keyset pagination
+    if token is not None:
+        produce_list, next_token, produce_count = find_page_after(db.produce, filter, token, limit, include_total)
+
+        return jsonify({
+            "success": True,
+            "data": {
+                "farmId": farmId,
+                "farmName": farm["name"],
+                "produce": [mongo_to_dict(produce, "produceId") for produce in produce_list],
+                "pagination": keyset_pagination(next_token, produce_count, limit)
+            }
+        }), 200
     
     # Create the pagination information
     produce_count = int(db.produce.count_documents(filter))
-    page_count = int(np.ceil(limit/produce_count) if produce_count > 0 else 0)
+    page_count = int(np.ceil(produce_count/limit) if produce_count > 0 else 0)
     page = int(np.clip(page,1,page_count if page_count > 0 else 1))
     first_item = int((page-1)*limit+1)
 
@@ -978,17 +1843,6 @@ def add_farm_produce(farmId : str):
     # Get the farm_details database
     db = client.farm_details
 
-    # Find the farm
-    farm = db.farms.find_one({"_id": ObjectId(farmId)})
-
-    # If no farm was found return an error
-    if farm is None:
-        raise exc.BadRequest(f"Farm not found, {farmId}")
-
-    # Check that the authenticated user owns the farm
-    if g.user_id != str(farm["ownerId"]):
-        raise exc.Unauthorized(f"User does not own farm, {g.user_id}")
-    
     # Get the data from the request
     data = request.json
 
@@ -997,16 +1851,37 @@ def add_farm_produce(farmId : str):
         app.logger.info("Request was malformed but we recovered")
         data = data.get("data")
 
+    strip_server_fields(data, SERVER_PRODUCE_FIELDS)
+
     # Add the farm id and created timestamp
     data["farmId"] = ObjectId(farmId)
     data["createdAt"] = datetime.datetime.now()
     data["modifiedAt"] = datetime.datetime.now()
 
-    # Add the produce item
-    produceId = db.produce.insert_one(data).inserted_id
+    # Add the category to the farm's produceCategories and bump its version if
+    # the authenticated user owns the farm, then add the produce item, together
+    def add_produce(session):
+        farm_update = {"$inc": {"version": 1}, "$set": {"modifiedAt": data["modifiedAt"]}}
+        # The category is an array of categories, or a single one from older clients
+        categories = [category for category in category_list(data.get("category")) if category]
+        if categories:
+            farm_update["$addToSet"] = {"produceCategories": {"$each": categories}}
+        result = db.farms.update_one(
+            {"_id": ObjectId(farmId), "ownerId": ObjectId(g.user_id)},
+            farm_update,
+            session=session
+        )
+        if result.matched_count == 0:
+            raise_farm_write_error(db, farmId)
+
+        db.produce.insert_one(data, session=session)
 
-    # Get the produce document
-    produce = db.produce.find_one({"_id":produceId})
+    run_in_transaction(add_produce)
+
+    # insert_one sets the produce document's _id on the data
+    produce = data
+    search_backend.produce_saved(produce)
+    farms_cache.invalidate()
 
     # Return the success message
     return jsonify({
@@ -1036,41 +1911,62 @@ def get_produce_id(produceId: str):
 
         Endpoint: GET /produce/:produceId
 
+        Query Parameters:
+            produceFields (optional): Comma separated produce fields to return (default: all)
+            fields (optional): Comma separated fields of the produce's farm to return (default: all)
+
         Response (200 OK)
     """
     db = client.farm_details
     
     data = request.args
-    app.logger.info(f"{request.remote_addr}: Request args received, {data}")
+    app.logger.debug("%s: Request args received, %s", request.remote_addr, data)
+
+    fields = parse_fields(data.get("fields"), "farmId")
+    produce_fields = parse_fields(data.get("produceFields"), "produceId")
+
+    # Get the produce document associated with this id and join its farm, in one query
+    farm_pipeline = [{"$project": projection(fields, *VALIDATOR_FIELDS)}] if fields is not None else []
+    pipeline = [
+        {"$match": {"_id": ObjectId(produceId)}},
+        {"$lookup": {"from": "farms", "localField": "farmId", "foreignField": "_id", "pipeline": farm_pipeline, "as": "farm"}}
+    ]
+    if produce_fields is not None:
+        pipeline.append({"$project": {**projection(produce_fields, "farmId", *VALIDATOR_FIELDS), "farm": 1}})
+    produce = next(db.produce.aggregate(pipeline), None)
 
-    # Get the produce document associated with this id
-    produce = db.produce.find_one({"_id": ObjectId(produceId)})
     # If no produce document was found return an error
     if produce is None:
-        app.logger.info(f"    {request.remote_addr}: Produce with this id does not exist, {produceId}")
+        app.logger.info("    %s: Produce with this id does not exist, %s", request.remote_addr, produceId)
         raise exc.BadRequest(f"Produce with this id does not exist, {produceId}")
     
     # Get the farm document associated with this produce
-    farm = db.farms.find_one({"_id": produce["farmId"]})
+    farm = produce.pop("farm")[0] if produce.get("farm") else None
     # If no farm was found with the produce document's farm id return an error
     if farm is None:
-        app.logger.info(f"    {request.remote_addr}: Farm with this id does not exist, {produce["farmId"]}")
+        app.logger.info("    %s: Farm with this id does not exist, %s", request.remote_addr, produce["farmId"])
         raise exc.BadRequest(f"Produce with this id does not exist, {produce["farmId"]}")
+
+    # Answer conditional requests, the response includes the farm so both versions are used
+    versions, last_modified = document_validators(produce, farm)
+    etag = make_etag("produce", versions)
+    if (response := not_modified_response(etag, last_modified)) is not None:
+        return response
     
     # Convert the produce document to a json compatible dict
-    produce_dict = mongo_to_dict(produce, "produceId")
+    produce_dict = mongo_to_dict(strip_validator_fields(produce, produce_fields), "produceId")
 
     # Convert the farm document to a json compatible dict
-    farm_dict = mongo_to_dict(farm, "farmId")
+    farm_dict = mongo_to_dict(strip_validator_fields(farm, fields), "farmId")
     
     # Add the farm dict to the produce dict
     produce_dict["farm"] = farm_dict
 
     # Return the details requested
-    return jsonify({
+    return set_validators(jsonify({
         "success": True,
         "data": produce_dict
-    }), 200
+    }), etag, last_modified), 200
 
 @clerk_auth_required
 def update_produce_id(produceId: str):
@@ -1084,26 +1980,8 @@ def update_produce_id(produceId: str):
     # Get the farm_details database
     db = client.farm_details
 
-    # Find the produce document
-    produce = db.produce.find_one({"_id": ObjectId(produceId)})
-
-    # If no produce document was found return an error
-    if produce is None:
-        raise exc.BadRequest(f"Produce not found, {produceId}")
-
-    # Get the associated farm id
-    farmId = str(produce["farmId"])
-
-    # Find the associated farm
-    farm = db.farms.find_one({"_id": ObjectId(farmId)})
-
-    # If no farm was found return an error
-    if farm is None:
-        raise exc.BadRequest(f"Associated farm not found, {farmId}")
-
-    # Check that the authenticated user owns the farm
-    if g.user_id != str(farm["ownerId"]):
-        raise exc.Unauthorized(f"User does not own associated farm, {g.user_id}")
+    # The authenticated user's farms, the update only matches produce of one of them
+    owned = owned_farm_ids(db)
     
     # Get the data from the request
     data = request.json
@@ -1112,6 +1990,7 @@ def update_produce_id(produceId: str):
     if "data" in data.keys():
         app.logger.info("Request was malformed but we recovered")
         data = data.get("data")
+    strip_server_fields(data, SERVER_PRODUCE_FIELDS)
     
     # Create the set data dictionary
     set_data = {}
@@ -1122,13 +2001,39 @@ def update_produce_id(produceId: str):
 
     set_data["modifiedAt"] = datetime.datetime.now()
 
-    # Update the produce item
-    db.produce.update_one(
-        {"_id": ObjectId(produceId)},
-        {'$set': set_data}
-    )
+    # Produce can only be moved to another farm of the same owner
+    if "farmId" in set_data:
+        set_data["farmId"] = ObjectId(set_data["farmId"])
+        if set_data["farmId"] not in owned:
+            raise exc.Unauthorized(f"User does not own farm, {g.user_id}")
+
+    # Update the produce item if its farm is owned by the authenticated user and
+    # bump its version, getting back its farm before the update. Then bump the
+    # version of its farms, and recompute their produceCategories if the
+    # category changed, in the same transaction so they never drift from the produce
+    def update_produce(session):
+        previous = db.produce.find_one_and_update(
+            {"_id": ObjectId(produceId), "farmId": {"$in": owned}},
+            {'$set': set_data, '$inc': {'version': 1}},
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if previous is None:
+            raise_produce_write_error(db, produceId)
+        farm_ids = {previous["farmId"], set_data.get("farmId", previous["farmId"])}
+        if "category" in set_data or "farmId" in set_data:
+            sync_produce_categories(db, farm_ids, session)
+        else:
+            touch_farms(db, farm_ids, session)
+        return {**previous, **set_data, "version": previous.get("version", 0) + 1}
 
-    produce = db.produce.find_one({"_id": ObjectId(produceId)})
+    # Only category changes need the farms' produceCategories updated in the same transaction
+    if "category" in set_data or "farmId" in set_data:
+        produce = run_in_transaction(update_produce)
+    else:
+        produce = update_produce(None)
+    search_backend.produce_saved(produce)
+    farms_cache.invalidate()
 
     # Return the success message
     return jsonify({
@@ -1149,35 +2054,40 @@ def delete_produce_id(produceId: str):
     # Get the farm_details database
     db = client.farm_details
 
-    # Find the produce document
-    produce = db.produce.find_one({"_id": ObjectId(produceId)})
-
-    # If no produce document was found return an error
-    if produce is None:
-        raise exc.BadRequest(f"Produce not found, {produceId}")
-
-    # Get the associated farm id
-    farmId = str(produce["farmId"])
-
-    # Find the associated farm
-    farm = db.farms.find_one({"_id": ObjectId(farmId)})
-
-    # If no farm was found return an error
-    if farm is None:
-        raise exc.BadRequest(f"Associated farm not found, {farmId}")
-
-    # Check that the authenticated user owns the farm
-    if g.user_id != str(farm["ownerId"]):
-        raise exc.Unauthorized(f"User does not own associated farm, {g.user_id}")
+    owned = owned_farm_ids(db)
+
+    # Delete the produce document if its farm is owned by the authenticated user,
+    # bump its farm's version and remove its category from the farm if no other
+    # produce uses it, in one transaction so produceCategories never drifts from
+    # the produce. Its category is only known once deleted, so it always runs in one.
+    def delete_produce(session):
+        produce = db.produce.find_one_and_delete(
+            {"_id": ObjectId(produceId), "farmId": {"$in": owned}},
+            projection={"farmId": 1, "category": 1},
+            session=session
+        )
+        if produce is None:
+            raise_produce_write_error(db, produceId)
+        if produce.get("category"):
+            sync_produce_categories(db, [produce["farmId"]], session)
+        else:
+            touch_farms(db, [produce["farmId"]], session)
 
-    # Delete the produce document
-    db.produce.delete_one({"_id": ObjectId(produceId)})
+    run_in_transaction(delete_produce)
+    search_backend.produce_deleted(ObjectId(produceId))
+    farms_cache.invalidate()
     
     return jsonify({
         "success": True,
         "message": "Produce deleted successfully"
     }), 201
 
+# The categories and a hash of them as the collection's version. They are edited
+# outside the API, so no write can bump a version or invalidate them. Instead they
+# are read at most once per categories_max_age, for which clients may already
+# reuse them, so conditional requests are answered without reading the collection.
+categories_cache = TTLCache(maxsize=1, ttl=categories_max_age)
+
 @app.route('/categories', methods=["GET"])
 @cross_origin()
 def categories():
@@ -1189,18 +2099,29 @@ def categories():
 
             Response (200 OK)
         """
-        app.logger.info(f"{request.remote_addr}: Request received")
+        app.logger.info("%s: Request received", request.remote_addr)
 
         db = client.farm_details
 
-        categories = db.produce_categories.find()
+        # Read at most once per categories_max_age, see categories_cache
+        cached = categories_cache.get("categories")
+        if cached is None:
+            categories = [category["value"] for category in db.produce_categories.find({}, {"_id": 0, "value": 1})]
+            cached = (categories, hashlib.sha1(repr(categories).encode()).hexdigest())
+            categories_cache.set("categories", cached)
+        categories, version = cached
 
-        return jsonify({
+        etag = make_etag("categories", version)
+        cache_control = f"public, max-age={categories_max_age}"
+        if (response := not_modified_response(etag, cache_control=cache_control)) is not None:
+            return response
+
+        return set_validators(jsonify({
             "success": True,
             "data": {
-                "categories": [category["value"] for category in categories]
+                "categories": categories
             }
-        }), 200
+        }), etag, cache_control=cache_control), 200
     except Exception as e:
         app.logger.warning(e)
         return exc.handle_error(e)
@@ -1218,27 +2139,18 @@ def track_profile_view(farmId: str):
         Response (200 OK)
     """
     try:
-        db = client.farm_details
-        
-        farm = db.farms.find_one({"_id": ObjectId(farmId)})
-        
-        if farm is None:
+        if not ObjectId.is_valid(farmId):
             raise exc.BadRequest(f"Farm not found, {farmId}")
         
-        db.farms.update_one(
-            {"_id": ObjectId(farmId)},
-            {
-                "$inc": {"metrics.profileViews": 1},
-                "$set": {"metrics.lastProfileView": datetime.datetime.now()}
-            }
-        )
+        # Buffer the view, it is written with the next batch of metrics
+        metrics_aggregator.increment(ObjectId(farmId), "profileViews")
         
         return jsonify({
             "success": True,
             "message": "Profile view tracked successfully"
         }), 200
     except Exception as e:
-        print(e)
+        app.logger.warning(e)
         return exc.handle_error(e)
 
 @app.route('/farms/<farmId>/track-contact', methods=["POST"])
@@ -1252,31 +2164,243 @@ def track_contact_submission(farmId: str):
         Response (200 OK)
     """
     try:
-        db = client.farm_details
-        
-        farm = db.farms.find_one({"_id": ObjectId(farmId)})
-        
-        if farm is None:
+        if not ObjectId.is_valid(farmId):
             raise exc.BadRequest(f"Farm not found, {farmId}")
         
-        db.farms.update_one(
-            {"_id": ObjectId(farmId)},
-            {
-                "$inc": {"metrics.contactForms": 1},
-                "$set": {"metrics.lastContactForm": datetime.datetime.now()}
-            }
-        )
+        # Buffer the submission, it is written with the next batch of metrics
+        metrics_aggregator.increment(ObjectId(farmId), "contactForms")
         
         return jsonify({
             "success": True,
             "message": "Contact form submission tracked successfully"
         }), 200
     except Exception as e:
-        print(e)
+        app.logger.warning(e)
+        return exc.handle_error(e)
+
+
+@app.route('/farms/<farmId>/metrics', methods=["GET"])
+@cross_origin()
+def farm_metrics(farmId: str):
+    try:
+        return get_farm_metrics(farmId)
+    except Exception as e:
+        app.logger.warning(e)
         return exc.handle_error(e)
 
+def parse_metrics_time(value, name):
+    """
+        Parse a unix timestamp or ISO 8601 date into a naive UTC datetime
+    """
+    try:
+        try:
+            return datetime.datetime.fromtimestamp(float(value), datetime.timezone.utc).replace(tzinfo=None)
+        except ValueError:
+            dt = datetime.datetime.fromisoformat(value)
+            if dt.tzinfo is not None:
+                dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+            return dt
+    except (ValueError, TypeError, OverflowError):
+        raise exc.BadRequest(f"Invalid {name} time, {value}")
+
+@clerk_auth_required
+def get_farm_metrics(farmId: str):
+    """
+        Get the profile view and contact form history of a farm for its owner
+
+        Endpoint: GET /farms/:farmId/metrics
+
+        Query Parameters:
+            from (optional): Start of the range, unix timestamp or ISO 8601 date (default: 30 days before to)
+            to (optional): End of the range, unix timestamp or ISO 8601 date (default: now)
+            granularity (optional): hour, day or month (default: day)
+
+        Hour buckets are kept for a limited time, and day and month buckets are
+        updated by rollup_metrics.py, see its retention settings.
+
+        Response (200 OK)
+    """
+    db = client.farm_details
+    args = request.args
+
+    # Find the farm
+    farm = db.farms.find_one({"_id": ObjectId(farmId)}, {"ownerId": 1})
+
+    # If no farm was found return an error
+    if farm is None:
+        raise exc.BadRequest(f"Farm not found, {farmId}")
+
+    # Check that the authenticated user owns the farm
+    if g.user_id != str(farm["ownerId"]):
+        raise exc.Unauthorized(f"User does not own farm, {g.user_id}")
+
+    granularity = args.get("granularity", "day")
+    if granularity not in METRIC_GRANULARITIES:
+        raise exc.BadRequest(f"Granularity must be one of {', '.join(METRIC_GRANULARITIES)}")
+
+    to_time = parse_metrics_time(args["to"], "to") if args.get("to") else utc_now()
+    from_time = parse_metrics_time(args["from"], "from") if args.get("from") else to_time - datetime.timedelta(days=30)
+    if from_time > to_time:
+        raise exc.BadRequest("The from time must be before the to time")
+
+    # One range scan on the (farmId, granularity, bucket) index
+    buckets = db.farm_metrics.find(
+        {
+            "farmId": ObjectId(farmId),
+            "granularity": granularity,
+            "bucket": {"$gte": bucket_start(from_time, granularity), "$lte": to_time}
+        },
+        {"_id": 0, "bucket": 1, "counts": 1},
+        sort=[("bucket", 1)]
+    )
+
+    def to_timestamp(dt):
+        return dt.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+    bucket_list = []
+    totals = {metric: 0 for metric in METRIC_FIELDS}
+    for bucket in buckets:
+        counts = {metric: bucket.get("counts", {}).get(metric, 0) for metric in METRIC_FIELDS}
+        for metric, count in counts.items():
+            totals[metric] += count
+        bucket_list.append({"bucket": to_timestamp(bucket["bucket"]), **counts})
+
+    return jsonify({
+        "success": True,
+        "data": {
+            "farmId": farmId,
+            "granularity": granularity,
+            "from": to_timestamp(from_time),
+            "to": to_timestamp(to_time),
+            "buckets": bucket_list,
+            "totals": totals
+        }
+    }), 200
+
+
+""" Health Endpoints """
+
+import threading
+
+# Warm-up state of this process, see ensure_warm_up
+warm_up_state = {"pid": None, "done": False, "error": None, "seconds": None}
+warm_up_lock = threading.Lock()
+
+# Seconds the readiness check waits for MongoDB to answer a ping
+readiness_timeout = float(os.getenv('readiness_timeout', 2))
+
+def create_readiness_client():
+    # A client of its own that gives up after readiness_timeout, instead of the
+    # 30s server selection timeout, and holds no thread of the lookup pool
+    timeout_ms = int(readiness_timeout * 1000)
+    return MongoClient(uri, server_api=ServerApi('1'), maxPoolSize=1, serverSelectionTimeoutMS=timeout_ms,
+                       connectTimeoutMS=timeout_ms, socketTimeoutMS=timeout_ms)
+
+readiness_client = LazyClient(create_readiness_client, "MongoDB readiness")
+
+def warm_up():
+    """
+        Create the clients and load the caches that the first requests would
+        otherwise wait for
+    """
+    start = time.perf_counter()
+    try:
+        client.admin.command('ping')
+        app.logger.info("Pinged your deployment. You successfully connected to MongoDB!")
+
+        if jwks_key_set is not None:
+            jwks_key_set.refresh()
+        else:
+            clerk.get()
+
+        search_backend.load(client.farm_details)
+        warm_up_state.update(done=True, error=None)
+    except Exception as e:
+        app.logger.warning("Warm-up failed, %s", e)
+        warm_up_state.update(error=str(e))
+    warm_up_state["seconds"] = time.perf_counter() - start
+
+def ensure_warm_up():
+    """
+        Start the warm-up in a background thread, once per process
+    """
+    with warm_up_lock:
+        if warm_up_state["pid"] == os.getpid():
+            return
+        warm_up_state.update(pid=os.getpid(), done=False, error=None, seconds=None)
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+@app.route('/health/live', methods=["GET"])
+@cross_origin()
+def health_live():
+    """
+        Liveness check, the process is up and serving requests. Does no I/O.
+
+        Endpoint: GET /health/live
+
+        Response (200 OK)
+    """
+    return jsonify({"success": True, "data": {"status": "live"}}), 200
+
+@app.route('/health/ready', methods=["GET"])
+@cross_origin()
+def health_ready():
+    """
+        Readiness check, MongoDB answers a ping and the warm-up has finished
+        (if the app was started with a warm-up, see create_app)
+
+        Endpoint: GET /health/ready
+
+        Response (200 OK, or 503 Service Unavailable when not ready)
+    """
+    checks = {}
+    try:
+        readiness_client.admin.command('ping')
+        checks["mongodb"] = "ok"
+    except Exception as e:
+        app.logger.warning("Readiness check could not ping MongoDB, %r", e)
+        checks["mongodb"] = "unavailable"
+
+    if warm_up_state["pid"] == os.getpid():
+        checks["warmUp"] = "ok" if warm_up_state["done"] else (warm_up_state["error"] or "running")
+
+    ready = all(check == "ok" for check in checks.values())
+    return jsonify({
+        "success": ready,
+        "data": {"status": "ready" if ready else "not ready", "checks": checks}
+    }), 200 if ready else 503
+
+
+""" App Factory """
+
+def create_app(warm_up_mode=None):
+    """
+        Get the configured app, for WSGI servers: gunicorn "app:create_app()"
+
+        Importing the app does no network I/O and leaves logging alone, logging
+        is configured here and the MongoDB and Clerk clients are created on
+        first use. startup_warm_up (or warm_up_mode) selects:
+
+            background - create the clients and load the caches in a background
+                         thread, /health/ready answers 503 until it is done (default)
+            blocking   - do the warm-up before returning
+            off        - create everything on first use
+    """
+    setup_logging()
+
+    warm_up_mode = warm_up_mode or os.getenv('startup_warm_up', 'background')
+    if warm_up_mode == "background":
+        ensure_warm_up()
+    elif warm_up_mode == "blocking":
+        with warm_up_lock:
+            warm_up_state["pid"] = os.getpid()
+        warm_up()
+    elif warm_up_mode != "off":
+        raise ValueError(f"Unknown startup_warm_up mode, {warm_up_mode}")
+    return app
+
 
 """ Run Flask App """
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
\ No newline at end of file
@@ -0,0 +1,16 @@
+""" ASGI Entry Point
+
+Serves the Flask app from an ASGI server, with the same routes, handlers and
+responses as the WSGI app:
+
+    uvicorn asgi:asgi_app --workers 4
+
+Requests run on the adapter's thread pool. Within a request, independent
+queries run at the same time on the lookup pool (see run_concurrently).
+"""
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import create_app
+
+asgi_app = WsgiToAsgi(create_app())
@@ -0,0 +1,55 @@
+""" Backfill produceCategories
+
+One-off migration that sets the denormalized produceCategories array on every
+farm from the categories of its produce, and creates the farms indexes (see indexes.py),
+including the one GET /farms uses to filter on it. Safe to run more than once.
+
+Usage:
+    python backfill_produce_categories.py
+"""
+
+from pymongo import UpdateOne
+
+from app import client
+from indexes import ensure_indexes
+
+BATCH_SIZE = 1000
+
+def farm_categories(db):
+    """
+        Get the sorted, distinct categories of each farm's produce. A produce
+        category is an array of categories, or a single one on older produce.
+    """
+    return {
+        doc["_id"]: sorted(c for c in doc["categories"] if isinstance(c, str) and c)
+        for doc in db.produce.aggregate([
+            # Unwinding a string category keeps it as it is
+            {"$unwind": "$category"},
+            {"$group": {"_id": "$farmId", "categories": {"$addToSet": "$category"}}}
+        ])
+    }
+
+def backfill(db):
+    categories_by_farm = farm_categories(db)
+
+    updated = 0
+    batch = []
+    for farm in db.farms.find({}, {"_id": 1}):
+        batch.append(UpdateOne(
+            {"_id": farm["_id"]},
+            {"$set": {"produceCategories": categories_by_farm.get(farm["_id"], [])}}
+        ))
+        if len(batch) == BATCH_SIZE:
+            updated += db.farms.bulk_write(batch, ordered=False).modified_count
+            batch = []
+
+    if batch:
+        updated += db.farms.bulk_write(batch, ordered=False).modified_count
+
+    ensure_indexes(db.farms)
+
+    return updated
+
+
+if __name__ == "__main__":
+    print(f"Updated produceCategories on {backfill(client.farm_details)} farms")
@@ -0,0 +1,97 @@
+""" Benchmark - Session Token Verification
+
+Compares the per-request latency of verifying a session token locally against a
+cached JWKS key set with the Clerk authenticate_request path used by default.
+
+The local path is measured against a generated RSA key and JWKS fixture file.
+The Clerk path is only measured when a real session token is passed with --token
+and clerk_secret_key is set in the environment.
+
+Usage:
+    python benchmarks/bench_auth.py [--iterations 2000] [--token <session token>]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwks import JWKSKeySet
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    print(f"{name:<28} mean {statistics.mean(timings)*1e6:>10.1f}us  "
+          f"p50 {timings[len(timings)//2]*1e6:>10.1f}us  "
+          f"p99 {timings[int(len(timings)*0.99)]*1e6:>10.1f}us")
+
+
+def bench_local(iterations):
+    # Create a signing key and write its public half to a JWKS fixture file
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update({"kid": "ins_bench", "alg": "RS256", "use": "sig"})
+
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump({"keys": [jwk]}, f)
+        jwks_file = f.name
+
+    try:
+        key_set = JWKSKeySet(jwks_file=jwks_file)
+        token = jwt.encode(
+            {"sub": "user_bench", "exp": int(time.time()) + 3600, "iat": int(time.time())},
+            private_key,
+            algorithm="RS256",
+            headers={"kid": "ins_bench"}
+        )
+
+        # First verification includes loading the key set
+        start = time.perf_counter()
+        key_set.verify(token)
+        report("jwks (cold, loads keys)", [time.perf_counter() - start])
+
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            key_set.verify(token)
+            timings.append(time.perf_counter() - start)
+        report("jwks (cached keys)", timings)
+    finally:
+        os.remove(jwks_file)
+
+
+def bench_clerk(iterations, token):
+    from clerk_backend_api import Clerk
+    from clerk_backend_api.security.types import AuthenticateRequestOptions
+    import httpx
+
+    clerk = Clerk(bearer_auth=os.getenv("clerk_secret_key"))
+    request = httpx.Request("GET", "http://localhost/", headers={"Authorization": f"Bearer {token}"})
+
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        clerk.authenticate_request(request, AuthenticateRequestOptions())
+        timings.append(time.perf_counter() - start)
+    report("clerk authenticate_request", timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--token", help="A real Clerk session token to benchmark the Clerk path")
+    args = parser.parse_args()
+
+    bench_local(args.iterations)
+
+    if args.token and os.getenv("clerk_secret_key"):
+        bench_clerk(args.iterations, args.token)
+    else:
+        print("Skipping clerk authenticate_request (pass --token and set clerk_secret_key)")
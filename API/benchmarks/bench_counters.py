@@ -0,0 +1,85 @@
+""" Benchmark - Farm Metrics Tracking
+
+Compares sustained track-view throughput and per-call latency of the previous
+find_one + update_one path with the write-behind MetricsAggregator, using a
+scratch database on a local mongod. A few farms receive most of the views to
+mimic popular farm pages.
+
+Usage:
+    python benchmarks/bench_counters.py --mongo-uri mongodb://localhost:27017 [--threads 16] [--seconds 10]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import datetime
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import MongoClient
+from counters import MetricsAggregator
+
+
+def direct_view(collection, farm_id):
+    if collection.find_one({"_id": farm_id}) is None:
+        raise ValueError("Farm not found")
+    collection.update_one(
+        {"_id": farm_id},
+        {"$inc": {"metrics.profileViews": 1}, "$set": {"metrics.lastProfileView": datetime.datetime.now()}}
+    )
+
+
+def run(name, track, farm_ids, threads, seconds):
+    latencies = [[] for _ in range(threads)]
+    stop = time.perf_counter() + seconds
+
+    def worker(timings):
+        rng = random.Random()
+        while time.perf_counter() < stop:
+            # 80% of the views go to the 10 most popular farms
+            farm_id = rng.choice(farm_ids[:10]) if rng.random() < 0.8 else rng.choice(farm_ids)
+            start = time.perf_counter()
+            track(farm_id)
+            timings.append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=worker, args=(timings,)) for timings in latencies]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    timings = sorted(t for thread_timings in latencies for t in thread_timings)
+    print(f"{name:<16} {len(timings)/seconds:>10.0f} views/s  "
+          f"p50 {timings[len(timings)//2]*1e6:>8.1f}us  p99 {timings[int(len(timings)*0.99)]*1e6:>8.1f}us")
+    return len(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mongo-uri", required=True)
+    parser.add_argument("--farms", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo_uri)
+    collection = client.bench_counters.farms
+    collection.drop()
+    farm_ids = collection.insert_many([
+        {"name": f"Farm {i}", "metrics": {"profileViews": 0, "contactForms": 0, "lastProfileView": None, "lastContactForm": None}}
+        for i in range(args.farms)
+    ]).inserted_ids
+
+    direct = run("find + update", lambda farm_id: direct_view(collection, farm_id), farm_ids, args.threads, args.seconds)
+
+    aggregator = MetricsAggregator(lambda: collection)
+    buffered = run("write-behind", lambda farm_id: aggregator.increment(farm_id, "profileViews"), farm_ids, args.threads, args.seconds)
+    aggregator.flush()
+
+    total = sum(farm["metrics"]["profileViews"] for farm in collection.find({}, {"metrics": 1}))
+    print(f"Stored views {total}, expected {direct + buffered}, flushes {aggregator.flush_count}")
+
+    client.drop_database("bench_counters")
@@ -0,0 +1,416 @@
+""" Benchmark - Endpoints
+
+Seeds a local mongod with generated data (see datagen.py) and drives every
+route of the API through Flask test clients. Reports throughput and latency
+percentiles in three phases:
+
+    routes     - each route on its own, --requests requests one after another
+    workloads  - read heavy, mixed and write heavy mixes of the routes from
+                 --threads threads for --seconds each
+    scenarios  - importing farms with POST /farms/bulk against one POST /farms
+                 per farm, and page 1 against page 500 of GET /my_farms with
+                 offset and with keyset (cursor) pagination
+
+Session tokens are signed by a local JWKS key (see bench_mutations.py), and the
+local search backend is used as a local mongod has no Atlas Search. The mongod
+must be a (single node) replica set for the produce transactions. Results are
+saved as JSON with the commit they were measured on, pass --compare with an
+earlier result to print the change of every measurement.
+
+Usage:
+    python benchmarks/bench_endpoints.py --mongo-uri "mongodb://localhost:27017/?replicaSet=rs0" --scale 100000 \\
+        [--output results.json] [--compare previous.json] [--force]
+
+The app always uses the farm_details and authentication databases, which are
+replaced while the benchmark runs and dropped afterwards. Run once per scale.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import itertools
+import threading
+import subprocess
+from types import SimpleNamespace
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+
+from bson import ObjectId
+from datagen import TOWNS, CATEGORIES, PRODUCE, seed
+from bench_mutations import make_signer
+
+PAGE_SIZE = 20
+
+
+""" Requests """
+
+def farm_body(ctx, rng):
+    address = rng.choice(ctx.addresses)
+    return {
+        "name": f"Bench Farm {next(ctx.counter)}",
+        "description": "Seasonal fruit and vegetables",
+        "address": {"street": address["street"].title(), "city": address["city"].title(),
+                    "zipCode": str(address["zipcode"]), "state": "qld"}
+    }
+
+def produce_body(rng):
+    category = rng.choice(CATEGORIES)
+    return {"name": rng.choice(PRODUCE[category]), "category": category, "price": round(rng.uniform(1, 40), 2), "unit": "kg"}
+
+def clerk_user(ctx, clerk_id):
+    # The parts of a Clerk user webhook payload the auth endpoints read
+    return {"data": {
+        "id": clerk_id,
+        "first_name": "Bench",
+        "last_name": "Farmer",
+        "email_addresses": [{"id": "idn_bench", "email_address": f"{clerk_id}.{next(ctx.counter)}@bench.example"}],
+        "primary_email_address_id": "idn_bench",
+        "phone_numbers": [],
+        "birthday": "",
+        "gender": "",
+        "profile_image_url": "",
+        "updated_at": int(time.time() * 1000)
+    }}
+
+def created_id(response, key):
+    if response.status_code >= 400:
+        raise RuntimeError(f"Setup request failed, {response.status_code} {response.get_data(as_text=True)}")
+    return response.get_json()["data"][key]
+
+def delete_farm(ctx, rng, client):
+    # Not measured, a farm to delete
+    farm_id, owner = rng.choice(ctx.farms)
+    new_id = created_id(send(ctx, client, "POST", "/farms", owner, farm_body(ctx, rng)), "farmId")
+    return "DELETE", f"/farms/{new_id}", owner, None
+
+def delete_produce(ctx, rng, client):
+    # Not measured, a produce item to delete
+    farm_id, owner = rng.choice(ctx.farms)
+    new_id = created_id(send(ctx, client, "POST", f"/farms/{farm_id}/produce", owner, produce_body(rng)), "produceId")
+    return "DELETE", f"/produce/{new_id}", owner, None
+
+def delete_user(ctx, rng, client):
+    # Not measured, a user to delete
+    clerk_id = f"user_bench_new_{next(ctx.counter)}"
+    send(ctx, client, "POST", "/auth/register", None, clerk_user(ctx, clerk_id))
+    return "POST", "/auth/delete", None, {"data": {"id": clerk_id}}
+
+# Every route, each request is (method, path, clerk id to sign in as, body)
+ROUTES = {
+    "GET /health/live": lambda ctx, rng, client: ("GET", "/health/live", None, None),
+    "GET /health/ready": lambda ctx, rng, client: ("GET", "/health/ready", None, None),
+    "GET /metrics": lambda ctx, rng, client: ("GET", "/metrics", None, None),
+    "GET /auth/cache-stats": lambda ctx, rng, client: ("GET", "/auth/cache-stats", None, None),
+    "GET /farms/cache-stats": lambda ctx, rng, client: ("GET", "/farms/cache-stats", None, None),
+    "GET /categories": lambda ctx, rng, client: ("GET", "/categories", None, None),
+    "POST /auth/register": lambda ctx, rng, client: (
+        "POST", "/auth/register", None, clerk_user(ctx, f"user_bench_new_{next(ctx.counter)}")),
+    "POST /auth/update": lambda ctx, rng, client: ("POST", "/auth/update", None, clerk_user(ctx, rng.choice(ctx.users))),
+    "POST /auth/delete": delete_user,
+    "GET /auth/profile": lambda ctx, rng, client: ("GET", "/auth/profile", rng.choice(ctx.users), None),
+    "GET /my_farms": lambda ctx, rng, client: ("GET", "/my_farms", rng.choice(ctx.farms)[1], None),
+    "GET /farms (location)": lambda ctx, rng, client: (
+        "GET", f"/farms?location={rng.choice(TOWNS)[0].title()},QLD&distance=25", None, None),
+    "GET /farms (location, cursor)": lambda ctx, rng, client: (
+        "GET", f"/farms?location={rng.choice(TOWNS)[0].title()},QLD&distance=25&cursor=", None, None),
+    "GET /farms (text)": lambda ctx, rng, client: ("GET", f"/farms?q={rng.choice(['mango', 'organic', 'honey'])}", None, None),
+    "GET /farms (categories)": lambda ctx, rng, client: (
+        "GET", f"/farms?categories={','.join(rng.sample(CATEGORIES, 2))}", None, None),
+    "POST /farms": lambda ctx, rng, client: ("POST", "/farms", rng.choice(ctx.farms)[1], farm_body(ctx, rng)),
+    "POST /farms/bulk (20 farms)": lambda ctx, rng, client: (
+        "POST", "/farms/bulk", rng.choice(ctx.farms)[1], [farm_body(ctx, rng) for _ in range(20)]),
+    "GET /farms/<id>": lambda ctx, rng, client: ("GET", f"/farms/{rng.choice(ctx.farms)[0]}", None, None),
+    "PUT /farms/<id>": lambda ctx, rng, client: (
+        "PUT", f"/farms/{(farm := rng.choice(ctx.farms))[0]}", farm[1], {"description": f"Updated {next(ctx.counter)}"}),
+    "DELETE /farms/<id>": delete_farm,
+    "GET /farms/<id>/produce": lambda ctx, rng, client: ("GET", f"/farms/{rng.choice(ctx.farms)[0]}/produce", None, None),
+    "POST /farms/<id>/produce": lambda ctx, rng, client: (
+        "POST", f"/farms/{(farm := rng.choice(ctx.farms))[0]}/produce", farm[1], produce_body(rng)),
+    "GET /produce/<id>": lambda ctx, rng, client: ("GET", f"/produce/{rng.choice(ctx.produce)[0]}", None, None),
+    "PUT /produce/<id>": lambda ctx, rng, client: (
+        "PUT", f"/produce/{(produce := rng.choice(ctx.produce))[0]}", produce[1], {"price": round(rng.uniform(1, 40), 2)}),
+    "DELETE /produce/<id>": delete_produce,
+    "POST /farms/<id>/track-view": lambda ctx, rng, client: ("POST", f"/farms/{rng.choice(ctx.farms)[0]}/track-view", None, None),
+    "POST /farms/<id>/track-contact": lambda ctx, rng, client: (
+        "POST", f"/farms/{rng.choice(ctx.farms)[0]}/track-contact", None, None),
+    "GET /farms/<id>/metrics": lambda ctx, rng, client: (
+        "GET", f"/farms/{(farm := rng.choice(ctx.farms))[0]}/metrics?granularity=hour", farm[1], None)
+}
+
+# Relative weights of the routes in each workload
+WORKLOADS = {
+    "read": {
+        "GET /farms (location)": 30, "GET /farms (text)": 10, "GET /farms (categories)": 10,
+        "GET /farms/<id>": 20, "GET /farms/<id>/produce": 5, "GET /produce/<id>": 10, "GET /categories": 5,
+        "POST /farms/<id>/track-view": 8, "GET /my_farms": 2
+    },
+    "mixed": {
+        "GET /farms (location)": 20, "GET /farms (text)": 5, "GET /farms (categories)": 5,
+        "GET /farms/<id>": 15, "GET /produce/<id>": 10, "GET /categories": 5, "GET /my_farms": 5,
+        "POST /farms/<id>/track-view": 10, "POST /farms/<id>/track-contact": 2,
+        "POST /farms": 3, "PUT /farms/<id>": 5, "POST /farms/<id>/produce": 5, "PUT /produce/<id>": 8, "DELETE /produce/<id>": 2
+    },
+    "write": {
+        "POST /farms": 15, "PUT /farms/<id>": 20, "DELETE /farms/<id>": 5, "POST /farms/<id>/produce": 20,
+        "PUT /produce/<id>": 25, "DELETE /produce/<id>": 5, "POST /farms/<id>/track-view": 10
+    }
+}
+
+
+def send(ctx, client, method, path, clerk_id, body):
+    return client.open(path, method=method, headers=ctx.headers(clerk_id), json=body)
+
+
+""" Measurement """
+
+def summary(latencies, errors, seconds):
+    latencies = sorted(latencies)
+    percentile = lambda p: latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1e3 if latencies else None
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / seconds if seconds > 0 else None,
+        "p50": percentile(0.5),
+        "p95": percentile(0.95),
+        "p99": percentile(0.99)
+    }
+
+def print_summary(name, result):
+    print(f"{name:<36} {result['throughput']:>9.1f} req/s  p50 {result['p50']:>8.2f}ms  "
+          f"p95 {result['p95']:>8.2f}ms  p99 {result['p99']:>8.2f}ms  errors {result['errors']}")
+
+def timed_request(ctx, client, route, rng):
+    method, path, clerk_id, body = ROUTES[route](ctx, rng, client)
+    headers = ctx.headers(clerk_id)
+    start = time.perf_counter()
+    response = client.open(path, method=method, headers=headers, json=body)
+    return time.perf_counter() - start, response.status_code < 400
+
+def measure_route(ctx, app, route, requests):
+    """
+        Send requests to one route one after another
+    """
+    client, rng = app.test_client(), random.Random(route)
+    latencies, errors = [], 0
+    for _ in range(requests):
+        latency, ok = timed_request(ctx, client, route, rng)
+        latencies.append(latency)
+        errors += not ok
+    return summary(latencies, errors, sum(latencies))
+
+def run_workload(ctx, app, weights, threads, seconds):
+    """
+        Send requests picked by weight from many threads, returns the overall
+        and per route results
+    """
+    routes, route_weights = list(weights), list(weights.values())
+    results = []
+    stop = time.perf_counter() + seconds
+
+    def worker(thread):
+        client, rng = app.test_client(), random.Random(thread)
+        while time.perf_counter() < stop:
+            route = rng.choices(routes, route_weights)[0]
+            results.append((route, *timed_request(ctx, client, route, rng)))
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+
+    by_route = {route: summary([r[1] for r in results if r[0] == route], sum(not r[2] for r in results if r[0] == route), elapsed)
+                for route in routes}
+    return {"total": summary([r[1] for r in results], sum(not r[2] for r in results), elapsed), "routes": by_route}
+
+def bulk_scenario(ctx, app, count):
+    """
+        Import the same number of farms with one POST /farms/bulk and with one
+        POST /farms per farm
+    """
+    client, rng = app.test_client(), random.Random("bulk")
+    owner = rng.choice(ctx.farms)[1]
+    results = {}
+
+    start = time.perf_counter()
+    errors = sum(send(ctx, client, "POST", "/farms", owner, farm_body(ctx, rng)).status_code >= 400 for _ in range(count))
+    results["single"] = {"farms": count, "seconds": time.perf_counter() - start, "errors": errors}
+
+    start = time.perf_counter()
+    response = send(ctx, client, "POST", "/farms/bulk", owner, [farm_body(ctx, rng) for _ in range(count)])
+    results["bulk"] = {"farms": count, "seconds": time.perf_counter() - start, "errors": int(response.status_code >= 400)}
+
+    for name, result in results.items():
+        result["farmsPerSecond"] = result["farms"] / result["seconds"]
+        print(f"{name + ' import':<36} {result['farmsPerSecond']:>9.1f} farms/s  {result['seconds']:>8.2f}s for {count} farms")
+    return results
+
+def pagination_scenario(ctx, app, requests, deep_page=500):
+    """
+        Compare page 1 and a deep page of GET /my_farms for the owner of the
+        most farms, with offset (page=) and keyset (cursor=) pagination
+    """
+    client = app.test_client()
+    owner = ctx.largest_owner
+    get = lambda path: client.get(path, headers=ctx.headers(owner))
+
+    total = get(f"/my_farms?limit={PAGE_SIZE}").get_json()["data"]["pagination"]["totalItems"]
+    deep_page = max(1, min(deep_page, -(-total // PAGE_SIZE)))
+
+    # Walk the cursor to the deep page, not measured
+    cursor = ""
+    for _ in range(deep_page - 1):
+        cursor = get(f"/my_farms?limit={PAGE_SIZE}&cursor={cursor}").get_json()["data"]["pagination"]["nextCursor"]
+
+    paths = {
+        "offset page 1": f"/my_farms?limit={PAGE_SIZE}&page=1",
+        f"offset page {deep_page}": f"/my_farms?limit={PAGE_SIZE}&page={deep_page}",
+        "keyset page 1": f"/my_farms?limit={PAGE_SIZE}&cursor=",
+        f"keyset page {deep_page}": f"/my_farms?limit={PAGE_SIZE}&cursor={cursor}"
+    }
+    results = {}
+    for name, path in paths.items():
+        latencies, errors = [], 0
+        for _ in range(requests):
+            start = time.perf_counter()
+            errors += get(path).status_code >= 400
+            latencies.append(time.perf_counter() - start)
+        results[name] = summary(latencies, errors, sum(latencies))
+        print_summary(f"/my_farms {name} ({total} farms)", results[name])
+    return results
+
+
+""" Results """
+
+def load_context(client, sign):
+    """
+        Sample the generated farms, produce and addresses the requests use
+    """
+    users = {user["_id"]: user["clerkId"] for user in client.authentication.users.find({}, {"clerkId": 1})}
+    db = client.farm_details
+    farms = [(str(farm["_id"]), users[farm["ownerId"]])
+             for farm in db.farms.aggregate([{"$sample": {"size": 2000}}, {"$project": {"ownerId": 1}}])]
+    owners = dict(farms)
+    produce = [(str(p["_id"]), owners[str(p["farmId"])])
+               for p in db.produce.find({"farmId": {"$in": [ObjectId(farm_id) for farm_id, _ in farms[:500]]}}, {"farmId": 1})]
+    largest_owner = next(db.farms.aggregate([
+        {"$group": {"_id": "$ownerId", "count": {"$sum": 1}}}, {"$sort": {"count": -1}}, {"$limit": 1}
+    ]))["_id"]
+
+    tokens, lock = {}, threading.Lock()
+
+    def headers(clerk_id):
+        if clerk_id is None:
+            return {}
+        with lock:
+            if clerk_id not in tokens:
+                tokens[clerk_id] = sign(clerk_id)
+            return tokens[clerk_id]
+
+    return SimpleNamespace(
+        users=list(users.values())[:1000],
+        farms=farms,
+        produce=produce,
+        addresses=list(db.national_address_file.aggregate([{"$sample": {"size": 1000}}])),
+        largest_owner=users[largest_owner],
+        counter=itertools.count(),
+        headers=headers
+    )
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=API_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(previous, current, path=()):
+    """
+        Print the relative change of every p50, p99 and throughput measurement
+    """
+    for key, value in current.items():
+        if isinstance(value, dict) and isinstance(previous.get(key), dict):
+            compare(previous[key], value, (*path, key))
+        elif key in ("p50", "p99", "throughput", "farmsPerSecond") and previous.get(key) and value is not None:
+            change = (value - previous[key]) / previous[key] * 100
+            print(f"{' / '.join(path):<60} {key:<14} {previous[key]:>10.2f} -> {value:>10.2f}  {change:+6.1f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mongo-uri", required=True)
+    parser.add_argument("--scale", type=int, default=10000, help="Number of addresses, e.g. 10000, 100000 or 1000000")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per route")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=15, help="Duration of each workload")
+    parser.add_argument("--bulk-farms", type=int, default=500)
+    parser.add_argument("--cache", action="store_true", help="Keep the GET /farms response cache enabled")
+    parser.add_argument("--output", help="Save the results to this JSON file")
+    parser.add_argument("--compare", help="Print the change from the results in this JSON file")
+    parser.add_argument("--force", action="store_true", help="Replace existing farm_details and authentication databases")
+    args = parser.parse_args()
+
+    jwks_file = os.path.join(tempfile.mkdtemp(), "jwks.json")
+    sign = make_signer(jwks_file)
+    os.environ.update(mongodb_url=args.mongo_uri, clerk_auth_mode="jwks", clerk_jwks_file=jwks_file,
+                      clerk_secret_key=os.getenv("clerk_secret_key", "sk_test_bench"), search_backend="local",
+                      internal_endpoints="on")
+    if not args.cache:
+        os.environ["farms_cache_ttl"] = "0"
+
+    from app import create_app, client
+
+    start = time.perf_counter()
+    counts = seed(client, args.scale, args.force)
+    print(f"Seeded {counts} in {time.perf_counter() - start:.1f}s")
+
+    # Loads the local search index from the seeded data
+    app = create_app("blocking")
+    ctx = load_context(client, sign)
+
+    results = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "scale": args.scale,
+        "counts": counts,
+        "settings": {key: value for key, value in vars(args).items() if key not in ("mongo_uri", "output", "compare")},
+        "routes": {},
+        "workloads": {},
+        "scenarios": {}
+    }
+
+    try:
+        print("\nRoutes")
+        for route in ROUTES:
+            results["routes"][route] = measure_route(ctx, app, route, args.requests)
+            print_summary(route, results["routes"][route])
+
+        for name, weights in WORKLOADS.items():
+            print(f"\n{name.title()} workload, {args.threads} threads")
+            results["workloads"][name] = run_workload(ctx, app, weights, args.threads, args.seconds)
+            print_summary("total", results["workloads"][name]["total"])
+
+        print("\nScenarios")
+        results["scenarios"]["import"] = bulk_scenario(ctx, app, args.bulk_farms)
+        results["scenarios"]["pagination"] = pagination_scenario(ctx, app, max(args.requests // 4, 10))
+    finally:
+        client.drop_database("farm_details")
+        client.drop_database("authentication")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved the results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print(f"\nChange from {previous.get('commit')} (scale {previous.get('scale')}) to {results['commit']}")
+        compare(previous, results)
@@ -0,0 +1,107 @@
+""" Benchmark - Farm Metrics History
+
+Loads a year of synthetic farm_metrics buckets for 10k farms (hour buckets for
+the retention window, day and month buckets for the rest of the year, as left
+by rollup_metrics.py) into a scratch database on a local mongod, then times
+the range scan GET /farms/<farmId>/metrics runs for each granularity.
+
+Usage:
+    python benchmarks/bench_farm_metrics.py --mongo-uri mongodb://localhost:27017 [--farms 10000] [--queries 500]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import datetime
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from pymongo import MongoClient
+from counters import bucket_start, utc_now
+from rollup_metrics import ensure_indexes
+
+# Query ranges per granularity, matching what an owner dashboard would ask for
+RANGES = {"hour": datetime.timedelta(days=2), "day": datetime.timedelta(days=30), "month": datetime.timedelta(days=365)}
+
+
+def make_buckets(farm_id, now, hour_retention_days, rng):
+    docs = []
+    day_cutoff = bucket_start(now, "day") - datetime.timedelta(days=hour_retention_days)
+
+    # Hour buckets within retention, only for hours with events
+    hour = day_cutoff
+    while hour <= now:
+        if rng.random() < 0.3:
+            docs.append({"farmId": farm_id, "granularity": "hour", "bucket": hour,
+                         "counts": {"profileViews": rng.randint(1, 20), "contactForms": rng.randint(0, 2)}})
+        hour += datetime.timedelta(hours=1)
+
+    # Day buckets for the year, month buckets from them
+    months = {}
+    day = bucket_start(now - datetime.timedelta(days=365), "day")
+    while day <= now:
+        counts = {"profileViews": rng.randint(0, 200), "contactForms": rng.randint(0, 10)}
+        docs.append({"farmId": farm_id, "granularity": "day", "bucket": day, "counts": counts})
+        month = months.setdefault(bucket_start(day, "month"), {"profileViews": 0, "contactForms": 0})
+        for metric, count in counts.items():
+            month[metric] += count
+        day += datetime.timedelta(days=1)
+
+    docs.extend({"farmId": farm_id, "granularity": "month", "bucket": month, "counts": counts}
+                for month, counts in months.items())
+    return docs
+
+
+def query(collection, farm_id, granularity, now):
+    return list(collection.find(
+        {"farmId": farm_id, "granularity": granularity,
+         "bucket": {"$gte": bucket_start(now - RANGES[granularity], granularity), "$lte": now}},
+        {"_id": 0, "bucket": 1, "counts": 1},
+        sort=[("bucket", 1)]
+    ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mongo-uri", required=True)
+    parser.add_argument("--farms", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--hour-retention-days", type=int, default=7)
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo_uri)
+    collection = client.bench_farm_metrics.farm_metrics
+    collection.drop()
+    ensure_indexes(collection)
+
+    rng = random.Random(0)
+    now = utc_now()
+    farm_ids = [ObjectId() for _ in range(args.farms)]
+
+    start = time.perf_counter()
+    for farm_id in farm_ids:
+        collection.insert_many(make_buckets(farm_id, now, args.hour_retention_days, rng), ordered=False)
+    print(f"Loaded {collection.estimated_document_count()} buckets for {args.farms} farms "
+          f"in {time.perf_counter() - start:.1f}s")
+
+    for granularity in RANGES:
+        timings = []
+        for _ in range(args.queries):
+            farm_id = rng.choice(farm_ids)
+            start = time.perf_counter()
+            buckets = query(collection, farm_id, granularity, now)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+
+        plan = collection.find(
+            {"farmId": farm_id, "granularity": granularity, "bucket": {"$gte": now - RANGES[granularity]}}
+        ).explain()["executionStats"]
+        print(f"{granularity:<6} {len(buckets):>4} buckets  mean {statistics.mean(timings)*1e3:>7.2f}ms  "
+              f"p99 {timings[int(len(timings)*0.99)]*1e3:>7.2f}ms  "
+              f"docs examined {plan['totalDocsExamined']}")
+
+    client.drop_database("bench_farm_metrics")
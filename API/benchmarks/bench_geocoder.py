@@ -0,0 +1,105 @@
+""" Benchmark - Geocoding
+
+Measures lookup latency of the memory-mapped geocoder index at each match level
+on a synthetic G-NAF shaped address file. If --mongo-uri is given, the same
+addresses are also geocoded with the national_address_file fallback ladder.
+
+Usage:
+    python benchmarks/bench_geocoder.py [--addresses 1000000] [--lookups 5000] [--mongo-uri mongodb://localhost:27017]
+"""
+
+import os
+import sys
+import csv
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geocoder import Geocoder, build_index
+
+STREET_TYPES = ["ROAD", "STREET", "AVENUE", "DRIVE", "COURT", "CLOSE", "PARADE", "LANE"]
+
+
+def write_addresses(path, count):
+    """
+        Write a synthetic cleaned G-NAF csv, returns a sample of its addresses
+    """
+    random.seed(1)
+    localities = [(f"LOCALITY {i}", 4000 + i % 900) for i in range(3000)]
+    streets = [f"STREET NAME {i} {random.choice(STREET_TYPES)}" for i in range(20000)]
+
+    sample = []
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["address_detail_pid", "street", "city", "state", "zipcode", "latitude", "longitude"])
+        for i in range(count):
+            city, zipcode = random.choice(localities)
+            street = f"{random.randint(1, 300)} {random.choice(streets)}"
+            writer.writerow([f"GAQLD{i}", street, city, "QLD", zipcode, -16.9 - random.random(), 145.7 + random.random()])
+            if i % max(count // 10000, 1) == 0:
+                sample.append((street, city, zipcode, "QLD"))
+    return sample
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    print(f"{name:<28} mean {statistics.mean(timings)*1e6:>10.1f}us  "
+          f"p50 {timings[len(timings)//2]*1e6:>10.1f}us  "
+          f"p99 {timings[int(len(timings)*0.99)]*1e6:>10.1f}us")
+
+
+def bench_index(geocoder, addresses):
+    for level, make_query in [
+        ("street", lambda a: a),
+        ("city", lambda a: ("1 UNKNOWN STREET", a[1], a[2], a[3])),
+        ("zipcode", lambda a: ("1 UNKNOWN STREET", "UNKNOWN", a[2], a[3])),
+    ]:
+        timings = []
+        for address in addresses:
+            query = make_query(address)
+            start = time.perf_counter()
+            _, match_level = geocoder.geocode(*query)
+            timings.append(time.perf_counter() - start)
+            assert match_level == level, (query, match_level)
+        report(f"index ({level})", timings)
+
+
+def bench_mongo(mongo_uri, addresses):
+    from pymongo import MongoClient
+
+    collection = MongoClient(mongo_uri).farm_details.national_address_file
+
+    timings = []
+    for street, city, zipcode, state in addresses:
+        location_query = {"state": state, "zipcode": zipcode, "city": city, "street": street}
+        start = time.perf_counter()
+        while location_query and collection.find_one(location_query) is None:
+            location_query.popitem()
+        timings.append(time.perf_counter() - start)
+    report("mongo ladder", timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--addresses", type=int, default=1000000)
+    parser.add_argument("--lookups", type=int, default=5000)
+    parser.add_argument("--mongo-uri", help="Also benchmark the national_address_file ladder on this server")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "addresses.csv")
+        sample = write_addresses(csv_path, args.addresses)
+        addresses = [random.choice(sample) for _ in range(args.lookups)]
+
+        start = time.perf_counter()
+        build_index(csv_path, os.path.join(tmp, "index"))
+        print(f"Built index of {args.addresses} addresses in {time.perf_counter() - start:.1f}s")
+
+        bench_index(Geocoder(os.path.join(tmp, "index")), addresses)
+
+    if args.mongo_uri:
+        bench_mongo(args.mongo_uri, addresses)
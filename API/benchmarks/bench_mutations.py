@@ -0,0 +1,136 @@
+""" Benchmark - Mutation Round Trips
+
+Counts the database commands each farm and produce mutation sends, using a
+pymongo command listener, and fails if an endpoint goes over its budget. Runs
+the app against a scratch farm_details database on a local mongod, which must
+be a (single node) replica set for the produce transactions, with session
+tokens signed by a local JWKS key. tests/test_mutations.py checks the
+same budgets offline.
+
+Usage:
+    python benchmarks/bench_mutations.py --mongo-uri "mongodb://localhost:27017/?replicaSet=rs0"
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from pymongo import monitoring
+
+# Most commands each request may send, commitTransaction included
+BUDGETS = {
+    "POST /farms": 2,                          # geocode, insert
+    "PUT /farms/<id>": 1,                      # find_one_and_update
+    "PUT /farms/<id> (not owner)": 2,          # find_one_and_update, error lookup
+    "POST /farms/<id>/produce": 3,             # farm update, insert, commit
+    "PUT /produce/<id>": 3,                    # owned farms, find_one_and_update, farm version
+    "PUT /produce/<id> (category)": 5,         # owned farms, find_one_and_update, distinct, farm update, commit
+    "PUT /produce/<id> (not owner)": 3,        # owned farms, find_one_and_update, error lookup
+    "DELETE /produce/<id>": 5,                 # owned farms, find_one_and_delete, distinct, farm update, commit
+    "DELETE /farms/<id>": 1,                   # delete_one
+}
+
+IGNORED_COMMANDS = {"hello", "isMaster", "ismaster", "ping", "endSessions", "buildInfo", "saslStart", "saslContinue"}
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.commands = Counter()
+
+    def started(self, event):
+        if event.database_name == "farm_details" or event.command_name == "commitTransaction":
+            if event.command_name not in IGNORED_COMMANDS:
+                self.commands[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def make_signer(jwks_file):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update({"kid": "ins_bench", "alg": "RS256", "use": "sig"})
+    with open(jwks_file, "w") as f:
+        json.dump({"keys": [jwk]}, f)
+
+    def sign(clerk_id):
+        token = jwt.encode({"sub": clerk_id, "exp": int(time.time()) + 3600, "iat": int(time.time())},
+                           private_key, algorithm="RS256", headers={"kid": "ins_bench"})
+        return {"Authorization": f"Bearer {token}"}
+    return sign
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mongo-uri", required=True)
+    parser.add_argument("--force", action="store_true", help="Replace existing farm_details and authentication databases")
+    args = parser.parse_args()
+
+    jwks_file = os.path.join(tempfile.mkdtemp(), "jwks.json")
+    sign = make_signer(jwks_file)
+    os.environ.update(mongodb_url=args.mongo_uri, clerk_auth_mode="jwks", clerk_jwks_file=jwks_file,
+                      clerk_secret_key=os.getenv("clerk_secret_key", "sk_test_bench"), search_backend="local")
+
+    counter = CommandCounter()
+    monitoring.register(counter)
+
+    from app import app, client
+
+    db = client.farm_details
+    if (db.farms.estimated_document_count() or client.authentication.users.estimated_document_count()) and not args.force:
+        sys.exit("farm_details or authentication already hold data on this server, pass --force to replace them")
+    client.drop_database("farm_details")
+    client.drop_database("authentication")
+    client.authentication.users.insert_many([{"clerkId": "user_owner"}, {"clerkId": "user_other"}])
+    db.national_address_file.insert_one({"street": "1 A ROAD", "city": "CAIRNS", "zipcode": 4870, "state": "QLD",
+                                         "location": {"type": "Point", "coordinates": [145.77, -16.92]}})
+    db.create_collection("farms")
+    db.create_collection("produce")
+
+    test_client = app.test_client()
+    owner, other = sign("user_owner"), sign("user_other")
+
+    # Warm the authentication caches so only the handlers' commands are counted
+    for headers in [owner, other]:
+        test_client.get("/my_farms", headers=headers)
+
+    results = {}
+
+    def measure(name, method, path, headers, body=None, status=None):
+        counter.commands.clear()
+        response = test_client.open(path, method=method, headers=headers, json=body)
+        if status is not None and response.status_code != status:
+            sys.exit(f"{name} returned {response.status_code}, {response.get_data(as_text=True)}")
+        results[name] = sum(counter.commands.values())
+        print(f"{name:<32} {results[name]:>2} commands (budget {BUDGETS[name]})  {dict(counter.commands)}")
+        return response.get_json()
+
+    address = {"street": "1 a road", "city": "cairns", "zipCode": "4870", "state": "qld"}
+    farm_id = measure("POST /farms", "POST", "/farms", owner, {"name": "Bench Farm", "address": address}, 201)["data"]["farmId"]
+    measure("PUT /farms/<id>", "PUT", f"/farms/{farm_id}", owner, {"name": "Renamed Farm"}, 201)
+    measure("PUT /farms/<id> (not owner)", "PUT", f"/farms/{farm_id}", other, {"name": "Stolen Farm"}, 401)
+    produce_id = measure("POST /farms/<id>/produce", "POST", f"/farms/{farm_id}/produce", owner,
+                         {"name": "Mango", "category": "Fruit"}, 201)["data"]["produceId"]
+    measure("PUT /produce/<id>", "PUT", f"/produce/{produce_id}", owner, {"price": 4.5}, 201)
+    measure("PUT /produce/<id> (category)", "PUT", f"/produce/{produce_id}", owner, {"category": "Vegetables"}, 201)
+    measure("PUT /produce/<id> (not owner)", "PUT", f"/produce/{produce_id}", other, {"price": 0}, 401)
+    measure("DELETE /produce/<id>", "DELETE", f"/produce/{produce_id}", owner, None, 201)
+    measure("DELETE /farms/<id>", "DELETE", f"/farms/{farm_id}", owner, None, 200)
+
+    client.drop_database("farm_details")
+    client.drop_database("authentication")
+
+    over = [name for name, count in results.items() if count > BUDGETS[name]]
+    if over:
+        sys.exit(f"Over budget: {', '.join(over)}")
@@ -0,0 +1,102 @@
+""" Benchmark - Farm Search
+
+Measures GET /farms query latency of the search backends on synthetic farms
+around Far North Queensland. The local backend is always measured. The Atlas
+backend is measured too when --mongo-uri points at an Atlas cluster whose
+farm_details database holds the farms (and the farm_text search index).
+
+Usage:
+    python benchmarks/bench_search.py [--farms 10000 100000] [--queries 200] [--mongo-uri <atlas uri>]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from search import LocalSearchBackend, AtlasSearchBackend
+
+CATEGORIES = ["Vegetables", "Fruit", "Herbs", "Dairy", "Eggs", "Meat", "Honey", "Nuts"]
+WORDS = ["mango", "banana", "avocado", "organic", "family", "tropical", "free range", "heritage",
+         "pawpaw", "lychee", "coffee", "cacao", "citrus", "berries", "pineapple", "macadamia"]
+CENTERS = {"CAIRNS": [145.77, -16.92], "MAREEBA": [145.42, -17.0], "INNISFAIL": [146.03, -17.52]}
+
+QUERIES = [
+    {"center": CENTERS["CAIRNS"], "distance_km": 50},
+    {"center": CENTERS["MAREEBA"], "distance_km": 25, "text": "mango"},
+    {"center": CENTERS["INNISFAIL"], "distance_km": 100, "categories": ["Fruit"]},
+    {"text": "organic coffee"},
+    {"categories": ["Honey", "Eggs"]},
+    {"state": "QLD"},
+]
+
+
+def make_data(count):
+    random.seed(count)
+    farms = []
+    produce = []
+    for i in range(count):
+        farm_id = ObjectId()
+        farms.append({
+            "_id": farm_id,
+            "name": f"{random.choice(WORDS).title()} Farm {i}",
+            "description": " ".join(random.sample(WORDS, 4)),
+            "address": {"city": random.choice(list(CENTERS)), "state": "QLD"},
+            "location": {"type": "Point", "coordinates": [144.5 + random.random() * 2.5, -15.5 - random.random() * 3]}
+        })
+        for _ in range(random.randint(1, 8)):
+            produce.append({
+                "_id": ObjectId(),
+                "farmId": farm_id,
+                "name": random.choice(WORDS),
+                # The frontend sends an array of categories, older produce has a single string
+                "category": random.choice([random.choice(CATEGORIES), random.sample(CATEGORIES, random.randint(1, 3))])
+            })
+    return farms, produce
+
+
+def bench(name, backend, db, queries):
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        backend.search(db, skip=0, limit=20, **query)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    print(f"{name:<24} mean {statistics.mean(timings)*1e3:>8.2f}ms  "
+          f"p50 {timings[len(timings)//2]*1e3:>8.2f}ms  "
+          f"p99 {timings[int(len(timings)*0.99)]*1e3:>8.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--farms", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--mongo-uri", help="Also benchmark the Atlas backend on this cluster")
+    args = parser.parse_args()
+
+    queries = [random.choice(QUERIES) for _ in range(args.queries)]
+
+    for count in args.farms:
+        farms, produce = make_data(count)
+
+        # The local backend only needs find() on the two collections to load
+        db = SimpleNamespace(
+            farms=SimpleNamespace(find=lambda: iter(farms)),
+            produce=SimpleNamespace(find=lambda: iter(produce))
+        )
+
+        backend = LocalSearchBackend()
+        start = time.perf_counter()
+        backend.load(db)
+        print(f"{count} farms: built local index in {time.perf_counter() - start:.1f}s")
+        bench(f"local ({count} farms)", backend, db, queries)
+
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        bench("atlas", AtlasSearchBackend(), MongoClient(args.mongo_uri).farm_details, queries)
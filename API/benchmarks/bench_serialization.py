@@ -0,0 +1,132 @@
+""" Benchmark - Response Serialization
+
+Compares the previous recursive mongo_to_dict + Flask's default jsonify with the
+rename-only mongo_to_dict + orjson JSON provider on GET /farms shaped payloads
+(farms with their $lookup-ed produce arrays).
+
+Usage:
+    python benchmarks/bench_serialization.py [--farms 100] [--produce 8] [--iterations 50]
+"""
+
+import os
+import sys
+import copy
+import time
+import random
+import argparse
+import datetime
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from flask import Flask, jsonify
+from encoder import MongoJSONProvider
+
+CATEGORIES = ["Vegetables", "Fruit", "Herbs", "Dairy", "Eggs", "Meat", "Honey", "Nuts"]
+
+
+def legacy_mongo_to_dict(obj, id_name="id"):
+    """ The mongo_to_dict implementation used before the orjson provider """
+    if isinstance(obj, list):
+        return [legacy_mongo_to_dict(item, id_name) for item in obj]
+    if not isinstance(obj, dict):
+        return obj
+    new_doc = {}
+    for key, value in obj.items():
+        if key == '_id':
+            new_doc[id_name] = str(value)
+        elif isinstance(value, ObjectId):
+            new_doc[key] = str(value)
+        elif isinstance(value, datetime.datetime):
+            new_doc[key] = value.timestamp()
+        elif isinstance(value, (dict, list)):
+            new_doc[key] = legacy_mongo_to_dict(value, id_name)
+        else:
+            new_doc[key] = value
+    return new_doc
+
+
+def current_mongo_to_dict(obj, id_name="id"):
+    """ Mirrors mongo_to_dict in app.py without importing the app module """
+    if isinstance(obj, list):
+        for item in obj:
+            current_mongo_to_dict(item, id_name)
+        return obj
+    if not isinstance(obj, dict):
+        return obj
+    if '_id' in obj:
+        obj.setdefault(id_name, str(obj.pop('_id')))
+    for value in obj.values():
+        if isinstance(value, (dict, list)):
+            current_mongo_to_dict(value, id_name)
+    return obj
+
+
+def make_farm(produce_count):
+    now = datetime.datetime.now()
+    farm_id = ObjectId()
+    return {
+        "_id": farm_id,
+        "name": f"Farm {random.randint(1, 100000)}",
+        "description": "Family run farm growing seasonal fruit and vegetables. " * 3,
+        "ownerId": ObjectId(),
+        "address": {
+            "street": "12 MULGRAVE RD",
+            "city": "CAIRNS",
+            "state": "QLD",
+            "zipCode": "4870",
+            "zipCodeInt": 4870
+        },
+        "location": {"type": "Point", "coordinates": [145.7 + random.random(), -16.9 - random.random()]},
+        "contactInfo": {"email": "farm@example.com", "phone": "0400000000", "website": ""},
+        "operatingHours": [{"day": day, "open": "08:00", "close": "17:00"} for day in ["Mon", "Tue", "Wed", "Thu", "Fri"]],
+        "images": ["https://example.com/image.png"],
+        "createdAt": now,
+        "modifiedAt": now,
+        "metrics": {"profileViews": 120, "contactForms": 4, "lastProfileView": now, "lastContactForm": None},
+        "distance": random.random(),
+        "produce": [{
+            "_id": ObjectId(),
+            "farmId": farm_id,
+            "name": f"Produce {i}",
+            "category": random.choice(CATEGORIES),
+            "description": "Freshly picked.",
+            "price": {"amount": 4.5, "unit": "kg"},
+            "minimumOrderQuantity": 1,
+            "availabilityWindows": [{"start": now, "end": now}],
+            "images": [],
+            "createdAt": now,
+            "modifiedAt": now
+        } for i in range(produce_count)]
+    }
+
+
+def bench(name, app, convert, payloads):
+    timings = []
+    with app.app_context():
+        for farms in payloads:
+            start = time.perf_counter()
+            body = jsonify({"success": True, "data": {"farms": [convert(farm, "farmId") for farm in farms]}}).get_data()
+            timings.append(time.perf_counter() - start)
+    print(f"{name:<32} mean {statistics.mean(timings)*1e3:>8.2f}ms  "
+          f"min {min(timings)*1e3:>8.2f}ms  size {len(body)/1024:>7.1f}KiB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--farms", type=int, default=100)
+    parser.add_argument("--produce", type=int, default=8)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    # The current mongo_to_dict updates documents in place so each run gets its own copy
+    page = [make_farm(args.produce) for _ in range(args.farms)]
+    payloads = [copy.deepcopy(page) for _ in range(args.iterations)]
+
+    legacy_app = Flask("legacy")
+    orjson_app = Flask("orjson")
+    orjson_app.json = MongoJSONProvider(orjson_app)
+
+    bench("mongo_to_dict + jsonify (legacy)", legacy_app, legacy_mongo_to_dict, payloads)
+    bench("mongo_to_dict + orjson provider", orjson_app, current_mongo_to_dict, payloads)
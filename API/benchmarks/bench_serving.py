@@ -0,0 +1,153 @@
+""" Benchmark - WSGI vs ASGI Serving
+
+Seeds a scratch farm_details database on a local mongod, starts the API under
+gunicorn (WSGI, threaded workers) and under uvicorn (ASGI, see asgi.py), and
+drives both with 50 to 500 concurrent keep-alive clients requesting farm
+searches, farm and produce details and the categories. Reports requests/sec
+per worker core and latency percentiles.
+
+The local search backend is used as a local mongod has no Atlas Search, and the
+GET /farms response cache is disabled unless --cache is passed.
+
+Usage:
+    python benchmarks/bench_serving.py --mongo-uri mongodb://localhost:27017 [--workers 2] [--clients 50 100 250 500]
+
+The app always reads the farm_details database, which is replaced while the
+benchmark runs and dropped afterwards.
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+import urllib.request
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+
+from pymongo import MongoClient
+from bench_search import make_data, CENTERS
+
+SERVERS = {
+    "wsgi": lambda port, workers: ["gunicorn", "-w", str(workers), "-k", "gthread", "--threads", "16",
+                                   "-b", f"127.0.0.1:{port}", "app:create_app()"],
+    "asgi": lambda port, workers: ["uvicorn", "asgi:asgi_app", "--workers", str(workers),
+                                   "--host", "127.0.0.1", "--port", str(port), "--no-access-log"],
+}
+
+
+def seed(mongo_uri, count, force):
+    # The app always uses the farm_details database, so never replace existing data by accident
+    db = MongoClient(mongo_uri).farm_details
+    if db.farms.estimated_document_count() > 0 and not force:
+        sys.exit("farm_details already holds farms on this server, pass --force to replace them")
+    for name in ["farms", "produce", "national_address_file", "produce_categories"]:
+        db[name].drop()
+
+    farms, produce = make_data(count)
+    db.farms.insert_many(farms)
+    db.produce.insert_many(produce)
+    db.produce.create_index("farmId")
+    db.national_address_file.insert_many([
+        {"city": city, "state": "QLD", "location": {"type": "Point", "coordinates": coordinates}}
+        for city, coordinates in CENTERS.items()
+    ])
+    db.produce_categories.insert_many([{"value": category} for category in sorted({p["category"] for p in produce})])
+
+    return [str(farm["_id"]) for farm in farms], [str(p["_id"]) for p in produce]
+
+
+def request_paths(farm_ids, produce_ids, count=2000):
+    rng = random.Random(0)
+    paths = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.4:
+            paths.append(f"/farms?location={rng.choice(list(CENTERS))},QLD&distance=25&fields=name,location,produceCategories")
+        elif kind < 0.7:
+            paths.append(f"/farms/{rng.choice(farm_ids)}")
+        elif kind < 0.9:
+            paths.append(f"/produce/{rng.choice(produce_ids)}")
+        else:
+            paths.append("/categories")
+    return paths
+
+
+async def client(port, paths, stop, latencies, errors):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    rng = random.Random()
+    try:
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            writer.write(f"GET {rng.choice(paths)} HTTP/1.1\r\nHost: bench\r\n\r\n".encode())
+            status = (await reader.readline()).split()[1]
+            length = 0
+            while (line := await reader.readline()) not in (b"\r\n", b""):
+                name, _, value = line.decode().partition(":")
+                if name.lower() == "content-length":
+                    length = int(value)
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            if status != b"200":
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def load(port, paths, clients, seconds):
+    latencies, errors = [], []
+    stop = time.perf_counter() + seconds
+    await asyncio.gather(*[client(port, paths, stop, latencies, errors) for _ in range(clients)])
+    return sorted(latencies), errors
+
+
+def wait_until_up(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/categories", timeout=1)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("Server did not start")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mongo-uri", required=True)
+    parser.add_argument("--farms", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--clients", type=int, nargs="+", default=[50, 100, 250, 500])
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--cache", action="store_true", help="Keep the GET /farms response cache enabled")
+    parser.add_argument("--force", action="store_true", help="Replace an existing farm_details database")
+    args = parser.parse_args()
+
+    farm_ids, produce_ids = seed(args.mongo_uri, args.farms, args.force)
+    paths = request_paths(farm_ids, produce_ids)
+
+    env = dict(os.environ, mongodb_url=args.mongo_uri, search_backend="local",
+               clerk_secret_key=os.getenv("clerk_secret_key", "sk_test_bench"))
+    if not args.cache:
+        env["farms_cache_ttl"] = "0"
+
+    for name, command in SERVERS.items():
+        server = subprocess.Popen(command(args.port, args.workers), cwd=API_DIR, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_until_up(args.port)
+            for clients in args.clients:
+                latencies, errors = asyncio.run(load(args.port, paths, clients, args.seconds))
+                rate = len(latencies) / args.seconds
+                print(f"{name} {clients:>4} clients  {rate:>8.0f} req/s  {rate / args.workers:>7.0f} req/s/core  "
+                      f"p50 {latencies[len(latencies)//2]*1e3:>7.1f}ms  p99 {latencies[int(len(latencies)*0.99)]*1e3:>7.1f}ms  "
+                      f"errors {len(errors)}")
+        finally:
+            server.terminate()
+            server.wait()
+
+    MongoClient(args.mongo_uri).drop_database("farm_details")
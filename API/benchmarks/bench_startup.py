@@ -0,0 +1,62 @@
+""" Benchmark - Cold Start
+
+Measures, in fresh processes, the time from starting to import the app to its
+first response: the liveness check, and with --mongo-uri also the first ready
+readiness check and the first GET /categories, for each startup_warm_up mode.
+
+Without --mongo-uri the app is pointed at an unreachable server, which shows
+that importing and serving the liveness check do no network I/O.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 5] [--mongo-uri mongodb://localhost:27017]
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter for every measurement
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.create_app(sys.argv[1]).test_client()
+created = time.perf_counter()
+client.get("/health/live")
+timings = {"import": imported - start, "create_app": created - start, "first live": time.perf_counter() - start}
+if sys.argv[2] == "mongo":
+    while client.get("/health/ready").status_code != 200:
+        time.sleep(0.01)
+    timings["first ready"] = time.perf_counter() - start
+    client.get("/categories")
+    timings["first /categories"] = time.perf_counter() - start
+print(json.dumps(timings))
+"""
+
+
+def measure(mode, mongo_uri):
+    env = dict(os.environ, clerk_secret_key=os.getenv("clerk_secret_key", "sk_test_bench"),
+               mongodb_url=mongo_uri or "mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=500")
+    output = subprocess.run([sys.executable, "-c", CHILD, mode, "mongo" if mongo_uri else "none"],
+                            cwd=API_DIR, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--mongo-uri", help="Also measure readiness and a first query against this server")
+    args = parser.parse_args()
+
+    for mode in ["off", "background", "blocking"]:
+        if mode == "blocking" and not args.mongo_uri:
+            continue
+        runs = [measure(mode, args.mongo_uri) for _ in range(args.runs)]
+        summary = "  ".join(f"{name} {statistics.median(run[name] for run in runs)*1e3:>7.1f}ms" for name in runs[0])
+        print(f"{mode:<10} {summary}")
@@ -0,0 +1,215 @@
+""" Benchmark Data Generator
+
+Generates users, farms, produce and a G-NAF shaped national_address_file for
+the endpoint benchmarks, at a scale given as the number of addresses. There is
+one farm for every 10 addresses, one user for every 4 farms and 1 to 8 produce
+per farm. The first user (user_bench_0) owns every other farm, so GET /my_farms
+has deep pages to benchmark. Farms and addresses are spread around real
+Queensland towns, and every farm's address is one of the generated addresses
+so it geocodes.
+
+Generation is seeded, so the same scale always gives the same documents apart
+from their ids.
+
+Usage:
+    python benchmarks/datagen.py --mongo-uri mongodb://localhost:27017 --scale 100000 [--force]
+"""
+
+import os
+import sys
+import random
+import argparse
+import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from indexes import INDEXES, ensure_indexes
+
+# (town, postcode, longitude, latitude)
+TOWNS = [
+    ("CAIRNS", 4870, 145.77, -16.92),
+    ("MAREEBA", 4880, 145.42, -17.00),
+    ("ATHERTON", 4883, 145.48, -17.27),
+    ("INNISFAIL", 4860, 146.03, -17.52),
+    ("MOSSMAN", 4873, 145.37, -16.46),
+    ("TULLY", 4854, 145.92, -17.93),
+    ("TOWNSVILLE", 4810, 146.82, -19.26),
+    ("AYR", 4807, 147.40, -19.57),
+    ("BOWEN", 4805, 148.24, -20.01),
+    ("MACKAY", 4740, 149.19, -21.14),
+    ("ROCKHAMPTON", 4700, 150.51, -23.38),
+    ("EMERALD", 4720, 148.16, -23.53),
+    ("BUNDABERG", 4670, 152.35, -24.87),
+    ("GYMPIE", 4570, 152.67, -26.19),
+    ("NAMBOUR", 4560, 152.96, -26.63),
+    ("TOOWOOMBA", 4350, 151.95, -27.56),
+    ("STANTHORPE", 4380, 151.93, -28.65),
+    ("LAIDLEY", 4341, 152.39, -27.63),
+    ("BEAUDESERT", 4285, 153.00, -27.99),
+    ("BRISBANE", 4000, 153.03, -27.47)
+]
+
+STREET_NAMES = ["MAIN", "MILL", "RIVER", "STATION", "CREEK", "HILL", "MANGO", "CANE", "DAIRY", "ORCHARD",
+                "BANANA", "RANGE", "VALLEY", "BRIDGE", "SCHOOL", "CHURCH", "RAILWAY", "HIGHFIELDS", "PALM", "COAST"]
+STREET_TYPES = ["ROAD", "STREET", "LANE", "AVENUE", "DRIVE", "COURT", "HIGHWAY", "TRACK"]
+
+CATEGORIES = ["Vegetables", "Fruit", "Herbs", "Dairy", "Eggs", "Meat", "Honey", "Nuts", "Grains", "Flowers"]
+PRODUCE = {
+    "Vegetables": ["Pumpkin", "Sweet Potato", "Tomato", "Capsicum", "Zucchini", "Lettuce"],
+    "Fruit": ["Mango", "Banana", "Avocado", "Pawpaw", "Lychee", "Pineapple", "Strawberry"],
+    "Herbs": ["Basil", "Coriander", "Mint", "Lemongrass"],
+    "Dairy": ["Milk", "Cheese", "Yoghurt", "Butter"],
+    "Eggs": ["Free Range Eggs", "Duck Eggs"],
+    "Meat": ["Beef", "Pork", "Lamb", "Chicken"],
+    "Honey": ["Raw Honey", "Honeycomb"],
+    "Nuts": ["Macadamias", "Peanuts", "Pecans"],
+    "Grains": ["Sorghum", "Wheat", "Rice"],
+    "Flowers": ["Sunflowers", "Proteas", "Gerberas"]
+}
+WORDS = ["organic", "family", "tropical", "free range", "heritage", "seasonal", "local", "sustainable",
+         "hydroponic", "pasture raised", "spray free", "biodynamic"]
+
+BATCH_SIZE = 10000
+
+
+def make_address(rng, i):
+    """
+        A national_address_file document near one of the towns
+    """
+    town, postcode, longitude, latitude = TOWNS[i % len(TOWNS)]
+    longitude += rng.uniform(-0.25, 0.25)
+    latitude += rng.uniform(-0.25, 0.25)
+    return {
+        "address_detail_pid": f"GAQLD{i:09d}",
+        "street": f"{rng.randint(1, 999)} {rng.choice(STREET_NAMES)} {rng.choice(STREET_TYPES)}",
+        "city": town,
+        "state": "QLD",
+        "zipcode": postcode,
+        "latitude": latitude,
+        "longitude": longitude,
+        "location": {"type": "Point", "coordinates": [longitude, latitude]}
+    }
+
+def make_user(i):
+    return {
+        "_id": ObjectId(),
+        "clerkId": f"user_bench_{i}",
+        "firstName": "Bench",
+        "lastName": f"Farmer {i}",
+        "email": f"farmer{i}@bench.example",
+        "phoneNumber": "",
+        "createdAt": datetime.datetime(2025, 1, 1),
+        "modifiedAt": datetime.datetime(2025, 1, 1)
+    }
+
+def make_farm(rng, i, owner_id, address):
+    now = datetime.datetime(2025, 1, 1) + datetime.timedelta(minutes=i)
+    return {
+        "_id": ObjectId(),
+        "name": f"{rng.choice(WORDS).title()} {address['city'].title()} Farm {i}",
+        "description": f"{', '.join(rng.sample(WORDS, 3))} produce from {address['city'].title()}",
+        "ownerId": owner_id,
+        "address": {
+            "street": address["street"],
+            "city": address["city"],
+            "state": address["state"],
+            "zipCode": str(address["zipcode"]),
+            "zipCodeInt": address["zipcode"]
+        },
+        "location": address["location"],
+        "produceCategories": [],
+        "metrics": {"profileViews": 0, "contactForms": 0, "lastProfileView": None, "lastContactForm": None},
+        "createdAt": now,
+        "modifiedAt": now,
+        "version": 1
+    }
+
+def make_produce(rng, farm):
+    produce = []
+    for _ in range(rng.randint(1, 8)):
+        category = rng.choice(CATEGORIES)
+        produce.append({
+            "_id": ObjectId(),
+            "farmId": farm["_id"],
+            "name": rng.choice(PRODUCE[category]),
+            "category": category,
+            "price": round(rng.uniform(1, 40), 2),
+            "unit": rng.choice(["kg", "each", "dozen", "bunch"]),
+            "createdAt": farm["createdAt"],
+            "modifiedAt": farm["createdAt"]
+        })
+    farm["produceCategories"] = sorted({p["category"] for p in produce})
+    return produce
+
+
+def generate(scale, seed=0):
+    """
+        Generate the data for a scale, yielding (collection, batch of documents)
+        so large scales are never held in memory at once
+    """
+    rng = random.Random(seed)
+    farm_count = (scale + 9) // 10
+    users = [make_user(i) for i in range(max(farm_count // 4, 1))]
+    yield ("authentication", "users"), users
+
+    addresses, farms, produce = [], [], []
+    for i in range(scale):
+        address = make_address(rng, i)
+        addresses.append(address)
+
+        if i % 10 == 0:
+            farm_number = i // 10
+            owner = users[0] if farm_number % 2 == 0 else users[farm_number // 2 % len(users)]
+            farm = make_farm(rng, farm_number, owner["_id"], address)
+            produce += make_produce(rng, farm)
+            farms.append(farm)
+
+        if len(addresses) == BATCH_SIZE:
+            yield ("farm_details", "national_address_file"), addresses
+            addresses = []
+        if len(farms) >= BATCH_SIZE // 10:
+            yield ("farm_details", "farms"), farms
+            yield ("farm_details", "produce"), produce
+            farms, produce = [], []
+
+    for namespace, batch in [(("farm_details", "national_address_file"), addresses),
+                             (("farm_details", "farms"), farms), (("farm_details", "produce"), produce)]:
+        if batch:
+            yield namespace, batch
+
+    yield ("farm_details", "produce_categories"), [{"value": category} for category in CATEGORIES]
+
+
+def seed(client, scale, force=False, random_seed=0):
+    """
+        Replace the farm_details and authentication databases with generated
+        data and create the declared indexes. Returns the number of documents
+        inserted into each collection.
+    """
+    if not force and (client.farm_details.farms.estimated_document_count()
+                      or client.authentication.users.estimated_document_count()):
+        sys.exit("farm_details or authentication already hold data on this server, pass --force to replace them")
+    client.drop_database("farm_details")
+    client.drop_database("authentication")
+
+    counts = {}
+    for (database, name), batch in generate(scale, random_seed):
+        client[database][name].insert_many(batch, ordered=False)
+        counts[name] = counts.get(name, 0) + len(batch)
+
+    for database, name in INDEXES:
+        ensure_indexes(client[database][name])
+
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mongo-uri", required=True)
+    parser.add_argument("--scale", type=int, default=10000, help="Number of addresses, e.g. 10000, 100000 or 1000000")
+    parser.add_argument("--force", action="store_true", help="Replace existing farm_details and authentication databases")
+    args = parser.parse_args()
+
+    from pymongo import MongoClient
+    print(seed(MongoClient(args.mongo_uri), args.scale, args.force))
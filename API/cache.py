@@ -0,0 +1,231 @@
+""" Caches """
+
+import time
+import bisect
+import threading
+from collections import OrderedDict, defaultdict
+
+
+class TTLCache:
+    """
+        A bounded, thread-safe cache with per-entry expiry and LRU eviction.
+
+        - Entries expire after `ttl` seconds (or a per-entry ttl passed to set).
+        - When `maxsize` is reached the least recently used entry is evicted.
+        - Hit, miss and eviction counters are kept for the stats endpoint.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._counters = defaultdict(int)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                # Expired entries are removed on read
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            # Mark as most recently used
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+
+            # Evict the least recently used entries until we are within bounds
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return None if entry is None else entry[0]
+
+    def pop_matching(self, predicate):
+        """
+            Remove every entry whose value satisfies the predicate.
+
+            Returns the number of entries removed.
+        """
+        with self._lock:
+            keys = [key for key, (value, _) in self._data.items() if predicate(value)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    # Counters are kept apart from the entries so they never expire or get evicted
+    def counter(self, name):
+        with self._lock:
+            return self._counters[name]
+
+    def incr(self, name):
+        with self._lock:
+            self._counters[name] += 1
+            return self._counters[name]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxSize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hitRatio": self.hits / lookups if lookups > 0 else 0.0
+            }
+
+
+class RedisCache:
+    """
+        The TTLCache interface over a Redis compatible server (Redis, Valkey,
+        KeyDB...), so every worker process shares the entries and counters.
+
+        Values must be bytes. Entries expire after `ttl` seconds, and the server
+        should be configured with an LRU maxmemory-policy (e.g. allkeys-lru) to
+        bound its size. Hit and miss counters are kept per process.
+    """
+
+    def __init__(self, url, ttl=60, prefix="cache:"):
+        # Optional dependency, only needed when a cache URL is configured
+        import redis
+
+        self.ttl = ttl
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        value = self._redis.get(self.prefix + str(key))
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl > 0:
+            self._redis.set(self.prefix + str(key), value, ex=ttl)
+
+    def pop(self, key):
+        return self._redis.getdel(self.prefix + str(key))
+
+    def counter(self, name):
+        return int(self._redis.get(self.prefix + "counter:" + name) or 0)
+
+    def incr(self, name):
+        return self._redis.incr(self.prefix + "counter:" + name)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRatio": self.hits / lookups if lookups > 0 else 0.0
+            }
+
+
+def create_cache(url=None, maxsize=1024, ttl=60, prefix="cache:"):
+    """
+        Create a RedisCache when a URL is given, otherwise an in-process TTLCache
+    """
+    if url:
+        return RedisCache(url, ttl=ttl, prefix=prefix)
+    return TTLCache(maxsize=maxsize, ttl=ttl)
+
+
+class GenerationalCache:
+    """
+        Groups the entries of a cache under a generation counter. Writes call
+        invalidate() to move to a new generation, and the entries of older
+        generations are never read again and age out of the backend.
+    """
+
+    def __init__(self, backend, name):
+        self.backend = backend
+        self.name = name
+
+    def generation(self):
+        return self.backend.counter(self.name)
+
+    # Pass the generation read before computing a value to set, so a value
+    # computed while a write invalidated the cache is not stored as current
+    def get(self, key, default=None, generation=None):
+        generation = self.generation() if generation is None else generation
+        return self.backend.get((self.name, generation, key), default)
+
+    def set(self, key, value, ttl=None, generation=None):
+        generation = self.generation() if generation is None else generation
+        self.backend.set((self.name, generation, key), value, ttl)
+
+    def invalidate(self):
+        return self.backend.incr(self.name)
+
+    def stats(self):
+        return {**self.backend.stats(), "generation": self.generation()}
+
+
+class LatencyHistogram:
+    """
+        Counts observed durations in cumulative buckets, like a Prometheus histogram
+    """
+
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self._sum += seconds
+
+    def stats(self):
+        with self._lock:
+            count = sum(self._counts)
+            cumulative, buckets = 0, {}
+            for bound, bucket_count in zip([*self.buckets, "+Inf"], self._counts):
+                cumulative += bucket_count
+                buckets[str(bound)] = cumulative
+            return {
+                "count": count,
+                "sum": self._sum,
+                "mean": self._sum / count if count > 0 else 0.0,
+                "buckets": buckets
+            }
@@ -0,0 +1,48 @@
+""" Lazy Clients """
+
+import os
+import threading
+
+
+class LazyClient:
+    """
+        Stands in for a client object (MongoClient, Clerk...) that is only
+        created on first use, so importing the app does no network I/O.
+
+        - Attribute access is forwarded to the client, creating it if needed.
+        - The client is created again in a forked child process, as MongoClient
+          must not be shared across a fork (e.g. gunicorn --preload).
+    """
+
+    def __init__(self, factory, name="client"):
+        self._factory = factory
+        self._name = name
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        # Fast path without the lock once the client exists in this process
+        client = self._client
+        if client is not None and self._pid == os.getpid():
+            return client
+
+        with self._lock:
+            if self._client is None or self._pid != os.getpid():
+                self._client = self._factory()
+                self._pid = os.getpid()
+            return self._client
+
+    @property
+    def created(self):
+        return self._client is not None and self._pid == os.getpid()
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def __getitem__(self, name):
+        # e.g. client["farm_details"], special methods are not looked up through __getattr__
+        return self.get()[name]
+
+    def __repr__(self):
+        return f"<LazyClient {self._name} {'created' if self.created else 'not created'}>"
@@ -0,0 +1,196 @@
+""" Write-behind Farm Metrics """
+
+import os
+import atexit
+import logging
+import datetime
+import threading
+from collections import defaultdict
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+# The counter and last-seen timestamp fields updated for each tracked metric
+METRIC_FIELDS = {
+    "profileViews": "lastProfileView",
+    "contactForms": "lastContactForm"
+}
+
+# Granularities of the metric history buckets, events are written to hour
+# buckets and rolled up into day and month buckets by rollup_metrics.py
+METRIC_GRANULARITIES = ["hour", "day", "month"]
+
+def bucket_start(dt, granularity):
+    """
+        Truncate a datetime to the start of its hour, day or month bucket
+    """
+    if granularity == "hour":
+        return dt.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "month":
+        return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unknown granularity, {granularity}")
+
+def utc_now():
+    # Naive UTC, the same as the datetimes pymongo returns
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+def new_entry():
+    return {"inc": defaultdict(int), "max": {}, "hours": defaultdict(lambda: defaultdict(int))}
+
+
+class MetricsAggregator:
+    """
+        Buffers farm metric increments in memory and writes them to the farms
+        collection in batches.
+
+        - Increments are summed per farm and metric, the last-seen timestamp
+          keeps the latest value.
+        - A background thread flushes the buffer as one unordered bulk_write
+          every `flush_interval` seconds, or sooner once `max_events` are buffered.
+        - The buffer is flushed when the process exits.
+        - If a history collection is given, the increments of farms that
+          exist are also added to hourly buckets in it (see METRIC_GRANULARITIES).
+    """
+
+    def __init__(self, collection_getter, flush_interval=1.0, max_events=1000, history_getter=None):
+        # The collections are looked up at flush time so the client can be replaced
+        self.collection_getter = collection_getter
+        self.history_getter = history_getter
+        self.flush_interval = flush_interval
+        self.max_events = max_events
+
+        self._lock = threading.Lock()
+        self._buffer = {}
+        self._events = 0
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+        self.flushed_events = 0
+        self.flush_count = 0
+
+        atexit.register(self.flush)
+
+    def _ensure_thread(self):
+        # Start the flusher lazily, and again in a forked worker process
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="metrics-flusher", daemon=True)
+            self._thread.start()
+
+    def increment(self, farm_id, metric, timestamp=None):
+        if metric not in METRIC_FIELDS:
+            raise ValueError(f"Unknown metric, {metric}")
+
+        timestamp = timestamp or datetime.datetime.now()
+        hour = bucket_start(utc_now(), "hour")
+
+        with self._lock:
+            self._ensure_thread()
+
+            entry = self._buffer.get(farm_id)
+            if entry is None:
+                entry = self._buffer[farm_id] = new_entry()
+
+            entry["inc"][metric] += 1
+            entry["hours"][hour][metric] += 1
+            last_field = METRIC_FIELDS[metric]
+            if entry["max"].get(last_field) is None or entry["max"][last_field] < timestamp:
+                entry["max"][last_field] = timestamp
+
+            self._events += 1
+            if self._events >= self.max_events:
+                self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """
+            Write all buffered increments to the database
+        """
+        with self._lock:
+            buffer, self._buffer = self._buffer, {}
+            events, self._events = self._events, 0
+
+        if not buffer:
+            return
+
+        operations = [UpdateOne(
+            {"_id": farm_id},
+            {
+                "$inc": {f"metrics.{metric}": count for metric, count in entry["inc"].items()},
+                "$max": {f"metrics.{field}": value for field, value in entry["max"].items()}
+            }
+        ) for farm_id, entry in buffer.items()]
+
+        try:
+            self.collection_getter().bulk_write(operations, ordered=False)
+            self.flushed_events += events
+            self.flush_count += 1
+        except BulkWriteError as e:
+            # Rejected updates would fail again, so they are dropped rather than retried
+            logger.warning("Dropped %s farm metric updates, %s", len(e.details.get('writeErrors', [])), e)
+            self.flush_count += 1
+        except Exception as e:
+            # Nothing was written (e.g. the connection failed), try again on the next flush
+            logger.warning("Could not flush farm metrics, %s", e)
+            self._restore(buffer)
+            return
+
+        if self.history_getter is not None:
+            self._flush_history(buffer)
+
+    def _flush_history(self, buffer):
+        """
+            Add the flushed increments to the hourly history buckets of the
+            farms that exist. The track endpoints accept any farm id, and the
+            buckets are upserted, so other ids are dropped here.
+        """
+        try:
+            farm_ids = {doc["_id"] for doc in self.collection_getter().find({"_id": {"$in": list(buffer)}}, {"_id": 1})}
+            operations = [UpdateOne(
+                {"farmId": farm_id, "granularity": "hour", "bucket": hour},
+                {"$inc": {f"counts.{metric}": count for metric, count in counts.items()}},
+                upsert=True
+            ) for farm_id, entry in buffer.items() if farm_id in farm_ids for hour, counts in entry["hours"].items()]
+
+            if operations:
+                self.history_getter().bulk_write(operations, ordered=False)
+        except Exception as e:
+            # The lifetime counters are already written, so the history is not retried
+            logger.warning("Could not write farm metrics history, %s", e)
+
+    def _restore(self, buffer):
+        """
+            Merge increments that failed to flush back into the buffer
+        """
+        events = sum(sum(entry["inc"].values()) for entry in buffer.values())
+        with self._lock:
+            for farm_id, entry in buffer.items():
+                current = self._buffer.setdefault(farm_id, new_entry())
+                for metric, count in entry["inc"].items():
+                    current["inc"][metric] += count
+                for hour, counts in entry["hours"].items():
+                    for metric, count in counts.items():
+                        current["hours"][hour][metric] += count
+                for field, value in entry["max"].items():
+                    if current["max"].get(field) is None or current["max"][field] < value:
+                        current["max"][field] = value
+            self._events += events
+
+    def stats(self):
+        with self._lock:
+            return {
+                "bufferedFarms": len(self._buffer),
+                "bufferedEvents": self._events,
+                "flushedEvents": self.flushed_events,
+                "flushes": self.flush_count
+            }
@@ -0,0 +1,164 @@
+""" In-process Street-level Geocoder
+
+Geocodes farm addresses without querying the national_address_file collection.
+
+The index is built once from the cleaned G-NAF addresses, the national_address_file
+Parquet dataset written by G-NAF_DATA_CLEANING.py or a csv export of it, and
+stored as two numpy arrays:
+
+    <prefix>.keys.npy   - sorted, fixed width "STATE|ZIPCODE|CITY|STREET|" keys
+    <prefix>.coords.npy - the matching [longitude, latitude] pairs
+
+Both files are opened memory-mapped, so every worker process shares the same
+pages through the OS page cache instead of holding its own copy. A lookup is a
+binary search for the full key and then for each shorter prefix (city, zipcode,
+state) until one matches.
+
+Usage:
+    python geocoder.py build "../Backend Data Scripts/clean_data/national_address_file" national_address
+    python geocoder.py build QLD_ADDRESS_DETAIL_CLEAN.csv national_address
+    python geocoder.py lookup national_address "12 MULGRAVE ROAD" CAIRNS 4870 QLD
+"""
+
+import re
+import csv
+import sys
+
+import numpy as np
+
+SEPARATOR = "|"
+
+# Match levels, from the most to the least specific
+MATCH_LEVELS = ["street", "city", "zipcode", "state"]
+
+def normalize(value):
+    """
+        Uppercase, trim and collapse whitespace so user input matches G-NAF
+    """
+    if value is None:
+        return ""
+    value = str(value).strip().upper()
+    return re.sub(r"\s+", " ", value).replace(SEPARATOR, " ")
+
+def normalize_zipcode(value):
+    try:
+        return str(int(float(value)))
+    except (ValueError, TypeError):
+        return ""
+
+def make_key(state, zipcode, city, street):
+    fields = [normalize(state), normalize_zipcode(zipcode), normalize(city), normalize(street)]
+    return SEPARATOR.join(fields) + SEPARATOR
+
+def match_levels(state, zipcode, city, street):
+    """
+        Get the fields of each usable match level, most specific first.
+
+        A level is only usable if every field in it was provided, so an
+        address without a zipcode falls back to its state whatever its city
+        and street. The index and the national_address_file queries of the
+        API all use these levels, so an address geocodes the same way on
+        every endpoint.
+    """
+    values = {"state": state, "zipcode": zipcode, "city": city, "street": street}
+    provided = [normalize(state), normalize_zipcode(zipcode), normalize(city), normalize(street)]
+
+    levels = []
+    for level, depth in zip(MATCH_LEVELS, [4, 3, 2, 1]):
+        if all(provided[:depth]):
+            levels.append((level, {field: values[field] for field in list(values)[:depth]}))
+    return levels
+
+def key_prefixes(state, zipcode, city, street):
+    """
+        Get the lookup keys for each match level, most specific first
+    """
+    fields = [normalize(state), normalize_zipcode(zipcode), normalize(city), normalize(street)]
+    return [(level, (SEPARATOR.join(fields[:len(query)]) + SEPARATOR).encode("utf-8"))
+            for level, query in match_levels(state, zipcode, city, street)]
+
+def read_addresses(path):
+    """
+        The rows of cleaned G-NAF addresses, from a csv or a Parquet dataset directory
+    """
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            yield from csv.DictReader(f)
+        return
+
+    # Only needed to build from Parquet, so not a requirement of the API
+    import pyarrow.dataset as ds
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    for batch in dataset.to_batches(columns=["state", "zipcode", "city", "street", "longitude", "latitude"]):
+        yield from batch.to_pylist()
+
+def build_index(path, out_prefix):
+    """
+        Build the sorted key and coordinate arrays from the cleaned G-NAF addresses
+    """
+    keys = []
+    coords = []
+    for row in read_addresses(path):
+        try:
+            coords.append((float(row["longitude"]), float(row["latitude"])))
+        except (ValueError, TypeError):
+            continue
+        keys.append(make_key(row["state"], row["zipcode"], row["city"], row["street"]).encode("utf-8"))
+
+    keys = np.array(keys, dtype=bytes)
+    coords = np.array(coords, dtype=np.float64).reshape(-1, 2)
+
+    # Sort once so lookups can binary search
+    order = np.argsort(keys, kind="stable")
+    np.save(f"{out_prefix}.keys.npy", keys[order])
+    np.save(f"{out_prefix}.coords.npy", coords[order])
+
+    return len(keys)
+
+
+class Geocoder:
+    """
+        Looks up addresses in a memory-mapped index created by build_index
+    """
+
+    def __init__(self, prefix):
+        self.keys = np.load(f"{prefix}.keys.npy", mmap_mode="r")
+        self.coords = np.load(f"{prefix}.coords.npy", mmap_mode="r")
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _prefix_range(self, prefix):
+        """
+            Get the [start, end) range of keys starting with the prefix
+        """
+        start = int(np.searchsorted(self.keys, prefix, side="left"))
+        # Every key sharing the prefix sorts before prefix + 0xff
+        end = int(np.searchsorted(self.keys, prefix + b"\xff", side="left"))
+        return start, end
+
+    def geocode(self, street=None, city=None, zipcode=None, state=None):
+        """
+            Find the best match for an address.
+
+            Returns a tuple of the GeoJSON point and the match level ("street",
+            "city", "zipcode" or "state"), or (None, None) if nothing matched.
+            For the broader levels the middle address of the matching range is used.
+        """
+        for level, prefix in key_prefixes(state, zipcode, city, street):
+            start, end = self._prefix_range(prefix)
+            if start < end:
+                longitude, latitude = self.coords[(start + end - 1) // 2 if level != "street" else start]
+                return {"type": "Point", "coordinates": [float(longitude), float(latitude)]}, level
+        return None, None
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "build":
+        count = build_index(sys.argv[2], sys.argv[3])
+        print(f"Indexed {count} addresses into {sys.argv[3]}.keys.npy and {sys.argv[3]}.coords.npy")
+    elif len(sys.argv) == 7 and sys.argv[1] == "lookup":
+        print(Geocoder(sys.argv[2]).geocode(*sys.argv[3:]))
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,245 @@
+""" Index Definitions
+
+Every index the API's queries rely on, by database and collection, with the
+queries each one serves. QUERY_SHAPES lists a representative of each query the
+API sends, so the plans can be checked after changing a query or an index.
+
+    python indexes.py                 - show how the cluster differs from INDEXES
+    python indexes.py --apply         - create missing indexes and rebuild changed ones
+    python indexes.py --apply --drop-extra
+                                      - also drop indexes that are not declared
+    python indexes.py --search        - include the Atlas Search indexes (Atlas only)
+    python indexes.py --explain       - explain every query shape, exits with 1 if
+                                        any of them scans a whole collection
+
+Usage:
+    python indexes.py [--apply] [--drop-extra] [--search] [--explain] [--mongo-uri <uri>]
+"""
+
+import sys
+import argparse
+import datetime
+
+from bson import ObjectId
+from pymongo import ASCENDING, GEOSPHERE, IndexModel
+from pymongo.errors import OperationFailure
+from pymongo.operations import SearchIndexModel
+
+INDEXES = {
+    ("authentication", "users"): [
+        # clerk_auth_required, /auth/update, /auth/delete and /auth/profile
+        IndexModel([("clerkId", ASCENDING)], name="clerkId_1"),
+        # /auth/register and /auth/update check if the email is already registered
+        IndexModel([("email", ASCENDING)], name="email_1")
+    ],
+    ("farm_details", "farms"): [
+        # GET /my_farms, keyset pages continue on _id
+        IndexModel([("ownerId", ASCENDING), ("_id", ASCENDING)], name="ownerId_1__id_1"),
+        # Category filter of GET /farms, see backfill_produce_categories.py
+        IndexModel([("produceCategories", ASCENDING)], name="produceCategories_1")
+    ],
+    ("farm_details", "produce"): [
+        # GET /farms/<id>/produce, the produce $lookup of searches and GET /farms/<id>,
+        # and the category sync after produce writes
+        IndexModel([("farmId", ASCENDING), ("_id", ASCENDING)], name="farmId_1__id_1")
+    ],
+    ("farm_details", "farm_metrics"): [
+        # Write-behind history upserts, GET /farms/<id>/metrics and the rollup $merge
+        IndexModel([("farmId", ASCENDING), ("granularity", ASCENDING), ("bucket", ASCENDING)],
+                   name="farmId_1_granularity_1_bucket_1", unique=True),
+        # The rollup's source scan and the removal of old buckets
+        IndexModel([("granularity", ASCENDING), ("bucket", ASCENDING)], name="granularity_1_bucket_1")
+    ],
+    ("farm_details", "national_address_file"): [
+        # The geocoding ladder of POST /farms and /farms/bulk, every level is a prefix
+        IndexModel([("state", ASCENDING), ("zipcode", ASCENDING), ("city", ASCENDING), ("street", ASCENDING)],
+                   name="state_1_zipcode_1_city_1_street_1"),
+        # Search centres of GET /farms by zipcode, or zipcode and city
+        IndexModel([("zipcode", ASCENDING), ("city", ASCENDING)], name="zipcode_1_city_1"),
+        # Search centres of GET /farms by city
+        IndexModel([("city", ASCENDING)], name="city_1"),
+        # The G-NAF refresh replaces and retires addresses by their pid, see gnaf_load.py
+        IndexModel([("address_detail_pid", ASCENDING)], name="address_detail_pid_1", unique=True),
+        # Created by G-NAF_DATA_CLEANING.py
+        IndexModel([("location", GEOSPHERE)], name="location_2dsphere")
+    ]
+}
+
+SEARCH_INDEXES = {
+    ("farm_details", "farms"): [
+        # The $search stages of AtlasSearchBackend, text on every field and
+        # geoWithin on the location
+        SearchIndexModel({"mappings": {"dynamic": True, "fields": {"location": {"type": "geo"}}}}, name="farm_text")
+    ]
+}
+
+# Index options that must match for a live index to be the declared one
+COMPARED_OPTIONS = ["unique", "sparse", "partialFilterExpression", "expireAfterSeconds", "collation"]
+
+def ensure_indexes(collection):
+    """
+        Create the declared indexes of a collection, for scripts that write to it
+    """
+    collection.create_indexes(INDEXES[(collection.database.name, collection.name)])
+
+def index_spec(document):
+    return {
+        "key": [(field, direction) for field, direction in document["key"].items()],
+        **{option: document[option] for option in COMPARED_OPTIONS if option in document}
+    }
+
+def diff_indexes(client):
+    """
+        Compare the declared indexes with the cluster's. Returns a list of
+        (database, collection, action, name) where action is "create" (missing),
+        "rebuild" (different keys or options) or "extra" (not declared)
+    """
+    changes = []
+    for (database, name), models in INDEXES.items():
+        live = {index["name"]: index for index in client[database][name].list_indexes()}
+        for model in models:
+            declared = model.document
+            if declared["name"] not in live:
+                changes.append((database, name, "create", declared["name"]))
+            elif index_spec(declared) != index_spec(live[declared["name"]]):
+                changes.append((database, name, "rebuild", declared["name"]))
+
+        declared_names = {model.document["name"] for model in models}
+        changes += [(database, name, "extra", index) for index in live if index != "_id_" and index not in declared_names]
+    return changes
+
+def apply_changes(client, changes, drop_extra=False):
+    """
+        Make the changes found by diff_indexes. Rebuilt indexes are dropped and
+        created again, so queries relying on them scan until the build finishes.
+    """
+    for database, name, action, index in changes:
+        collection = client[database][name]
+        model = next((model for model in INDEXES[(database, name)] if model.document["name"] == index), None)
+        if action == "create":
+            collection.create_indexes([model])
+        elif action == "rebuild":
+            collection.drop_index(index)
+            collection.create_indexes([model])
+        elif action == "extra" and drop_extra:
+            collection.drop_index(index)
+        else:
+            continue
+        print(f"{action:<8} {database}.{name} {index}")
+
+def apply_search_indexes(client, apply=False):
+    """
+        Show, and with apply create or update, the declared Atlas Search indexes
+    """
+    for (database, name), models in SEARCH_INDEXES.items():
+        collection = client[database][name]
+        live = {index["name"]: index for index in collection.list_search_indexes()}
+        for model in models:
+            definition = model.document["definition"]
+            index = model.document["name"]
+            if index not in live:
+                print(f"{'create' if apply else 'missing':<8} {database}.{name} {index} (search)")
+                if apply:
+                    collection.create_search_index(model)
+            # Atlas adds defaults to the definition, so only the declared settings are compared
+            elif {key: live[index].get("latestDefinition", {}).get(key) for key in definition} != definition:
+                print(f"{'update' if apply else 'changed':<8} {database}.{name} {index} (search)")
+                if apply:
+                    collection.update_search_index(index, definition)
+
+
+""" Query Plans """
+
+# (description, database, collection, filter, sort) of every query the API sends
+# outside of the Atlas Search pipelines, and other than plain _id lookups
+EXAMPLE_ID = ObjectId()
+EXAMPLE_TIME = datetime.datetime(2025, 1, 1)
+
+QUERY_SHAPES = [
+    ("session user", "authentication", "users", {"clerkId": "user_example"}, None),
+    ("registered email", "authentication", "users", {"email": "farmer@example.com"}, None),
+    ("my farms", "farm_details", "farms", {"ownerId": EXAMPLE_ID}, None),
+    ("my farms after cursor", "farm_details", "farms", {"ownerId": EXAMPLE_ID, "_id": {"$gt": EXAMPLE_ID}}, [("_id", 1)]),
+    ("farms by category", "farm_details", "farms", {"produceCategories": {"$in": ["Fruit"]}}, None),
+    ("farm produce", "farm_details", "produce", {"farmId": EXAMPLE_ID}, None),
+    ("farm produce after cursor", "farm_details", "produce", {"farmId": EXAMPLE_ID, "_id": {"$gt": EXAMPLE_ID}}, [("_id", 1)]),
+    ("produce lookup", "farm_details", "produce", {"farmId": EXAMPLE_ID}, [("_id", 1)]),
+    ("farm metrics", "farm_details", "farm_metrics",
+     {"farmId": EXAMPLE_ID, "granularity": "day", "bucket": {"$gte": EXAMPLE_TIME, "$lte": EXAMPLE_TIME}}, [("bucket", 1)]),
+    ("metrics rollup", "farm_details", "farm_metrics", {"granularity": "hour"}, None),
+    ("geocode street", "farm_details", "national_address_file",
+     {"state": "QLD", "zipcode": "4870", "city": "CAIRNS", "street": "1 ABBOTT STREET"}, None),
+    ("geocode city", "farm_details", "national_address_file", {"state": "QLD", "zipcode": "4870", "city": "CAIRNS"}, None),
+    ("geocode zipcode", "farm_details", "national_address_file", {"state": "QLD", "zipcode": "4870"}, None),
+    ("geocode state", "farm_details", "national_address_file", {"state": "QLD"}, None),
+    ("centre by city", "farm_details", "national_address_file", {"city": "CAIRNS"}, None),
+    ("centre by zipcode", "farm_details", "national_address_file", {"zipcode": "4870"}, None),
+    ("centre by city and zipcode", "farm_details", "national_address_file", {"city": "CAIRNS", "zipcode": "4870"}, None)
+]
+
+def plan_stages(plan):
+    """
+        Get the stage names of a query plan and all of its input stages
+    """
+    if isinstance(plan, dict):
+        stages = [plan["stage"]] if "stage" in plan else []
+        for value in plan.values():
+            stages += plan_stages(value)
+        return stages
+    if isinstance(plan, list):
+        return [stage for item in plan for stage in plan_stages(item)]
+    return []
+
+def query_plans(client):
+    """
+        Explain every query shape and return the (description, stages) of its winning plan
+    """
+    return [(description, plan_stages(client[database][name].find(filter, sort=sort).explain()["queryPlanner"]["winningPlan"]))
+            for description, database, name, filter, sort in QUERY_SHAPES]
+
+def explain_query_shapes(client):
+    """
+        Explain every query shape and return the (description, stages) of those
+        whose winning plan scans a whole collection
+    """
+    return [(description, stages) for description, stages in query_plans(client) if "COLLSCAN" in stages]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--apply", action="store_true", help="Create missing and rebuild changed indexes")
+    parser.add_argument("--drop-extra", action="store_true", help="With --apply, also drop indexes that are not declared")
+    parser.add_argument("--search", action="store_true", help="Include the Atlas Search indexes")
+    parser.add_argument("--explain", action="store_true", help="Check the query plans instead")
+    parser.add_argument("--mongo-uri", help="Connect to this server instead of the app's cluster")
+    args = parser.parse_args()
+
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        client = MongoClient(args.mongo_uri)
+    else:
+        from app import client
+
+    if args.explain:
+        plans = query_plans(client)
+        for description, stages in plans:
+            print(f"{description:<28} {' <- '.join(dict.fromkeys(stages))}")
+        scans = [description for description, stages in plans if "COLLSCAN" in stages]
+        if scans:
+            sys.exit(f"{len(scans)} queries scan a whole collection: {', '.join(scans)}")
+        sys.exit(0)
+
+    changes = diff_indexes(client)
+    if args.apply:
+        apply_changes(client, changes, drop_extra=args.drop_extra)
+    else:
+        for database, name, action, index in changes:
+            print(f"{action:<8} {database}.{name} {index}")
+        if not changes:
+            print("Indexes match the declared indexes")
+
+    if args.search:
+        try:
+            apply_search_indexes(client, apply=args.apply)
+        except OperationFailure as e:
+            print(f"Could not read the search indexes, they need an Atlas cluster, {e}")
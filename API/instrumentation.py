@@ -0,0 +1,254 @@
+""" Request and MongoDB Instrumentation
+
+Latency histograms per route, MongoDB command durations and counts attributed
+to the request that ran them, and connection pool statistics, rendered in the
+Prometheus text format.
+
+The timings of the current request are kept in a context variable, so the
+pymongo listeners (which run on the thread issuing the command) can add to them
+without knowing about Flask. Work submitted to other threads must be run in a
+copy of the request's context to be attributed, see app.run_concurrently.
+"""
+
+import time
+import threading
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+
+from pymongo import monitoring
+
+from cache import LatencyHistogram
+
+# Buckets of the number of MongoDB commands a request runs
+COMMAND_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50)
+
+# Buckets of the time spent waiting for a pooled connection
+CHECKOUT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+
+class RequestTimings:
+    """
+        Time spent in each part (auth, db, serialization) of one request and the
+        number of MongoDB commands it ran. The db time is the sum of the command
+        durations, so it can exceed the request time when commands run concurrently.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.durations = defaultdict(float)
+        self.commands = 0
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, commands=0):
+        with self._lock:
+            self.durations[name] += seconds
+            self.commands += commands
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self):
+        """
+            Get the value of a Server-Timing header for the request so far
+        """
+        with self._lock:
+            parts = [f"{name};dur={seconds*1e3:.1f}" for name, seconds in self.durations.items()]
+            if self.commands:
+                parts.append(f'db-commands;desc="{self.commands}"')
+        parts.append(f"total;dur={self.elapsed()*1e3:.1f}")
+        return ", ".join(parts)
+
+
+current_timings = contextvars.ContextVar("current_timings", default=None)
+
+@contextmanager
+def track(name):
+    """
+        Add the time spent in the block to the current request's timings, if any
+    """
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+class Metrics:
+    """
+        Process-wide request, MongoDB command and connection pool metrics
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.request_commands = {}
+        self.commands = {}
+        self.checkout_wait = {}
+        self.pool = defaultdict(lambda: defaultdict(int))
+
+    def _histogram(self, family, key, buckets=LatencyHistogram.BUCKETS):
+        histogram = family.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = family.setdefault(key, LatencyHistogram(buckets))
+        return histogram
+
+    def observe_request(self, route, method, status, timings):
+        self._histogram(self.requests, (route, method, str(status))).observe(timings.elapsed())
+        self._histogram(self.request_commands, (route, method), COMMAND_COUNT_BUCKETS).observe(timings.commands)
+
+    def observe_command(self, command, outcome, seconds):
+        self._histogram(self.commands, (command, outcome)).observe(seconds)
+
+    def observe_checkout(self, address, seconds):
+        self._histogram(self.checkout_wait, (address,), CHECKOUT_BUCKETS).observe(seconds)
+
+    def count_pool(self, address, name, delta=1):
+        with self._lock:
+            self.pool[address][name] += delta
+
+    def render(self, lines=None):
+        """
+            Get all metrics in the Prometheus text exposition format, after the
+            already rendered lines if given (see prometheus_samples)
+        """
+        lines = lines if lines is not None else []
+
+        # Copy the families, series may be added while rendering
+        with self._lock:
+            requests, request_commands = dict(self.requests), dict(self.request_commands)
+            commands, checkout_wait = dict(self.commands), dict(self.checkout_wait)
+            pool = {address: dict(counts) for address, counts in self.pool.items()}
+
+        prometheus_histogram(lines, "http_request_duration_seconds", "Request latency by route, method and status",
+                             ("route", "method", "status"), requests)
+        prometheus_histogram(lines, "http_request_mongodb_commands", "MongoDB commands run per request",
+                             ("route", "method"), request_commands)
+        prometheus_histogram(lines, "mongodb_command_duration_seconds", "MongoDB command latency by command and outcome",
+                             ("command", "outcome"), commands)
+        prometheus_histogram(lines, "mongodb_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection",
+                             ("address",), checkout_wait)
+
+        for name, kind, description in [
+            ("open", "gauge", "Open pooled connections"),
+            ("checked_out", "gauge", "Pooled connections in use"),
+            ("checkouts", "counter", "Connections checked out"),
+            ("checkout_failures", "counter", "Connection check outs that failed"),
+            ("clears", "counter", "Times the pool was cleared")
+        ]:
+            prometheus_samples(lines, f"mongodb_pool_{name}{'_total' if kind == 'counter' else ''}", description, kind,
+                               [({"address": address}, counts.get(name, 0)) for address, counts in pool.items()])
+        return "\n".join(lines) + "\n"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels.items()) + "}"
+
+def prometheus_samples(lines, name, description, kind, samples):
+    """
+        Add a counter or gauge family, samples are (labels, value) pairs
+    """
+    lines.append(f"# HELP {name} {description}")
+    lines.append(f"# TYPE {name} {kind}")
+    for labels, value in samples:
+        lines.append(f"{name}{format_labels(labels)} {value}")
+
+def prometheus_histogram(lines, name, description, label_names, histograms):
+    """
+        Add a histogram family from LatencyHistograms keyed by their label values
+    """
+    lines.append(f"# HELP {name} {description}")
+    lines.append(f"# TYPE {name} histogram")
+    for key, histogram in sorted(histograms.items()):
+        labels = dict(zip(label_names, key))
+        stats = histogram.stats()
+        for bound, count in stats["buckets"].items():
+            lines.append(f"{name}_bucket{format_labels({**labels, 'le': bound})} {count}")
+        lines.append(f"{name}_sum{format_labels(labels)} {stats['sum']}")
+        lines.append(f"{name}_count{format_labels(labels)} {stats['count']}")
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """
+        Records MongoDB command durations, and adds them to the current request
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, "ok")
+
+    def failed(self, event):
+        self._record(event, "error")
+
+    def _record(self, event, outcome):
+        seconds = event.duration_micros / 1e6
+        self.metrics.observe_command(event.command_name, outcome, seconds)
+
+        timings = current_timings.get()
+        if timings is not None:
+            timings.add("db", seconds, commands=1)
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """
+        Counts open and checked out connections and check out waits per server
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self.metrics.count_pool(address(event), "clears")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.metrics.count_pool(address(event), "open")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.metrics.count_pool(address(event), "open", -1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self.metrics.count_pool(address(event), "checkout_failures")
+        self.metrics.observe_checkout(address(event), event.duration)
+
+    def connection_checked_out(self, event):
+        self.metrics.count_pool(address(event), "checkouts")
+        self.metrics.count_pool(address(event), "checked_out")
+        self.metrics.observe_checkout(address(event), event.duration)
+
+    def connection_checked_in(self, event):
+        self.metrics.count_pool(address(event), "checked_out", -1)
+
+def address(event):
+    host, port = event.address
+    return f"{host}:{port}"
@@ -0,0 +1,116 @@
+""" Offline Clerk Session Token Verification """
+
+import json
+import time
+import threading
+import urllib.request
+
+import jwt
+
+
+class JWKSKeySet:
+    """
+        Verifies Clerk session JWTs locally against a cached JWKS key set.
+
+        - The key set is fetched once, either from a JWKS url or a local file,
+          and kept in memory.
+        - A token signed with an unknown `kid` (key rotation) triggers a refresh.
+          Refreshes are single-flight: concurrent requests wait on one fetch
+          instead of each calling the JWKS endpoint.
+        - Refreshes for unknown kids are rate limited by `min_refresh_interval`
+          so forged kids cannot be used to hammer the endpoint.
+    """
+
+    def __init__(self, jwks_url=None, jwks_file=None, secret_key=None,
+                 audience=None, authorized_parties=None, leeway=5, min_refresh_interval=30):
+        if jwks_url is None and jwks_file is None:
+            raise ValueError("Either jwks_url or jwks_file must be provided")
+
+        self.jwks_url = jwks_url
+        self.jwks_file = jwks_file
+        self.secret_key = secret_key
+        self.audience = audience
+        self.authorized_parties = authorized_parties
+        self.leeway = leeway
+        self.min_refresh_interval = min_refresh_interval
+
+        self._keys = {}
+        self._last_refresh = None
+        self._lock = threading.Lock()
+        self.refresh_count = 0
+
+    def _fetch(self):
+        """
+            Fetch the raw JWKS document from the configured source
+        """
+        if self.jwks_file is not None:
+            with open(self.jwks_file) as f:
+                return json.load(f)
+
+        req = urllib.request.Request(self.jwks_url)
+        if self.secret_key:
+            req.add_header("Authorization", f"Bearer {self.secret_key}")
+        with urllib.request.urlopen(req, timeout=10) as response:
+            return json.load(response)
+
+    def refresh(self, kid=None):
+        """
+            Reload the key set. If a kid is given the reload is skipped when
+            another thread has already loaded that key while we were waiting.
+        """
+        with self._lock:
+            if kid is not None and kid in self._keys:
+                return
+
+            now = time.monotonic()
+            if self._last_refresh is not None and now - self._last_refresh < self.min_refresh_interval:
+                return
+
+            keys = {}
+            for jwk in self._fetch().get("keys", []):
+                try:
+                    keys[jwk.get("kid")] = jwt.PyJWK(jwk).key
+                except jwt.PyJWKError:
+                    # Skip keys we cannot use (e.g. unsupported algorithms)
+                    continue
+
+            self._keys = keys
+            self._last_refresh = now
+            self.refresh_count += 1
+
+    def get_key(self, kid):
+        key = self._keys.get(kid)
+        if key is None:
+            self.refresh(kid)
+            key = self._keys.get(kid)
+        return key
+
+    def verify(self, token):
+        """
+            Verify the signature, expiry and audience of a session token.
+
+            Returns the claims, raises jwt.InvalidTokenError on failure.
+        """
+        kid = jwt.get_unverified_header(token).get("kid")
+
+        key = self.get_key(kid)
+        if key is None:
+            raise jwt.InvalidTokenError(f"Unknown signing key, {kid}")
+
+        claims = jwt.decode(
+            token,
+            key,
+            algorithms=["RS256"],
+            audience=self.audience,
+            leeway=self.leeway,
+            options={
+                "require": ["exp", "sub"],
+                "verify_aud": self.audience is not None,
+                "verify_iss": False
+            }
+        )
+
+        if self.authorized_parties and claims.get("azp") not in self.authorized_parties:
+            raise jwt.InvalidTokenError(f"Unauthorized party, {claims.get('azp')}")
+
+        return claims
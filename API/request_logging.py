@@ -0,0 +1,246 @@
+""" Structured Request Logging
+
+Log records are put on a bounded queue by the request threads, and formatted
+and written by a logging.handlers.QueueListener thread, so a request never
+waits on log I/O.
+
+- Records are written as JSON lines (or text), with the id and route of the
+  request that logged them. Long messages and fields are truncated.
+- The request id is taken from the X-Request-ID header when it is a simple
+  token, otherwise generated, and returned in the response header.
+- Whether the info and debug records of a request are kept is decided once
+  per request, from per-route sampling rates. Warnings and errors are always kept.
+- When the queue is full records are dropped and counted, never waited for.
+"""
+
+import os
+import re
+import sys
+import uuid
+import copy
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+import threading
+import contextvars
+
+import orjson
+from pymongo import monitoring
+
+# The id, route and sampling decision of the current request
+current_request = contextvars.ContextVar("current_request", default=None)
+
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+def request_id_from(header_value):
+    """
+        Use the caller's request id if it is safe to log, otherwise make one
+    """
+    if header_value and REQUEST_ID_PATTERN.match(header_value):
+        return header_value
+    return uuid.uuid4().hex
+
+def truncate(value, max_length):
+    if isinstance(value, str) and len(value) > max_length:
+        return f"{value[:max_length]}... ({len(value)} characters)"
+    return value
+
+
+class SampleRates:
+    """
+        Fraction of requests whose info and debug records are kept, by
+        "METHOD /route" (e.g. "GET /farms=0.05,POST /farms=1")
+    """
+
+    def __init__(self, default=1.0, rates=None):
+        self.default = default
+        self.rates = rates or {}
+
+    @classmethod
+    def parse(cls, default, value):
+        rates = {}
+        for item in (value or "").split(","):
+            if "=" in item:
+                route, _, rate = item.rpartition("=")
+                rates[route.strip()] = float(rate)
+        return cls(default, rates)
+
+    def sample(self, method, route):
+        rate = self.rates.get(f"{method} {route}", self.default)
+        return rate >= 1 or random.random() < rate
+
+
+class RequestLogFilter(logging.Filter):
+    """
+        Adds the current request's id and route to records, and drops the info
+        and debug records of requests that were not sampled
+    """
+
+    def filter(self, record):
+        context = current_request.get()
+        if context is None:
+            record.request_id = record.route = None
+            return True
+        if record.levelno < logging.WARNING and not context["sampled"]:
+            return False
+        record.request_id = context["id"]
+        record.route = context["route"]
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """
+        Formats a record as one JSON object. Extra fields are passed with
+        logger.info(message, extra={"fields": {...}})
+    """
+
+    def __init__(self, max_length=2000):
+        super().__init__()
+        self.max_length = max_length
+
+    def format(self, record):
+        doc = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": truncate(record.getMessage(), self.max_length)
+        }
+        if getattr(record, "request_id", None):
+            doc["requestId"] = record.request_id
+            doc["route"] = record.route
+        fields = getattr(record, "fields", None)
+        if fields:
+            doc.update({key: truncate(value, self.max_length) for key, value in fields.items()})
+        if record.exc_text:
+            doc["exception"] = truncate(record.exc_text, self.max_length * 4)
+        return orjson.dumps(doc, default=str).decode()
+
+
+class TextFormatter(logging.Formatter):
+    """
+        Formats a record as one line of text, with the id and route of the
+        request that logged it
+    """
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s%(request)s: %(message)s")
+
+    def formatMessage(self, record):
+        request_id = getattr(record, "request_id", None)
+        record.request = f" [{request_id} {record.route}]" if request_id else ""
+        return super().formatMessage(record)
+
+
+class QueueLogListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Wait for room, so stopping with a full queue still writes every queued record
+        self.queue.put(self._sentinel)
+
+
+class QueueLogHandler(logging.handlers.QueueHandler):
+    """
+        Queues records for a QueueLogListener thread that passes them to the
+        target handler. The listener is started lazily, and again in forked
+        worker processes.
+    """
+
+    def __init__(self, target, maxsize=10000, max_length=2000):
+        super().__init__(queue.Queue(maxsize))
+        self.target = target
+        self.max_length = max_length
+        self.dropped = 0
+
+        self.listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+        atexit.register(self.drain)
+
+    def _ensure_listener(self):
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self.listener = QueueLogListener(self.queue, self.target)
+                    self.listener.start()
+                    self._pid = os.getpid()
+
+    def prepare(self, record):
+        # Merge the arguments now, as they may change once the request moves on.
+        # Tracebacks are rendered now, as the listener must not hold on to frames
+        record = copy.copy(record)
+        record.msg = truncate(record.getMessage(), self.max_length)
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        self._ensure_listener()
+        super().emit(record)
+
+    def drain(self):
+        """
+            Write every queued record and stop the listener, e.g. at exit
+        """
+        if self._pid == os.getpid():
+            self.listener.stop()
+            self._pid = None
+        self.target.flush()
+
+
+class CommandLogListener(monitoring.CommandListener):
+    """
+        Logs failed MongoDB commands, and commands slower than slow_ms, with
+        the id of the request that ran them
+    """
+
+    def __init__(self, slow_ms=100, logger=None):
+        self.slow_ms = slow_ms
+        self.logger = logger or logging.getLogger("mongodb")
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        if event.duration_micros >= self.slow_ms * 1000:
+            self.logger.info("Slow MongoDB command", extra={"fields": self._fields(event)})
+
+    def failed(self, event):
+        self.logger.warning("MongoDB command failed", extra={"fields": {**self._fields(event), "failure": event.failure}})
+
+    def _fields(self, event):
+        return {
+            "command": event.command_name,
+            "database": event.database_name,
+            "durationMs": event.duration_micros / 1000,
+            "server": f"{event.connection_id[0]}:{event.connection_id[1]}"
+        }
+
+
+def configure_logging(level="INFO", log_format="json", max_length=2000, queue_size=10000, stream=None):
+    """
+        Send all log records through a QueueLogHandler on the root logger and
+        return the handler
+    """
+    target = logging.StreamHandler(stream or sys.stderr)
+    if log_format == "json":
+        target.setFormatter(JSONFormatter(max_length))
+    else:
+        target.setFormatter(TextFormatter())
+
+    handler = QueueLogHandler(target, queue_size, max_length)
+    handler.addFilter(RequestLogFilter())
+
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
+    return handler
@@ -0,0 +1,81 @@
+""" Farm Metrics Rollup
+
+Compacts the farm_metrics history: hourly buckets are summed into day buckets,
+day buckets into month buckets, and old fine-grained buckets are removed.
+Run it periodically (e.g. hourly from cron). GET /farms/<farmId>/metrics
+answers day and month queries from the rollups, so they lag the hourly
+buckets by at most one run.
+
+Every bucket still holding hours (or days) is rebuilt before any is removed,
+so hours are never removed without being rolled up, even when the job has not
+run for longer than the retention. Whole days (or months) are removed at once,
+so a rebuilt bucket always has all of its hours (or days). Buckets are
+replaced rather than incremented, so running the job again, or after a failed
+run, never counts an event twice.
+
+Usage:
+    python rollup_metrics.py [--hour-retention-days 7] [--day-retention-days 400]
+"""
+
+import argparse
+import datetime
+
+from counters import METRIC_FIELDS, bucket_start, utc_now
+from indexes import ensure_indexes
+
+def rollup(collection, source, target):
+    """
+        Rebuild the target granularity buckets from every kept source bucket
+    """
+    collection.aggregate([
+        {"$match": {"granularity": source}},
+        {"$group": {
+            "_id": {"farmId": "$farmId", "bucket": {"$dateTrunc": {"date": "$bucket", "unit": target}}},
+            **{metric: {"$sum": f"$counts.{metric}"} for metric in METRIC_FIELDS}
+        }},
+        {"$project": {
+            "_id": 0,
+            "farmId": "$_id.farmId",
+            "granularity": target,
+            "bucket": "$_id.bucket",
+            "counts": {metric: f"${metric}" for metric in METRIC_FIELDS}
+        }},
+        {"$merge": {
+            "into": collection.name,
+            "on": ["farmId", "granularity", "bucket"],
+            "whenMatched": "replace",
+            "whenNotMatched": "insert"
+        }}
+    ])
+
+def rollup_metrics(collection, hour_retention_days=7, day_retention_days=400, now=None):
+    now = now or utc_now()
+    ensure_indexes(collection)
+
+    # Every day still holding its hours is rebuilt, then hours are removed by whole days
+    hour_cutoff = bucket_start(now, "day") - datetime.timedelta(days=hour_retention_days)
+    rollup(collection, "hour", "day")
+    hours_removed = collection.delete_many({"granularity": "hour", "bucket": {"$lt": hour_cutoff}}).deleted_count
+
+    # Every month still holding its days is rebuilt, then days are removed by whole months
+    day_cutoff = bucket_start(now - datetime.timedelta(days=day_retention_days), "month")
+    rollup(collection, "day", "month")
+    days_removed = collection.delete_many({"granularity": "day", "bucket": {"$lt": day_cutoff}}).deleted_count
+
+    return hours_removed, days_removed
+
+
+if __name__ == "__main__":
+    from app import client
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hour-retention-days", type=int, default=7)
+    parser.add_argument("--day-retention-days", type=int, default=400)
+    args = parser.parse_args()
+
+    hours_removed, days_removed = rollup_metrics(
+        client.farm_details.farm_metrics,
+        args.hour_retention_days,
+        args.day_retention_days
+    )
+    print(f"Rolled up farm metrics, removed {hours_removed} hour and {days_removed} day buckets")
@@ -0,0 +1,565 @@
+""" Farm Search Backends
+
+GET /farms hands its parsed query to a search backend which returns the total
+number of matching farms and the requested page of farms, each with its produce
+joined in and, for location searches, its distance from the search centre.
+
+    AtlasSearchBackend - the $search aggregation on the farm_text Atlas Search index
+    LocalSearchBackend - an in-process inverted index and spatial grid, for running
+                         and benchmarking without Atlas
+
+Both backends take the same arguments and return the same result shapes.
+"""
+
+import re
+import copy
+import math
+import threading
+from collections import defaultdict
+
+# Most produce joined onto each farm in a search result
+PRODUCE_LOOKUP_LIMIT = 50
+
+def produce_lookup_stage(produce_fields=None, produce_limit=PRODUCE_LOOKUP_LIMIT):
+    """
+        Join the produce of each farm, capped and projected to the requested fields
+    """
+    sub_pipeline = [{"$sort": {"_id": 1}}, {"$limit": produce_limit}]
+    if produce_fields:
+        sub_pipeline.append({"$project": {field: 1 for field in produce_fields}})
+    return {"$lookup": {
+        "from": "produce", "localField": "_id", "foreignField": "farmId", "pipeline": sub_pipeline, "as": "produce"
+    }}
+
+def page_stages(fields, produce_fields, extra_fields=()):
+    """
+        The stages run on the farms of a page only, joining the produce unless
+        the fields leave it out and projecting the farms to the fields
+    """
+    stages = []
+    if fields is None or "produce" in fields:
+        stages.append(produce_lookup_stage(produce_fields))
+    if fields is not None:
+        stages.append({"$project": {field: 1 for field in [*fields, *extra_fields]}})
+    return stages
+
+
+class AtlasSearchBackend:
+    """
+        Searches farms with the Atlas Search farm_text index
+    """
+
+    def search(self, db, center=None, distance_km=50, text=None, categories=None, state=None, skip=0, limit=20,
+               keyset=False, after=None, count=True, fields=None, produce_fields=None):
+        """
+            Get a page of farms matching the query.
+
+            center: [longitude, latitude] to search around, or None
+            distance_km: radius around the center to search in
+            text: free text to match against the farm
+            categories: list of produce categories the farm must sell
+            state: only return farms in this state
+            skip, limit: pagination
+
+            keyset: sort on (distance, _id), (search score, _id) or _id so pages
+                    can be continued from the last result instead of skipped to
+            after: (sort value, _id) of the last farm on the previous page
+            count: whether to count the total matches, only used with keyset
+
+            fields: farm fields to return (dotted paths, "produce" for the joined
+                    produce), or None for the whole farm
+            produce_fields: produce fields to return, or None for the whole produce
+
+            Returns a tuple of the total number of matches (None if not counted),
+            the page of farms, and the (sort value, _id) to continue after if
+            there are more results.
+        """
+        pipeline = []
+
+        # Path A: Location-based search
+        if center is not None:
+            # Search for any farms matching the distance criteria
+            search_stage = {
+                "$search": {
+                    "index": "farm_text",
+                    "compound": {
+                        "filter": [{
+                            "geoWithin": {
+                                "circle": {
+                                    "center": {
+                                        "type": "Point",
+                                        "coordinates": center
+                                    },
+                                    "radius": distance_km * 1000
+                                },
+                                "path": "location"
+                            }
+                        }]
+                    }
+                }
+            }
+
+            # Add the query to match on the query string if provided
+            if text:
+                search_stage["$search"]["compound"]["must"] = [{
+                    "text": {
+                        "query": text,
+                        "path": {"wildcard": "*"}
+                    }
+                }]
+
+            pipeline.append(search_stage)
+
+            # Record the distance between the farm and the provided location
+            pipeline.append({
+                "$addFields": {
+                    "distance": {
+                        "$sqrt": {
+                            "$add": [
+                                { "$pow": [ { "$subtract": [ { "$arrayElemAt": [ "$location.coordinates", 0 ] }, { "$arrayElemAt": [ center, 0 ] } ] }, 2 ] },
+                                { "$pow": [ { "$subtract": [ { "$arrayElemAt": [ "$location.coordinates", 1 ] }, { "$arrayElemAt": [ center, 1 ] } ] }, 2 ] }
+                            ]
+                        }
+                    }
+                }
+            })
+
+            if not keyset:
+                pipeline.append({
+                    "$sort": {"distance": 1}
+                })
+
+        # Path B: Search-only
+        elif text:
+            pipeline.append({
+                '$search': {
+                    "index": "farm_text",
+                    "text": {
+                        "query": text,
+                        "path": {"wildcard": "*"}
+                    }
+                }
+            })
+
+        # Path C: No location, no search
+        else:
+            pass
+
+        # Apply category filter after main search/geo logic, farms keep the
+        # categories of their produce in the indexed produceCategories array
+        match_filter = {}
+        if categories:
+            match_filter['produceCategories'] = {'$in': categories}
+
+        if state:
+            match_filter['address.state'] = state
+
+        if match_filter:
+            pipeline.append({'$match': match_filter})
+
+        # Location searches keep returning the distance
+        extra_fields = ["distance"] if center is not None else []
+
+        if keyset:
+            return self._keyset_page(db, pipeline, center, text, limit, after, count, fields, produce_fields, extra_fields)
+
+        # Add pagination, the produce is only joined for the farms on the page
+        pipeline.append({
+            '$facet': {
+                'metadata': [{'$count': 'totalItems'}],
+                'data': [{'$skip': skip}, {'$limit': limit}, *page_stages(fields, produce_fields, extra_fields)]
+            }
+        })
+
+        # Execute the aggregation
+        result = list(db.farms.aggregate(pipeline, allowDiskUse=True))
+
+        if not result or not result[0]['metadata']:
+            return 0, [], None
+        return result[0]['metadata'][0]['totalItems'], result[0]['data'], None
+
+    def _keyset_page(self, db, pipeline, center, text, limit, after, count, fields, produce_fields, extra_fields):
+        """
+            Finish the search pipeline with a keyset page, continuing after the
+            (sort value, _id) of the previous page
+        """
+        # Sort on the cursor key with _id as a tie breaker
+        if center is not None:
+            sort_field, direction = "distance", 1
+        elif text:
+            pipeline.append({"$addFields": {"searchScore": {"$meta": "searchScore"}}})
+            sort_field, direction = "searchScore", -1
+        else:
+            sort_field, direction = None, 1
+
+        pipeline.append({"$sort": {sort_field: direction, "_id": 1} if sort_field else {"_id": 1}})
+
+        data_stages = []
+        if after is not None:
+            value, after_id = after
+            if sort_field:
+                data_stages.append({"$match": {"$or": [
+                    {sort_field: {"$gt" if direction == 1 else "$lt": value}},
+                    {sort_field: value, "_id": {"$gt": after_id}}
+                ]}})
+            else:
+                data_stages.append({"$match": {"_id": {"$gt": after_id}}})
+
+        # Fetch one extra farm to know if there is another page, and only join
+        # the produce for the farms being returned. The sort value is kept for
+        # the continuation token
+        if sort_field:
+            extra_fields = [*extra_fields, sort_field]
+        data_stages += [{"$limit": limit + 1}, *page_stages(fields, produce_fields, extra_fields)]
+
+        if count:
+            pipeline.append({
+                "$facet": {
+                    "metadata": [{"$count": "totalItems"}],
+                    "data": data_stages
+                }
+            })
+            result = list(db.farms.aggregate(pipeline, allowDiskUse=True))
+            total_items = result[0]['metadata'][0]['totalItems'] if result and result[0]['metadata'] else 0
+            farms = result[0]['data'] if result else []
+        else:
+            total_items = None
+            farms = list(db.farms.aggregate(pipeline + data_stages, allowDiskUse=True))
+
+        next_after = None
+        if len(farms) > limit:
+            farms = farms[:limit]
+            next_after = (farms[-1].get(sort_field) if sort_field else None, farms[-1]["_id"])
+
+        for farm in farms:
+            farm.pop("searchScore", None)
+
+        return total_items, farms, next_after
+
+    # Atlas keeps its own index up to date, so writes need no extra work
+    def load(self, db):
+        pass
+
+    def farm_saved(self, farm):
+        pass
+
+    def farm_deleted(self, farm_id):
+        pass
+
+    def produce_saved(self, produce):
+        pass
+
+    def produce_deleted(self, produce_id):
+        pass
+
+
+""" Local Search Backend """
+
+# Size of a spatial grid cell in degrees (about 55km of latitude)
+GRID_CELL_DEGREES = 0.5
+
+EARTH_RADIUS_KM = 6371.0088
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+def document_text(obj, skip_keys=("_id", "farmId", "ownerId", "location")):
+    """
+        Collect every string value in a document, like a wildcard path does
+    """
+    if isinstance(obj, str):
+        yield obj
+    elif isinstance(obj, dict):
+        for key, value in obj.items():
+            if key not in skip_keys:
+                yield from document_text(value, skip_keys)
+    elif isinstance(obj, list):
+        for value in obj:
+            yield from document_text(value, skip_keys)
+
+def category_list(category):
+    """
+        The categories of a produce item, whose category is a string or an array of strings
+    """
+    if isinstance(category, str):
+        return [category]
+    if isinstance(category, list):
+        return [value for value in category if isinstance(value, str)]
+    return []
+
+def haversine_km(a, b):
+    lon1, lat1, lon2, lat2 = map(math.radians, [a[0], a[1], b[0], b[1]])
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(h)))
+
+def grid_cell(coordinates):
+    return (int(math.floor(coordinates[0] / GRID_CELL_DEGREES)), int(math.floor(coordinates[1] / GRID_CELL_DEGREES)))
+
+def project(doc, fields, keep_id=True):
+    """
+        Copy the given dotted paths of a document (and its _id), like a
+        $project of included fields does
+    """
+    if isinstance(doc, list):
+        return [project(item, fields, False) for item in doc if isinstance(item, (dict, list))]
+
+    result = {"_id": doc["_id"]} if keep_id and "_id" in doc else {}
+    nested = defaultdict(list)
+    for field in fields:
+        key, _, rest = field.partition(".")
+        if key not in doc:
+            continue
+        if rest:
+            nested[key].append(rest)
+        else:
+            result[key] = copy.deepcopy(doc[key])
+
+    for key, rest in nested.items():
+        if key not in result and isinstance(doc[key], (dict, list)):
+            result[key] = project(doc[key], rest, False)
+    return result
+
+
+class LocalSearchBackend:
+    """
+        Searches farms in process with an inverted index over the farm and
+        produce text and a grid index over the farm locations.
+
+        The index is loaded from the database on first use and then kept up to
+        date by the write endpoints calling the farm/produce hooks. Writes made
+        by other processes are only picked up when the index is reloaded.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._reset()
+
+    def _reset(self):
+        self._farms = {}
+        self._produce = defaultdict(dict)
+        self._produce_farm = {}
+        self._farm_tokens = {}
+        self._postings = defaultdict(dict)
+        self._cells = defaultdict(set)
+        self._farm_cell = {}
+
+    def load(self, db):
+        """
+            (Re)build the index from the farms and produce collections
+        """
+        with self._lock:
+            self._reset()
+            for farm in db.farms.find():
+                self._index_farm(farm)
+            for produce in db.produce.find():
+                self._add_produce(produce)
+            for farm_id in self._farms:
+                self._reindex_text(farm_id)
+            self._loaded = True
+
+    def _index_farm(self, farm):
+        farm_id = farm["_id"]
+        self._unindex_location(farm_id)
+        self._farms[farm_id] = farm
+
+        coordinates = (farm.get("location") or {}).get("coordinates")
+        if coordinates:
+            cell = grid_cell(coordinates)
+            self._cells[cell].add(farm_id)
+            self._farm_cell[farm_id] = cell
+
+    def _unindex_location(self, farm_id):
+        cell = self._farm_cell.pop(farm_id, None)
+        if cell is not None:
+            self._cells[cell].discard(farm_id)
+
+    def _add_produce(self, produce):
+        self._remove_produce(produce["_id"])
+        self._produce[produce["farmId"]][produce["_id"]] = produce
+        self._produce_farm[produce["_id"]] = produce["farmId"]
+
+    def _remove_produce(self, produce_id):
+        farm_id = self._produce_farm.pop(produce_id, None)
+        if farm_id is not None:
+            self._produce[farm_id].pop(produce_id, None)
+        return farm_id
+
+    def _reindex_text(self, farm_id):
+        """
+            Rebuild the postings of a farm from its own and its produce text
+        """
+        for token in self._farm_tokens.pop(farm_id, {}):
+            self._postings[token].pop(farm_id, None)
+
+        if farm_id not in self._farms:
+            return
+
+        counts = defaultdict(int)
+        sources = [self._farms[farm_id]] + list(self._produce[farm_id].values())
+        for text in document_text(sources):
+            for token in tokenize(text):
+                counts[token] += 1
+
+        for token, count in counts.items():
+            self._postings[token][farm_id] = count
+        self._farm_tokens[farm_id] = counts
+
+    # The hooks keep their own copy of the documents, the endpoints modify them afterwards
+    def farm_saved(self, farm):
+        with self._lock:
+            if self._loaded:
+                farm = copy.deepcopy(farm)
+                self._index_farm(farm)
+                self._reindex_text(farm["_id"])
+
+    def farm_deleted(self, farm_id):
+        with self._lock:
+            if self._loaded:
+                self._unindex_location(farm_id)
+                self._farms.pop(farm_id, None)
+                self._reindex_text(farm_id)
+
+    def produce_saved(self, produce):
+        with self._lock:
+            if self._loaded:
+                produce = copy.deepcopy(produce)
+                previous_farm_id = self._produce_farm.get(produce["_id"])
+                self._add_produce(produce)
+                for farm_id in {previous_farm_id, produce["farmId"]} - {None}:
+                    self._reindex_text(farm_id)
+
+    def produce_deleted(self, produce_id):
+        with self._lock:
+            if self._loaded:
+                farm_id = self._remove_produce(produce_id)
+                if farm_id is not None:
+                    self._reindex_text(farm_id)
+
+    def _text_scores(self, text):
+        """
+            Score farms matching any token of the query, weighting rare tokens higher
+        """
+        scores = defaultdict(float)
+        farm_count = max(len(self._farms), 1)
+        for token in set(tokenize(text)):
+            postings = self._postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + farm_count / len(postings))
+            for farm_id, count in postings.items():
+                scores[farm_id] += count * idf
+        return scores
+
+    def _nearby(self, center, distance_km):
+        """
+            Get the farms within distance_km of the center, using the grid to
+            avoid checking every farm
+        """
+        lat_span = distance_km / 111.0
+        lon_span = distance_km / max(111.0 * math.cos(math.radians(center[1])), 1e-6)
+        min_x, min_y = grid_cell((center[0] - lon_span, center[1] - lat_span))
+        max_x, max_y = grid_cell((center[0] + lon_span, center[1] + lat_span))
+
+        nearby = []
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                for farm_id in self._cells.get((x, y), ()):
+                    coordinates = self._farms[farm_id]["location"]["coordinates"]
+                    if haversine_km(center, coordinates) <= distance_km:
+                        nearby.append(farm_id)
+        return nearby
+
+    def search(self, db, center=None, distance_km=50, text=None, categories=None, state=None, skip=0, limit=20,
+               keyset=False, after=None, count=True, fields=None, produce_fields=None):
+        """
+            Get a page of farms matching the query, see AtlasSearchBackend.search
+        """
+        if not self._loaded:
+            self.load(db)
+
+        with self._lock:
+            scores = self._text_scores(text) if text else None
+
+            if center is not None:
+                farm_ids = self._nearby(center, distance_km)
+                if scores is not None:
+                    farm_ids = [farm_id for farm_id in farm_ids if farm_id in scores]
+            elif scores is not None:
+                farm_ids = list(scores)
+            else:
+                farm_ids = list(self._farms)
+
+            if categories:
+                categories = set(categories)
+                farm_ids = [farm_id for farm_id in farm_ids if any(
+                    not categories.isdisjoint(category_list(produce.get("category")))
+                    for produce in self._produce[farm_id].values()
+                )]
+
+            if state:
+                farm_ids = [farm_id for farm_id in farm_ids if self._farms[farm_id].get("address", {}).get("state") == state]
+
+            # Match the Atlas ordering: by distance, by relevance, or in insertion order
+            distances = {}
+            if center is not None:
+                for farm_id in farm_ids:
+                    coordinates = self._farms[farm_id]["location"]["coordinates"]
+                    distances[farm_id] = math.sqrt((coordinates[0] - center[0]) ** 2 + (coordinates[1] - center[1]) ** 2)
+                sort_value, sign = distances, 1
+            elif scores is not None:
+                sort_value, sign = scores, -1
+            else:
+                sort_value, sign = None, 1
+
+            if sort_value is not None:
+                sort_key = lambda farm_id: (sign * sort_value[farm_id], farm_id)
+                farm_ids.sort(key=sort_key)
+            elif keyset:
+                sort_key = lambda farm_id: (0, farm_id)
+                farm_ids.sort()
+
+            total_items = len(farm_ids)
+            next_after = None
+            if keyset:
+                # Continue after the last farm of the previous page
+                if after is not None:
+                    after_key = (sign * after[0] if sort_value is not None else 0, after[1])
+                    farm_ids = [farm_id for farm_id in farm_ids if sort_key(farm_id) > after_key]
+
+                if len(farm_ids) > limit:
+                    last_id = farm_ids[limit - 1]
+                    next_after = (sort_value[last_id] if sort_value is not None else None, last_id)
+
+                farm_ids = farm_ids[:limit]
+                skip = 0
+
+            # Copy the page so callers can modify the documents
+            page = []
+            for farm_id in farm_ids[skip:skip + limit]:
+                farm = self._farms[farm_id]
+                farm = project(farm, fields) if fields is not None else copy.deepcopy(farm)
+
+                if fields is None or "produce" in fields:
+                    produce_list = sorted(self._produce[farm_id].values(), key=lambda produce: produce["_id"])
+                    produce_list = produce_list[:PRODUCE_LOOKUP_LIMIT]
+                    farm["produce"] = [
+                        project(produce, produce_fields) if produce_fields else copy.deepcopy(produce)
+                        for produce in produce_list
+                    ]
+
+                if center is not None:
+                    farm["distance"] = distances[farm_id]
+                page.append(farm)
+
+            return total_items if count or not keyset else None, page, next_after
+
+
+def create_search_backend(name):
+    if name == "local":
+        return LocalSearchBackend()
+    if name == "atlas":
+        return AtlasSearchBackend()
+    raise ValueError(f"Unknown search backend, {name}")
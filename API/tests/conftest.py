@@ -0,0 +1,131 @@
+""" Tests
+
+The tests run offline, against mongomock instead of a MongoDB server.
+
+Usage:
+    pip install pytest mongomock
+    python -m pytest tests
+"""
+
+import os
+import sys
+import time
+import uuid
+from types import SimpleNamespace
+from collections import Counter
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The command each collection method sends
+COMMANDS = {
+    "find": "find", "find_one": "find", "aggregate": "aggregate", "distinct": "distinct",
+    "count_documents": "aggregate", "estimated_document_count": "count",
+    "insert_one": "insert", "insert_many": "insert", "bulk_write": "bulkWrite",
+    "update_one": "update", "update_many": "update", "replace_one": "update",
+    "delete_one": "delete", "delete_many": "delete",
+    "find_one_and_update": "findAndModify", "find_one_and_replace": "findAndModify", "find_one_and_delete": "findAndModify"
+}
+
+
+class CountingCollection:
+    """
+        Counts the commands sent through a mongomock collection, as a pymongo
+        command listener would on a server
+    """
+
+    def __init__(self, collection, commands):
+        self._collection = collection
+        self._commands = commands
+
+    def __getattr__(self, name):
+        value = getattr(self._collection, name)
+        if name not in COMMANDS:
+            return value
+
+        def send(*args, **kwargs):
+            self._commands[COMMANDS[name]] += 1
+            return value(*args, **kwargs)
+        return send
+
+class CountingDatabase:
+    def __init__(self, database, commands):
+        self._database = database
+        self._commands = commands
+
+    def __getattr__(self, name):
+        value = getattr(self._database, name)
+        return CountingCollection(value, self._commands) if hasattr(value, "find_one_and_update") else value
+
+    def __getitem__(self, name):
+        return CountingCollection(self._database[name], self._commands)
+
+class CountingClient:
+    def __init__(self, client, commands):
+        self._client = client
+        self._commands = commands
+
+    def __getattr__(self, name):
+        value = getattr(self._client, name)
+        return CountingDatabase(value, self._commands) if hasattr(value, "list_collection_names") else value
+
+    def __getitem__(self, name):
+        return CountingDatabase(self._client[name], self._commands)
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """
+        A test client of the app on a mongomock server, with an owner and
+        another user whose bearer tokens are their Clerk ids. commands counts
+        the commands the requests send.
+    """
+    mongomock = pytest.importorskip("mongomock")
+    import app
+
+    server = mongomock.MongoClient()
+    commands = Counter()
+    monkeypatch.setattr(app, "client", CountingClient(server, commands))
+    monkeypatch.setattr(app, "verify_session_token", lambda token: {"sub": token, "exp": time.time() + 3600})
+
+    def run_in_transaction(callback):
+        # mongomock has no sessions, run the callback on its own and count the commit
+        result = callback(None)
+        commands["commitTransaction"] += 1
+        return result
+    monkeypatch.setattr(app, "run_in_transaction", run_in_transaction)
+
+    # Fresh Clerk ids, so the app's user id cache never holds ids from another test
+    owner, other = f"user_{uuid.uuid4().hex}", f"user_{uuid.uuid4().hex}"
+    server.authentication.users.insert_many([{"clerkId": owner}, {"clerkId": other}])
+
+    return SimpleNamespace(client=app.app.test_client(), db=server.farm_details, commands=commands,
+                           owner={"Authorization": f"Bearer {owner}"}, other={"Authorization": f"Bearer {other}"})
+
+@pytest.fixture
+def farm_id(api):
+    """
+        A farm of the api fixture's owner
+    """
+    response = api.client.post("/farms", headers=api.owner, json={
+        "name": "Test Farm", "address": {"street": "1 a road", "city": "cairns", "zipCode": "4870", "state": "qld"}
+    })
+    assert response.status_code == 201, response.get_data(as_text=True)
+    return response.get_json()["data"]["farmId"]
+
+@pytest.fixture
+def search(api, monkeypatch):
+    """
+        GET /farms on the local search backend and an empty farms cache of its
+        own, for the api fixture's farms
+    """
+    import app
+    from search import LocalSearchBackend
+    from cache import GenerationalCache, TTLCache
+
+    backend = LocalSearchBackend()
+    backend.load(app.client.farm_details)
+    monkeypatch.setattr(app, "search_backend", backend)
+    monkeypatch.setattr(app, "farms_cache", GenerationalCache(TTLCache(ttl=30), "farms"))
+    return backend
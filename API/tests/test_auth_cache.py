@@ -0,0 +1,87 @@
+""" Tests - Authentication Caches
+
+Verified session claims are cached for auth_cache_ttl, but never past the
+token's expiry, and the clerkId -> user_id lookups until /auth/update or
+/auth/delete changes the user.
+"""
+
+import time
+
+import pytest
+
+from cache import TTLCache
+
+
+@pytest.fixture
+def verified(api, monkeypatch):
+    """
+        The tokens verified with Clerk, with the exp of their claims in exp
+    """
+    import app
+
+    monkeypatch.setattr(app, "claims_cache", TTLCache(ttl=60))
+    tokens, exp = [], {}
+
+    def verify_session_token(token):
+        tokens.append(token)
+        return {"sub": token, "exp": exp.get(token, time.time() + 3600)}
+    monkeypatch.setattr(app, "verify_session_token", verify_session_token)
+    return tokens, exp
+
+def clerk_id(headers):
+    return headers["Authorization"].split()[1]
+
+
+def test_claims_are_cached_until_the_auth_cache_ttl(api, verified, monkeypatch):
+    import app
+
+    tokens, _ = verified
+    monkeypatch.setattr(app, "auth_cache_ttl", 0.2)
+    api.client.get("/my_farms", headers=api.owner)
+    api.client.get("/my_farms", headers=api.owner)
+    assert len(tokens) == 1
+
+    time.sleep(0.25)
+    api.client.get("/my_farms", headers=api.owner)
+    assert len(tokens) == 2
+
+def test_claims_are_cached_until_the_token_expires(api, verified):
+    tokens, exp = verified
+    exp[clerk_id(api.owner)] = time.time() + 0.2
+    api.client.get("/my_farms", headers=api.owner)
+    api.client.get("/my_farms", headers=api.owner)
+    assert len(tokens) == 1
+
+    time.sleep(0.25)
+    api.client.get("/my_farms", headers=api.owner)
+    assert len(tokens) == 2
+
+def test_updated_users_are_looked_up_again(api):
+    import app
+
+    assert api.client.get("/my_farms", headers=api.owner).status_code == 200
+    assert app.user_id_cache.get(clerk_id(api.owner)) is not None
+
+    response = api.client.post("/auth/update", json={"data": {
+        "id": clerk_id(api.owner), "first_name": "Updated", "email_addresses": [], "updated_at": time.time() * 1000
+    }})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    assert app.user_id_cache.get(clerk_id(api.owner)) is None
+
+def test_deleted_users_are_rejected(api):
+    assert api.client.get("/my_farms", headers=api.owner).status_code == 200
+
+    response = api.client.post("/auth/delete", json={"data": {"id": clerk_id(api.owner)}})
+    assert response.status_code == 200, response.get_data(as_text=True)
+
+    assert api.client.get("/my_farms", headers=api.owner).status_code == 401
+
+def test_cache_stats_are_internal(api, monkeypatch):
+    import app
+
+    for path in ["/auth/cache-stats", "/farms/cache-stats"]:
+        assert api.client.get(path).status_code == 403
+
+    monkeypatch.setattr(app, "internal_endpoints", True)
+    for path in ["/auth/cache-stats", "/farms/cache-stats"]:
+        assert api.client.get(path).status_code == 200
@@ -0,0 +1,69 @@
+""" Tests - Conditional Requests
+
+GET /farms/<farmId> and GET /categories send ETag (and Last-Modified)
+validators, and answer a request whose validators still match with an empty
+304. Writes bump the version the ETag is built from.
+"""
+
+from bson import ObjectId
+
+
+def assert_not_modified(response, cache_control):
+    assert response.status_code == 304
+    assert response.get_data() == b""
+    assert response.headers["Cache-Control"] == cache_control
+    assert response.headers["ETag"]
+
+def test_farm_matching_validators_are_not_modified(api, farm_id):
+    response = api.client.get(f"/farms/{farm_id}")
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "no-cache"
+    etag, last_modified = response.headers["ETag"], response.headers["Last-Modified"]
+
+    assert_not_modified(api.client.get(f"/farms/{farm_id}", headers={"If-None-Match": etag}), "no-cache")
+    assert_not_modified(api.client.get(f"/farms/{farm_id}", headers={"If-Modified-Since": last_modified}), "no-cache")
+
+    # If-None-Match takes precedence over If-Modified-Since
+    response = api.client.get(f"/farms/{farm_id}", headers={"If-None-Match": '"other"', "If-Modified-Since": last_modified})
+    assert response.status_code == 200
+
+def test_farm_and_produce_updates_change_the_etag(api, farm_id):
+    response = api.client.post(f"/farms/{farm_id}/produce", headers=api.owner, json={"name": "Mango"})
+    produce_id = response.get_json()["data"]["produceId"]
+    etag = api.client.get(f"/farms/{farm_id}").headers["ETag"]
+
+    api.client.put(f"/farms/{farm_id}", headers=api.owner, json={"name": "Renamed Farm"})
+    response = api.client.get(f"/farms/{farm_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.get_json()["data"]["name"] == "Renamed Farm"
+    etag = response.headers["ETag"]
+
+    # The produce's version is bumped, and its farm's, as GET /farms/<farmId> includes the produce
+    api.client.put(f"/produce/{produce_id}", headers=api.owner, json={"name": "Mangoes"})
+    assert api.db.produce.find_one({"_id": ObjectId(produce_id)})["version"] == 1
+    response = api.client.get(f"/farms/{farm_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.get_json()["data"]["produce"][0]["name"] == "Mangoes"
+
+def test_categories_matching_etag_is_not_modified(api, monkeypatch):
+    import app
+    from cache import TTLCache
+
+    monkeypatch.setattr(app, "categories_cache", TTLCache(maxsize=1, ttl=60))
+    api.db.produce_categories.insert_many([{"value": "Fruit"}, {"value": "Vegetables"}])
+    response = api.client.get("/categories")
+    assert response.status_code == 200
+    cache_control = f"public, max-age={app.categories_max_age}"
+    assert response.headers["Cache-Control"] == cache_control
+
+    # Answered without reading the collection
+    api.commands.clear()
+    assert_not_modified(api.client.get("/categories", headers={"If-None-Match": response.headers["ETag"]}), cache_control)
+    assert sum(api.commands.values()) == 0
+
+    # Read again once the cached categories expire
+    api.db.produce_categories.insert_one({"value": "Honey"})
+    app.categories_cache.clear()
+    response = api.client.get("/categories", headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 200
+    assert response.get_json()["data"]["categories"] == ["Fruit", "Vegetables", "Honey"]
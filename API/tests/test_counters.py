@@ -0,0 +1,48 @@
+""" Tests - Farm Metrics
+
+The track endpoints accept any well formed farm id, so the history buckets,
+which are upserted, must only be written for farms that exist.
+"""
+
+from bson import ObjectId
+
+from counters import MetricsAggregator
+
+
+class Collection:
+    """
+        Records bulk writes, and finds the farms with the given ids
+    """
+
+    def __init__(self, ids=()):
+        self.ids = set(ids)
+        self.writes = []
+
+    def find(self, filter, projection=None):
+        return [{"_id": farm_id} for farm_id in filter["_id"]["$in"] if farm_id in self.ids]
+
+    def bulk_write(self, operations, ordered=True):
+        self.writes.append(operations)
+
+
+def test_history_is_only_written_for_existing_farms():
+    farm, missing = ObjectId(), ObjectId()
+    farms, history = Collection([farm]), Collection()
+    aggregator = MetricsAggregator(lambda: farms, flush_interval=3600, history_getter=lambda: history)
+
+    for farm_id in [farm, farm, missing]:
+        aggregator.increment(farm_id, "profileViews")
+    aggregator.flush()
+
+    [operations] = history.writes
+    assert [operation._filter["farmId"] for operation in operations] == [farm]
+    assert operations[0]._doc == {"$inc": {"counts.profileViews": 2}}
+
+def test_no_history_is_written_for_unknown_farms_only():
+    farms, history = Collection(), Collection()
+    aggregator = MetricsAggregator(lambda: farms, flush_interval=3600, history_getter=lambda: history)
+
+    aggregator.increment(ObjectId(), "contactForms")
+    aggregator.flush()
+
+    assert history.writes == []
@@ -0,0 +1,68 @@
+""" Tests - GET /farms Cache
+
+GET /farms responses are cached, every farm or produce write moves the cache
+to a new generation. Another worker's writes only reach a process-local cache
+once its entries expire, a shared cache sees them at once.
+"""
+
+import time
+
+from cache import GenerationalCache, TTLCache
+
+
+def farm_names(api):
+    return [farm["name"] for farm in api.client.get("/farms").get_json()["data"]["farms"]]
+
+def produce_names(api):
+    return [produce["name"] for farm in api.client.get("/farms").get_json()["data"]["farms"] for produce in farm["produce"]]
+
+def test_writes_invalidate_the_cached_farms(api, search, farm_id):
+    assert farm_names(api) == ["Test Farm"]
+    api.commands.clear()
+    assert farm_names(api) == ["Test Farm"]
+    assert sum(api.commands.values()) == 0
+
+    api.client.put(f"/farms/{farm_id}", headers=api.owner, json={"name": "Renamed Farm"})
+    assert farm_names(api) == ["Renamed Farm"]
+
+    response = api.client.post(f"/farms/{farm_id}/produce", headers=api.owner, json={"name": "Mango"})
+    produce_id = response.get_json()["data"]["produceId"]
+    assert produce_names(api) == ["Mango"]
+
+    api.client.put(f"/produce/{produce_id}", headers=api.owner, json={"name": "Mangoes"})
+    assert produce_names(api) == ["Mangoes"]
+
+    api.client.delete(f"/produce/{produce_id}", headers=api.owner)
+    assert produce_names(api) == []
+
+    api.client.delete(f"/farms/{farm_id}", headers=api.owner)
+    assert farm_names(api) == []
+
+def test_other_workers_writes_are_seen_once_entries_expire(api, search, farm_id, monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, "farms_cache", GenerationalCache(TTLCache(ttl=0.2), "farms"))
+    assert farm_names(api) == ["Test Farm"]
+
+    # Another worker renames the farm, invalidating its own process-local cache only
+    farms_cache = app.farms_cache
+    monkeypatch.setattr(app, "farms_cache", GenerationalCache(TTLCache(ttl=30), "farms"))
+    api.client.put(f"/farms/{farm_id}", headers=api.owner, json={"name": "Renamed Farm"})
+    monkeypatch.setattr(app, "farms_cache", farms_cache)
+
+    assert farm_names(api) == ["Test Farm"]
+    time.sleep(0.25)
+    assert farm_names(api) == ["Renamed Farm"]
+
+def test_shared_cache_sees_other_workers_writes(api, search, farm_id, monkeypatch):
+    import app
+
+    # Two workers on one shared backend, e.g. Redis with farms_cache_url
+    shared = TTLCache(ttl=30)
+    monkeypatch.setattr(app, "farms_cache", GenerationalCache(shared, "farms"))
+    assert farm_names(api) == ["Test Farm"]
+
+    GenerationalCache(shared, "farms").invalidate()
+    api.db.farms.update_one({}, {"$set": {"name": "Renamed Farm"}})
+    search.load(api.db)
+    assert farm_names(api) == ["Renamed Farm"]
@@ -0,0 +1,77 @@
+""" Tests - Geocoding
+
+The single address, batch and index geocoders must fall back the same way on
+partial addresses, so a farm's location doesn't depend on the endpoint it was
+created with.
+"""
+
+import os
+import csv
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+import app
+from geocoder import Geocoder, build_index
+
+ADDRESSES = [
+    {"street": "12 MULGRAVE ROAD", "city": "CAIRNS", "zipcode": 4870, "state": "QLD", "coordinates": [145.1, -16.1]},
+    {"street": "5 SHERIDAN STREET", "city": "CAIRNS", "zipcode": 4870, "state": "QLD", "coordinates": [145.2, -16.2]},
+    {"street": "1 BYRNES STREET", "city": "MAREEBA", "zipcode": 4880, "state": "QLD", "coordinates": [145.3, -17.0]},
+]
+
+# (street, city, zipcode, state) and the level every path must match it at
+QUERIES = [
+    (("12 MULGRAVE ROAD", "CAIRNS", 4870, "QLD"), "street"),
+    (("99 UNKNOWN ROAD", "CAIRNS", 4870, "QLD"), "city"),
+    ((None, "CAIRNS", 4870, "QLD"), "city"),
+    (("12 MULGRAVE ROAD", None, 4870, "QLD"), "zipcode"),
+    (("12 MULGRAVE ROAD", "CAIRNS", None, "QLD"), "state"),
+    (("12 MULGRAVE ROAD", "CAIRNS", 9999, "QLD"), "state"),
+    ((None, None, None, "QLD"), "state"),
+    (("12 MULGRAVE ROAD", "CAIRNS", 4870, None), None),
+]
+
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient().farm_details
+    db.national_address_file.insert_many([
+        {**{key: value for key, value in address.items() if key != "coordinates"},
+         "location": {"type": "Point", "coordinates": address["coordinates"]}}
+        for address in ADDRESSES
+    ])
+    return db
+
+@pytest.fixture
+def index(tmp_path):
+    path = os.path.join(tmp_path, "addresses.csv")
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["address_detail_pid", "street", "city", "state", "zipcode", "latitude", "longitude"])
+        for i, address in enumerate(ADDRESSES):
+            longitude, latitude = address["coordinates"]
+            writer.writerow([f"GAQLD{i}", address["street"], address["city"], address["state"], address["zipcode"], latitude, longitude])
+    build_index(path, os.path.join(tmp_path, "index"))
+    return Geocoder(os.path.join(tmp_path, "index"))
+
+
+def test_paths_match_at_the_same_level(db, index, monkeypatch):
+    monkeypatch.setattr(app, "geocoder", None)
+    single = [app.locate_address(db, *query) for query, _ in QUERIES]
+    batch = app.locate_addresses(db, [dict(zip(["street", "city", "zipcode", "state"], query)) for query, _ in QUERIES])
+
+    monkeypatch.setattr(app, "geocoder", index)
+    indexed = [app.locate_address(db, *query) for query, _ in QUERIES]
+
+    for (query, level), single_result, batch_result, index_result in zip(QUERIES, single, batch, indexed):
+        assert single_result[1] == batch_result[1] == index_result[1] == level, query
+        if level == "street":
+            assert single_result[0] == batch_result[0] == index_result[0], query
+
+def test_unmatched_addresses_geocode_to_origin(db, monkeypatch):
+    monkeypatch.setattr(app, "geocoder", None)
+    origin = {"type": "Point", "coordinates": [0.0, 0.0]}
+    assert app.geocode_address(db, "12 MULGRAVE ROAD", "CAIRNS", 4870, None) == origin
+    assert app.geocode_addresses(db, [{"street": "12 MULGRAVE ROAD", "city": "CAIRNS", "zipcode": 4870}]) == [origin]
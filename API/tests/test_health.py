@@ -0,0 +1,26 @@
+""" Tests - Health Checks """
+
+import time
+
+from clients import LazyClient
+
+
+def test_readiness_gives_up_after_its_timeout(monkeypatch):
+    import app
+
+    # Nothing listens on port 1, the ping fails once server selection times out
+    monkeypatch.setattr(app, "uri", "mongodb://127.0.0.1:1")
+    monkeypatch.setattr(app, "readiness_timeout", 0.2)
+    monkeypatch.setattr(app, "readiness_client", LazyClient(app.create_readiness_client))
+
+    start = time.perf_counter()
+    response = app.app.test_client().get("/health/ready")
+    assert response.status_code == 503
+    assert response.get_json()["data"]["checks"]["mongodb"] == "unavailable"
+    assert time.perf_counter() - start < 2
+
+def test_importing_the_app_leaves_logging_alone():
+    import app
+
+    # Configured by create_app, which the tests never call
+    assert app.log_handler is None
@@ -0,0 +1,31 @@
+""" Tests - Query Plans
+
+Every query shape of indexes.py uses an index. Needs a MongoDB server, as
+mongomock has no query planner:
+
+    MONGODB_TEST_URI=mongodb://localhost:27017 python -m pytest tests/test_indexes.py
+
+The indexes are created in the server's authentication and farm_details databases.
+"""
+
+import os
+
+import pytest
+
+from indexes import INDEXES, explain_query_shapes
+
+
+@pytest.fixture(scope="module")
+def client():
+    if not os.getenv("MONGODB_TEST_URI"):
+        pytest.skip("MONGODB_TEST_URI is not set")
+    from pymongo import MongoClient
+
+    client = MongoClient(os.getenv("MONGODB_TEST_URI"))
+    for (database, name), indexes in INDEXES.items():
+        client[database][name].create_indexes(indexes)
+    yield client
+    client.close()
+
+def test_no_query_shape_scans_a_collection(client):
+    assert explain_query_shapes(client) == []
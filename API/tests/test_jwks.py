@@ -0,0 +1,115 @@
+""" Tests - JWKS Session Token Verification
+
+Tokens are signed by generated RSA keys and verified against a local JWKS
+fixture file.
+"""
+
+import json
+import time
+import threading
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from jwks import JWKSKeySet
+
+
+def make_key(kid):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update({"kid": kid, "alg": "RS256", "use": "sig"})
+    return private_key, jwk
+
+def write_jwks(path, *jwks):
+    with open(path, "w") as f:
+        json.dump({"keys": list(jwks)}, f)
+
+def sign(private_key, kid, algorithm="RS256", **claims):
+    claims = {"sub": "user_test", "exp": int(time.time()) + 60, "iat": int(time.time()), **claims}
+    return jwt.encode(claims, private_key, algorithm=algorithm, headers={"kid": kid})
+
+@pytest.fixture
+def keys(tmp_path):
+    """
+        A signing key, and the path of a JWKS file with its public key
+    """
+    private_key, jwk = make_key("ins_test")
+    path = tmp_path / "jwks.json"
+    write_jwks(path, jwk)
+    return private_key, jwk, str(path)
+
+
+def test_valid_token(keys):
+    private_key, _, path = keys
+    key_set = JWKSKeySet(jwks_file=path, audience="buyinggood")
+
+    claims = key_set.verify(sign(private_key, "ins_test", aud="buyinggood"))
+    assert claims["sub"] == "user_test"
+
+def test_expired_token(keys):
+    private_key, _, path = keys
+    key_set = JWKSKeySet(jwks_file=path)
+
+    with pytest.raises(jwt.ExpiredSignatureError):
+        key_set.verify(sign(private_key, "ins_test", exp=int(time.time()) - 60))
+
+def test_wrong_audience(keys):
+    private_key, _, path = keys
+    key_set = JWKSKeySet(jwks_file=path, audience="buyinggood")
+
+    with pytest.raises(jwt.InvalidAudienceError):
+        key_set.verify(sign(private_key, "ins_test", aud="someone-else"))
+
+def test_unsupported_algorithm(keys):
+    _, _, path = keys
+    key_set = JWKSKeySet(jwks_file=path)
+
+    # Signed with a shared secret under the kid of the RSA key
+    with pytest.raises(jwt.InvalidAlgorithmError):
+        key_set.verify(sign("a-shared-secret-of-at-least-32-bytes", "ins_test", algorithm="HS256"))
+
+def test_unknown_kid_refreshes_once_for_concurrent_callers(keys):
+    private_key, jwk, path = keys
+    key_set = JWKSKeySet(jwks_file=path, min_refresh_interval=0)
+    key_set.refresh()
+
+    # The key is rotated, every caller sees the new kid at once while the fetch is slow
+    rotated_key, rotated_jwk = make_key("ins_rotated")
+    write_jwks(path, jwk, rotated_jwk)
+    fetch = key_set._fetch
+    key_set._fetch = lambda: (time.sleep(0.1), fetch())[1]
+
+    token = sign(rotated_key, "ins_rotated")
+    barrier = threading.Barrier(8)
+    results = []
+
+    def verify():
+        barrier.wait()
+        results.append(key_set.verify(token)["sub"])
+
+    threads = [threading.Thread(target=verify) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["user_test"] * 8
+    assert key_set.refresh_count == 2
+
+def test_unknown_kid_refreshes_are_throttled(keys):
+    _, jwk, path = keys
+    key_set = JWKSKeySet(jwks_file=path, min_refresh_interval=60)
+    key_set.refresh()
+
+    rotated_key, rotated_jwk = make_key("ins_rotated")
+    write_jwks(path, jwk, rotated_jwk)
+
+    # Within min_refresh_interval of the last refresh the key set is not fetched again
+    with pytest.raises(jwt.InvalidTokenError, match="Unknown signing key"):
+        key_set.verify(sign(rotated_key, "ins_rotated"))
+    assert key_set.refresh_count == 1
+
+    key_set._last_refresh -= 60
+    assert key_set.verify(sign(rotated_key, "ins_rotated"))["sub"] == "user_test"
+    assert key_set.refresh_count == 2
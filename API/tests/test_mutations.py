@@ -0,0 +1,70 @@
+""" Tests - Mutation Round Trips
+
+The commands each farm and produce mutation sends, against the budgets of
+benchmarks/bench_mutations.py, which measures them on a MongoDB server.
+"""
+
+from benchmarks.bench_mutations import BUDGETS
+
+ADDRESS = {"street": "1 a road", "city": "cairns", "zipCode": "4870", "state": "qld"}
+
+
+def test_mutations_stay_within_their_budgets(api):
+    results = {}
+
+    def measure(name, method, path, headers, body=None, status=None):
+        api.commands.clear()
+        response = api.client.open(path, method=method, headers=headers, json=body)
+        assert response.status_code == status, (name, response.get_data(as_text=True))
+        results[name] = sum(api.commands.values())
+        return response.get_json()
+
+    api.db.national_address_file.insert_one({"street": "1 A ROAD", "city": "CAIRNS", "zipcode": 4870, "state": "QLD",
+                                             "location": {"type": "Point", "coordinates": [145.77, -16.92]}})
+
+    # Warm the authentication caches so only the handlers' commands are counted
+    for headers in [api.owner, api.other]:
+        api.client.get("/my_farms", headers=headers)
+
+    farm_id = measure("POST /farms", "POST", "/farms", api.owner, {"name": "Bench Farm", "address": ADDRESS}, 201)["data"]["farmId"]
+    measure("PUT /farms/<id>", "PUT", f"/farms/{farm_id}", api.owner, {"name": "Renamed Farm"}, 201)
+    measure("PUT /farms/<id> (not owner)", "PUT", f"/farms/{farm_id}", api.other, {"name": "Stolen Farm"}, 401)
+    produce_id = measure("POST /farms/<id>/produce", "POST", f"/farms/{farm_id}/produce", api.owner,
+                         {"name": "Mango", "category": "Fruit"}, 201)["data"]["produceId"]
+    measure("PUT /produce/<id>", "PUT", f"/produce/{produce_id}", api.owner, {"price": 4.5}, 201)
+    measure("PUT /produce/<id> (category)", "PUT", f"/produce/{produce_id}", api.owner, {"category": "Vegetables"}, 201)
+    measure("PUT /produce/<id> (not owner)", "PUT", f"/produce/{produce_id}", api.other, {"price": 0}, 401)
+    measure("DELETE /produce/<id>", "DELETE", f"/produce/{produce_id}", api.owner, None, 201)
+    measure("DELETE /farms/<id>", "DELETE", f"/farms/{farm_id}", api.owner, None, 200)
+
+    assert {name: count for name, count in results.items() if count > BUDGETS[name]} == {}
+
+def test_produce_writes_check_the_owner(api, farm_id):
+    response = api.client.post(f"/farms/{farm_id}/produce", headers=api.owner, json={"name": "Mango", "category": "Fruit"})
+    produce_id = response.get_json()["data"]["produceId"]
+
+    assert api.client.put(f"/produce/{produce_id}", headers=api.other, json={"price": 0}).status_code == 401
+    assert api.client.delete(f"/produce/{produce_id}", headers=api.other).status_code == 401
+    assert api.client.put("/produce/000000000000000000000000", headers=api.owner, json={"price": 0}).status_code == 400
+
+    # Not moved to a farm of another owner
+    response = api.client.post("/farms", headers=api.other, json={"name": "Other Farm", "address": ADDRESS})
+    other_farm_id = response.get_json()["data"]["farmId"]
+    assert api.client.put(f"/produce/{produce_id}", headers=api.owner, json={"farmId": other_farm_id}).status_code == 401
+
+    produce = api.db.produce.find_one()
+    assert produce["category"] == "Fruit" and "price" not in produce
+
+def test_moved_produce_updates_both_farms(api, farm_id):
+    response = api.client.post(f"/farms/{farm_id}/produce", headers=api.owner, json={"name": "Mango", "category": "Fruit"})
+    produce_id = response.get_json()["data"]["produceId"]
+    response = api.client.post("/farms", headers=api.owner, json={"name": "Second Farm", "address": ADDRESS})
+    second_farm_id = response.get_json()["data"]["farmId"]
+
+    response = api.client.put(f"/produce/{produce_id}", headers=api.owner, json={"farmId": second_farm_id})
+    assert response.status_code == 201, response.get_data(as_text=True)
+    assert response.get_json()["data"]["farmId"] == second_farm_id
+
+    farms = {str(farm["_id"]): farm for farm in api.db.farms.find()}
+    assert farms[farm_id]["produceCategories"] == []
+    assert farms[second_farm_id]["produceCategories"] == ["Fruit"]
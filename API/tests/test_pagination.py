@@ -0,0 +1,54 @@
+""" Tests - Keyset Pagination
+
+Following nextCursor from an empty cursor returns every document once, in
+order, and a malformed cursor is a bad request.
+"""
+
+import base64
+import json
+
+import pytest
+
+from bson import ObjectId
+
+ADDRESS = {"street": "1 a road", "city": "cairns", "zipCode": "4870", "state": "qld"}
+MALFORMED_CURSORS = ["not-base64!", base64.urlsafe_b64encode(b"[1, 2").decode(),
+                     base64.urlsafe_b64encode(json.dumps(["a", str(ObjectId())]).encode()).decode(),
+                     base64.urlsafe_b64encode(json.dumps([None, "not an id"]).encode()).decode()]
+
+
+def follow(api, path, key, id_key, headers=None):
+    """
+        The ids of every page of a keyset paginated list, from an empty cursor
+    """
+    ids, cursor = [], ""
+    while cursor is not None:
+        response = api.client.get(path, query_string={"cursor": cursor, "limit": 2}, headers=headers)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        data = response.get_json()["data"]
+        ids += [item[id_key] for item in data[key]]
+        cursor = data["pagination"]["nextCursor"]
+    return ids
+
+@pytest.fixture
+def farm_ids(api, search):
+    return [api.client.post("/farms", headers=api.owner, json={"name": f"Farm {i}", "address": ADDRESS}).get_json()["data"]["farmId"]
+            for i in range(5)]
+
+def test_my_farms_pages_return_every_farm_once(api, farm_ids):
+    assert follow(api, "/my_farms", "farms", "farmId", api.owner) == sorted(farm_ids)
+
+def test_farm_produce_pages_return_every_produce_once(api, farm_id):
+    produce_ids = [api.client.post(f"/farms/{farm_id}/produce", headers=api.owner, json={"name": f"Produce {i}"}).get_json()["data"]["produceId"]
+                   for i in range(5)]
+    assert follow(api, f"/farms/{farm_id}/produce", "produce", "produceId") == sorted(produce_ids)
+
+def test_farms_search_pages_return_every_farm_once(api, farm_ids):
+    # Without a location or text the search is sorted by _id
+    assert follow(api, "/farms", "farms", "farmId") == sorted(farm_ids)
+
+@pytest.mark.parametrize("cursor", MALFORMED_CURSORS)
+def test_malformed_cursors_are_bad_requests(api, farm_ids, cursor):
+    for path, headers in [("/my_farms", api.owner), (f"/farms/{farm_ids[0]}/produce", None), ("/farms", None)]:
+        response = api.client.get(path, query_string={"cursor": cursor}, headers=headers)
+        assert response.status_code == 400, (path, response.get_data(as_text=True))
@@ -0,0 +1,53 @@
+""" Tests - Produce Categories
+
+Farms keep the categories of their produce in produceCategories, which GET
+/farms filters on. The frontend sends a produce category as an array.
+"""
+
+from bson import ObjectId
+
+from backfill_produce_categories import farm_categories
+
+
+def produce_categories(api, farm_id):
+    return sorted(api.db.farms.find_one({"_id": ObjectId(farm_id)})["produceCategories"])
+
+def test_adding_produce_adds_its_categories(api, farm_id):
+    for body in [{"name": "Tomato", "category": ["Fruit", "Vegetables"]}, {"name": "Honey", "category": "Honey"}]:
+        response = api.client.post(f"/farms/{farm_id}/produce", headers=api.owner, json=body)
+        assert response.status_code == 201, response.get_data(as_text=True)
+
+    assert produce_categories(api, farm_id) == ["Fruit", "Honey", "Vegetables"]
+
+def test_backfill_flattens_array_categories(api, farm_id):
+    api.db.produce.insert_many([
+        {"farmId": ObjectId(farm_id), "name": "Tomato", "category": ["Fruit", "Vegetables"]},
+        {"farmId": ObjectId(farm_id), "name": "Mango", "category": "Fruit"},
+        {"farmId": ObjectId(farm_id), "name": "Eggs"},
+    ])
+
+    assert farm_categories(api.db)[ObjectId(farm_id)] == ["Fruit", "Vegetables"]
+
+def test_moving_and_deleting_produce_keep_the_categories_in_sync(api, farm_id):
+    response = api.client.post("/farms", headers=api.owner, json={
+        "name": "Second Farm", "address": {"street": "1 a road", "city": "cairns", "zipCode": "4870", "state": "qld"}
+    })
+    second_farm_id = response.get_json()["data"]["farmId"]
+    produce_ids = [api.client.post(f"/farms/{farm_id}/produce", headers=api.owner, json=body).get_json()["data"]["produceId"]
+                   for body in [{"name": "Tomato", "category": ["Fruit", "Vegetables"]}, {"name": "Mango", "category": "Fruit"}]]
+
+    # Moved, the first farm keeps the category still used by its other produce
+    api.commands.clear()
+    response = api.client.put(f"/produce/{produce_ids[0]}", headers=api.owner, json={"farmId": second_farm_id})
+    assert response.status_code == 201, response.get_data(as_text=True)
+    assert api.commands["commitTransaction"] == 1
+    assert produce_categories(api, farm_id) == ["Fruit"]
+    assert produce_categories(api, second_farm_id) == ["Fruit", "Vegetables"]
+
+    # Deleted, the farm has no category left
+    api.commands.clear()
+    response = api.client.delete(f"/produce/{produce_ids[1]}", headers=api.owner)
+    assert response.status_code == 201, response.get_data(as_text=True)
+    assert api.commands["commitTransaction"] == 1
+    assert produce_categories(api, farm_id) == []
+    assert produce_categories(api, second_farm_id) == ["Fruit", "Vegetables"]
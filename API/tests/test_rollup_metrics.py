@@ -0,0 +1,68 @@
+""" Tests - Metrics Rollup
+
+Hours older than the retention are rolled up before they are removed, even
+when the job has not run for longer than the retention. Needs a MongoDB
+server, as mongomock has no $merge:
+
+    MONGODB_TEST_URI=mongodb://localhost:27017 python -m pytest tests/test_rollup_metrics.py
+
+The buckets are written to the server's farm_details database.
+"""
+
+import datetime
+import os
+
+import pytest
+from bson import ObjectId
+
+from counters import bucket_start, utc_now
+from rollup_metrics import rollup_metrics
+
+
+@pytest.fixture
+def metrics():
+    if not os.getenv("MONGODB_TEST_URI"):
+        pytest.skip("MONGODB_TEST_URI is not set")
+    from pymongo import MongoClient
+
+    client = MongoClient(os.getenv("MONGODB_TEST_URI"))
+    farm_id = ObjectId()
+    yield client.farm_details.farm_metrics, farm_id
+    client.farm_details.farm_metrics.delete_many({"farmId": farm_id})
+    client.close()
+
+def hour_buckets(farm_id, day, hours):
+    return [
+        {"farmId": farm_id, "granularity": "hour", "bucket": day + datetime.timedelta(hours=hour),
+         "counts": {"profileViews": 1, "contactForms": 0}}
+        for hour in range(hours)
+    ]
+
+def test_hours_past_the_retention_are_rolled_up_before_removal(metrics):
+    collection, farm_id = metrics
+    now = utc_now()
+    # Written 30 days ago and never rolled up, as if the job had stopped running
+    stale_day = bucket_start(now, "day") - datetime.timedelta(days=30)
+    collection.insert_many(hour_buckets(farm_id, stale_day, 5))
+
+    hours_removed, _ = rollup_metrics(collection, hour_retention_days=7, now=now)
+
+    assert hours_removed >= 5
+    assert collection.count_documents({"farmId": farm_id, "granularity": "hour"}) == 0
+    day = collection.find_one({"farmId": farm_id, "granularity": "day", "bucket": stale_day})
+    assert day["counts"] == {"profileViews": 5, "contactForms": 0}
+    month = collection.find_one({"farmId": farm_id, "granularity": "month", "bucket": bucket_start(stale_day, "month")})
+    assert month["counts"]["profileViews"] >= 5
+
+def test_rerunning_does_not_count_twice(metrics):
+    collection, farm_id = metrics
+    now = utc_now()
+    today = bucket_start(now, "day")
+    collection.insert_many(hour_buckets(farm_id, today, 3))
+
+    rollup_metrics(collection, now=now)
+    rollup_metrics(collection, now=now)
+
+    day = collection.find_one({"farmId": farm_id, "granularity": "day", "bucket": today})
+    assert day["counts"] == {"profileViews": 3, "contactForms": 0}
+    assert collection.count_documents({"farmId": farm_id, "granularity": "hour"}) == 3
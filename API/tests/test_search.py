@@ -0,0 +1,38 @@
+""" Tests - Farm Search
+
+The local backend must filter on produce categories stored as a string or,
+as the frontend sends them, an array of strings.
+"""
+
+from types import SimpleNamespace
+
+from bson import ObjectId
+
+from search import LocalSearchBackend
+
+
+def make_db(farms, produce):
+    # The local backend only needs find() on the two collections to load
+    return SimpleNamespace(farms=SimpleNamespace(find=lambda: iter(farms)),
+                           produce=SimpleNamespace(find=lambda: iter(produce)))
+
+def test_category_filter_matches_string_and_array_categories():
+    string_farm, array_farm, other_farm = ObjectId(), ObjectId(), ObjectId()
+    farms = [{"_id": farm_id, "name": f"Farm {i}", "address": {"state": "QLD"}}
+             for i, farm_id in enumerate([string_farm, array_farm, other_farm])]
+    produce = [
+        {"_id": ObjectId(), "farmId": string_farm, "name": "Mango", "category": "Fruit"},
+        {"_id": ObjectId(), "farmId": array_farm, "name": "Tomato", "category": ["Fruit", "Vegetables"]},
+        {"_id": ObjectId(), "farmId": other_farm, "name": "Honey", "category": ["Honey"]},
+        {"_id": ObjectId(), "farmId": other_farm, "name": "Eggs"},
+    ]
+    db = make_db(farms, produce)
+    backend = LocalSearchBackend()
+
+    def farm_ids(categories):
+        _, page, _ = backend.search(db, categories=categories)
+        return {farm["_id"] for farm in page}
+
+    assert farm_ids(["Fruit"]) == {string_farm, array_farm}
+    assert farm_ids(["Vegetables", "Honey"]) == {array_farm, other_farm}
+    assert farm_ids(["Dairy"]) == set()
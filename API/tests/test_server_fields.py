@@ -0,0 +1,55 @@
+""" Tests - Server Fields
+
+Clients send back the documents they were given, so the update endpoints
+must ignore the fields the server sets, and the internal version behind the
+ETags must not be returned.
+"""
+
+from bson import ObjectId
+
+
+def find_key(obj, key):
+    """
+        Whether a key appears anywhere in a JSON response
+    """
+    if isinstance(obj, dict):
+        return key in obj or any(find_key(value, key) for value in obj.values())
+    if isinstance(obj, list):
+        return any(find_key(value, key) for value in obj)
+    return False
+
+def test_updates_ignore_server_fields(api, farm_id):
+    response = api.client.put(f"/farms/{farm_id}", headers=api.owner, json={
+        "name": "Renamed Farm", "version": 99, "modifiedAt": "2020-01-01", "farmId": farm_id, "ownerId": "someone"
+    })
+    assert response.status_code == 201, response.get_data(as_text=True)
+
+    farm = api.db.farms.find_one({"_id": ObjectId(farm_id)})
+    assert farm["name"] == "Renamed Farm"
+    assert farm["version"] == 1
+    assert "farmId" not in farm
+
+    response = api.client.post(f"/farms/{farm_id}/produce", headers=api.owner, json={"name": "Mango", "version": 7})
+    assert response.status_code == 201, response.get_data(as_text=True)
+    produce_id = response.get_json()["data"]["produceId"]
+    assert "version" not in api.db.produce.find_one({"_id": ObjectId(produce_id)})
+
+    response = api.client.put(f"/produce/{produce_id}", headers=api.owner, json={
+        "name": "Mangoes", "version": 99, "modifiedAt": "2020-01-01", "produceId": produce_id
+    })
+    assert response.status_code == 201, response.get_data(as_text=True)
+    assert "version" not in response.get_json()["data"]
+
+    produce = api.db.produce.find_one({"_id": ObjectId(produce_id)})
+    assert produce["name"] == "Mangoes"
+    assert produce["version"] == 1
+
+def test_responses_leave_out_the_version(api, farm_id):
+    api.client.put(f"/farms/{farm_id}", headers=api.owner, json={"name": "Renamed Farm"})
+    api.client.post(f"/farms/{farm_id}/produce", headers=api.owner, json={"name": "Mango"})
+
+    for path in [f"/farms/{farm_id}", f"/farms/{farm_id}/produce", "/my_farms"]:
+        response = api.client.get(path, headers=api.owner)
+        assert response.status_code == 200, (path, response.get_data(as_text=True))
+        assert not find_key(response.get_json(), "version"), path
+        assert find_key(response.get_json(), "modifiedAt"), path
@@ -2,49 +2,68 @@
 
 # We want to isolate the total freight costs per area for this dataset
 
+# Run on its own, or as the clean:freight_cost and load:freight_cost stages of pipeline.py
+# Usage:
+#     python ABARES_HISTORICAL_REGIONAL_ESTIMATES_DATA_CLEANING.py [--source ABARES_HISTORICAL_REGIONAL_ESTIMATES.csv] [--root clean_data] [--mongo-uri <uri>]
+
 # Import libraries
+import argparse
 import pandas as pd
+from datasets import DATA_ROOT, read_dataset, write_dataset
+
+SOURCE = 'ABARES_HISTORICAL_REGIONAL_ESTIMATES.csv'
 
-# Import dataset
-df = pd.read_csv('ABARES_HISTORICAL_REGIONAL_ESTIMATES.csv')
+def clean(source=SOURCE, root=DATA_ROOT):
+    # Import dataset
+    df = pd.read_csv(source)
 
-# Rename columns
-df_clean = df.rename(columns={'Variable': 'item', 'Year': 'year', 'ABARES region': 'abares_region', 'Value': 'cost', 'RSE': 'rse'})
+    # Rename columns
+    df_clean = df.rename(columns={'Variable': 'item', 'Year': 'year', 'ABARES region': 'abares_region', 'Value': 'cost', 'RSE': 'rse'})
 
-# Remove duplicates
-df_clean = df_clean.drop_duplicates()
+    # Remove duplicates
+    df_clean = df_clean.drop_duplicates()
 
-# Remove rows with null in Value column
-df_clean = df_clean.dropna()
+    # Remove rows with null in Value column
+    df_clean = df_clean.dropna()
 
-# Set data types
-df_clean = df_clean.astype({'year': int, 'abares_region': str, 'cost': float})
+    # Set data types
+    df_clean = df_clean.astype({'year': int, 'abares_region': str, 'cost': float})
 
-# Filter by only 'Total freight ($)'
-df_clean = df_clean[df_clean['item']=='Total freight ($)']
+    # Filter by only 'Total freight ($)'
+    df_clean = df_clean[df_clean['item']=='Total freight ($)']
 
-# Select only required columns
-df_clean = df_clean[['abares_region','year','cost']]
+    # Select only required columns
+    df_clean = df_clean[['abares_region','year','cost']]
 
-# Export cleaned data to csv
-df_clean.to_csv('ABARES_HISTORICAL_REGIONAL_ESTIMATES_CLEAN.csv', index = False)
+    # Export cleaned data to the freight_cost Parquet dataset, partitioned by year
+    write_dataset(df_clean, 'freight_cost', root)
+    return len(df_clean)
 
 ## INSERT TO MONGODB
 
-from pymongo import MongoClient
+def load(mongo_uri=None, root=DATA_ROOT):
+    from pymongo import MongoClient
+    from pipeline import connection_string
+
+    # MongoDB connection, the app's cluster unless another server is given
+    client = MongoClient(mongo_uri or connection_string())
+    db = client['analytics']
+    collection = db['freight_cost']
 
-# Define database username, password and connection string
-db_username = ''
-db_password = ''
-connect_str = 'mongodb+srv://' + db_username + ':' + db_password + '@buyinggood.jxdin83.mongodb.net/'
+    # Delete all documents in the collection
+    delete = collection.delete_many({})
 
-# MongoDB connection
-client = MongoClient(connect_str)
-db = client['analytics']
-collection = db['freight_cost']
+    # Insert updated documents to collection, read back from the exported dataset
+    records = read_dataset('freight_cost', root=root).to_dict('records')
+    collection.insert_many(records)
+    return len(records)
 
-# Delete all documents in the collection
-delete = collection.delete_many({})
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source', default=SOURCE)
+    parser.add_argument('--root', default=DATA_ROOT, help='Where the cleaned datasets are written')
+    parser.add_argument('--mongo-uri', help="Default: the app's cluster, see pipeline.connection_string")
+    args = parser.parse_args()
 
-# Insert updated documents to collection
-collection.insert_many(df_clean.to_dict('records'))
+    clean(args.source, args.root)
+    load(args.mongo_uri, args.root)
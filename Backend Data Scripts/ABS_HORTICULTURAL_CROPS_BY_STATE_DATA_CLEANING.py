@@ -1,79 +1,98 @@
 ## DATA CLEANING - ABS_HORTICULTURAL_CROPS_BY_STATE
 
+# Run on its own, or as the clean:crop_production and load:crop_production stages of pipeline.py
+# Usage:
+#     python ABS_HORTICULTURAL_CROPS_BY_STATE_DATA_CLEANING.py [--source ABS_HORTICULTURAL_CROPS_BY_STATE.xlsx] [--root clean_data] [--mongo-uri <uri>]
+
 # Import libraries
+import argparse
 import pandas as pd
-
-# Import Table 1 sheet from excel document
-xlsx = pd.ExcelFile('ABS_HORTICULTURAL_CROPS_BY_STATE.xlsx')
-df_1 = pd.read_excel(xlsx, 'Table 2') # Fruit data
-df_2 = pd.read_excel(xlsx, 'Table 3') # Vegetable data
-
-# Create empty dataframe to append both fruit and vegetable data together
-df_comb = pd.DataFrame()
-
-# Loop through df_1 and then df_2 and perform same cleaning process
-
-for df in (df_1,df_2):
-    # Define header as row 5 and remove top 6 rows
-    header = df.iloc[5] 
-    df_clean = df.iloc[6:] 
-    df_clean.columns = header
-
-    # Rename columns - years will be set to second year indicating financial year
-    df_clean.columns = ['region_code','region_label','item','2021','2022','2023','2024']
-
-    # Remove duplicates
-    df_clean = df_clean.drop_duplicates()
-
-    # Remove rows with null in Value column
-    df_clean = df_clean.dropna()
-    
-    # Remove rows for region_label 'Australia' as we are only interested in state data
-    df_clean = df_clean[df_clean['region_label']!='Australia']
-    
-    # Add row to label fruit or vegetable
-    if df.equals(df_1):
-        df_clean['produce_type'] = 'Fruit'
-    else:
-        df_clean['produce_type'] = 'Vegetable'
-
-    # Set data types
-    df_clean = df_clean.astype({'region_code':int,'region_label':str,'item':str,'2021':float,'2022':float,'2023':float,'2024':float, 'produce_type':str})
-    
-    # Melt df to bring year data into it's own column
-    melt_df_clean = df_clean.melt(id_vars=['region_code','region_label','produce_type','item'], var_name='financial_year', value_name='amount')
-    
-    # Split item column into item and amount_type
-    melt_df_clean[['item', 'amount_type']] = melt_df_clean['item'].str.split(' - ', expand=True)
-    
-    # Pivot amount_type to become new columns
-    pivot_df_clean = melt_df_clean.pivot(index=['region_code','region_label','produce_type','item','financial_year'],  columns='amount_type', values='amount').reset_index()
-
-    # Rename new columns 
-    pivot_df_clean.columns = ['region_code','region_label','produce_type','item','financial_year','farm_gate_value_in_millions','production_tonnes']
-
-    # Add to combined df
-    df_comb = df_comb.append(pivot_df_clean, ignore_index=True)
-    
-# Export cleaned data to csv
-df_comb.to_csv('ABS_HORTICULTURAL_CROPS_BY_STATE_CLEAN.csv', index = False)
+from datasets import DATA_ROOT, read_dataset, write_dataset
+
+SOURCE = 'ABS_HORTICULTURAL_CROPS_BY_STATE.xlsx'
+
+def clean(source=SOURCE, root=DATA_ROOT):
+    # Import Table 1 sheet from excel document
+    xlsx = pd.ExcelFile(source)
+    df_1 = pd.read_excel(xlsx, 'Table 2') # Fruit data
+    df_2 = pd.read_excel(xlsx, 'Table 3') # Vegetable data
+
+    # Create empty dataframe to append both fruit and vegetable data together
+    df_comb = pd.DataFrame()
+
+    # Loop through df_1 and then df_2 and perform same cleaning process
+
+    for df in (df_1,df_2):
+        # Define header as row 5 and remove top 6 rows
+        header = df.iloc[5] 
+        df_clean = df.iloc[6:] 
+        df_clean.columns = header
+
+        # Rename columns - years will be set to second year indicating financial year
+        df_clean.columns = ['region_code','region_label','item','2021','2022','2023','2024']
+
+        # Remove duplicates
+        df_clean = df_clean.drop_duplicates()
+
+        # Remove rows with null in Value column
+        df_clean = df_clean.dropna()
+        
+        # Remove rows for region_label 'Australia' as we are only interested in state data
+        df_clean = df_clean[df_clean['region_label']!='Australia']
+        
+        # Add row to label fruit or vegetable
+        if df.equals(df_1):
+            df_clean['produce_type'] = 'Fruit'
+        else:
+            df_clean['produce_type'] = 'Vegetable'
+
+        # Set data types
+        df_clean = df_clean.astype({'region_code':int,'region_label':str,'item':str,'2021':float,'2022':float,'2023':float,'2024':float, 'produce_type':str})
+        
+        # Melt df to bring year data into it's own column
+        melt_df_clean = df_clean.melt(id_vars=['region_code','region_label','produce_type','item'], var_name='financial_year', value_name='amount')
+        
+        # Split item column into item and amount_type
+        melt_df_clean[['item', 'amount_type']] = melt_df_clean['item'].str.split(' - ', expand=True)
+        
+        # Pivot amount_type to become new columns
+        pivot_df_clean = melt_df_clean.pivot(index=['region_code','region_label','produce_type','item','financial_year'],  columns='amount_type', values='amount').reset_index()
+
+        # Rename new columns 
+        pivot_df_clean.columns = ['region_code','region_label','produce_type','item','financial_year','farm_gate_value_in_millions','production_tonnes']
+
+        # Add to combined df
+        df_comb = pd.concat([df_comb, pivot_df_clean], ignore_index=True)
+        
+    # Export cleaned data to the crop_production Parquet dataset, partitioned by financial year
+    write_dataset(df_comb, 'crop_production', root)
+    return len(df_comb)
 
 ## INSERT TO MONGODB
 
-from pymongo import MongoClient
+def load(mongo_uri=None, root=DATA_ROOT):
+    from pymongo import MongoClient
+    from pipeline import connection_string
+
+    # MongoDB connection, the app's cluster unless another server is given
+    client = MongoClient(mongo_uri or connection_string())
+    db = client['analytics']
+    collection = db['crop_production']
 
-# Define database username, password and connection string
-db_username = ''
-db_password = ''
-connect_str = 'mongodb+srv://' + db_username + ':' + db_password + '@buyinggood.jxdin83.mongodb.net/'
+    # Delete all documents in the collection
+    delete = collection.delete_many({})
 
-# MongoDB connection
-client = MongoClient(connect_str)
-db = client['analytics']
-collection = db['crop_production']
+    # Insert updated documents to collection, read back from the exported dataset
+    records = read_dataset('crop_production', root=root).to_dict('records')
+    collection.insert_many(records)
+    return len(records)
 
-# Delete all documents in the collection
-delete = collection.delete_many({})
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source', default=SOURCE)
+    parser.add_argument('--root', default=DATA_ROOT, help='Where the cleaned datasets are written')
+    parser.add_argument('--mongo-uri', help="Default: the app's cluster, see pipeline.connection_string")
+    args = parser.parse_args()
 
-# Insert updated documents to collection
-collection.insert_many(df_comb.to_dict('records'))
+    clean(args.source, args.root)
+    load(args.mongo_uri, args.root)
@@ -1,166 +1,67 @@
-## DATA CLEANING - G-NAF QLD only
+## DATA CLEANING - G-NAF, every supported state
 
 # To obtain a complete address for our address search feature on the website we need the details from the below tables:
-# 1. Locality/Subrub (not null) from QLD_LOCALITY table
-# 2. Street name (not null) and street type code (null ok) from QLD_STREET_LOCALITY
-# 3. Longitude and latitude (not null) from QLD_ADDRESS_SITE_GEOCODE
-# 4. Address details from QLD_ADDRESS_DETAIL
+# 1. Locality/Subrub (not null) from <STATE>_LOCALITY table
+# 2. Street name (not null) and street type code (null ok) from <STATE>_STREET_LOCALITY
+# 3. Longitude and latitude (not null) from <STATE>_ADDRESS_SITE_GEOCODE
+# 4. Address details from <STATE>_ADDRESS_DETAIL
 
-# Import libraries
-import pandas as pd
-
-## QLD_LOCALITY CLEANING
-
-# Import dataset
-df_locality = pd.read_csv('G-NAF_AUSTRALIAN_ADDRESS_DATA\G-NAF\G-NAF MAY 2025\Standard\QLD_LOCALITY_psv.psv', sep='|')
-
-# Lowercase column names
-df_locality_clean = df_locality
-df_locality_clean.columns = df_locality_clean.columns.str.lower()
-
-# Remove duplicates
-df_locality_clean = df_locality_clean.drop_duplicates()
-
-# Remove rows with null primary key values (locality_pid)
-df_locality_clean = df_locality_clean.dropna(subset=['locality_pid'])
-
-# Select only required columns for address details
-df_locality_clean = df_locality_clean[['locality_pid','locality_name']]
-
-# Set data types
-df_locality_clean = df_locality_clean.astype({'locality_pid': str, 'locality_name': str})
-
-## ---------------------------------------------------------------------------------------------------------------
-
-## QLD_STREET_LOCALITY CLEANING
-
-# Import dataset
-df_street = pd.read_csv('G-NAF_AUSTRALIAN_ADDRESS_DATA\G-NAF\G-NAF MAY 2025\Standard\QLD_STREET_LOCALITY_psv.psv', sep='|')
-
-# Lowercase column names
-df_street_clean = df_street
-df_street_clean.columns = df_street_clean.columns.str.lower()
-
-# Remove duplicates
-df_street_clean = df_street_clean.drop_duplicates()
-
-# Remove rows with null primary key values (street_locality_pid)
-df_street_clean = df_street_clean.dropna(subset=['street_locality_pid'])
-
-# Select only required columns for address details
-df_street_clean = df_street_clean[['street_locality_pid','street_name','street_type_code']]
-
-# Set data types
-df_street_clean = df_street_clean.astype({'street_locality_pid': str, 'street_name': str, 'street_type_code': str})
-
-## ---------------------------------------------------------------------------------------------------------------
-
-## QLD_ADDRESS_SITE_GEOCODE CLEANING
-
-# Import dataset
-df_geocode = pd.read_csv('G-NAF_AUSTRALIAN_ADDRESS_DATA\G-NAF\G-NAF MAY 2025\Standard\QLD_ADDRESS_SITE_GEOCODE_psv.psv', sep='|')
-
-# Lowercase column names
-df_geocode_clean = df_geocode
-df_geocode_clean.columns = df_geocode_clean.columns.str.lower()
-
-# Remove duplicates
-df_geocode_clean = df_geocode_clean.drop_duplicates()
-
-# Remove rows with null primary key values (address_site_geocode_pid)
-df_geocode_clean = df_geocode_clean.dropna(subset=['address_site_geocode_pid'])
+# The cleaning itself is in gnaf.py. Each state is cleaned in its own worker process, reading only the
+# columns above in chunks, so memory stays bounded however large the state is.
 
-# Remove rows with null foreign key values (address_site_pid)
-df_geocode_clean = df_geocode_clean.dropna(subset=['address_site_pid'])
+# Run on its own, or as the clean:national_address_file and load:national_address_file stages of pipeline.py
+# Usage:
+#     python G-NAF_DATA_CLEANING.py [--source <G-NAF Standard directory>] [--states QLD NSW] [--fnq] [--full] [--root clean_data] [--mongo-uri <uri>]
 
-# Select only required columns for address details
-df_geocode_clean = df_geocode_clean[['address_site_geocode_pid','address_site_pid','latitude','longitude']]
-
-# Set data types
-df_geocode_clean = df_geocode_clean.astype({'address_site_geocode_pid': str, 'address_site_pid': str, 'latitude': float, 'longitude': float})
-
-## ---------------------------------------------------------------------------------------------------------------
-
-## QLD_ADDRESS_DETAIL CLEANING
-
-# Import dataset
-df_detail = pd.read_csv('G-NAF_AUSTRALIAN_ADDRESS_DATA\G-NAF\G-NAF MAY 2025\Standard\QLD_ADDRESS_DETAIL_psv.psv', sep='|')
-
-# Lowercase column names
-df_detail_clean = df_detail
-df_detail_clean.columns = df_detail_clean.columns.str.lower()
-
-# Remove duplicates
-df_detail_clean = df_detail_clean.drop_duplicates()
-
-# Remove rows with null primary key values (address_detail_pid)
-df_detail_clean = df_detail_clean.dropna(subset=['address_detail_pid'])
-
-# Remove rows with null foreign key values (address_site_pid, street_locality_pid, locality_pid)
-df_detail_clean = df_detail_clean.dropna(subset=['address_site_pid','street_locality_pid','locality_pid'])
-
-# Only keep rows with data relating to Far North Queensland area
-fnq_postcode_list = (4680,4814,4823,4825,4830,4852,4854,4855,4856,4857,4858,4859,4860,4865,4868,4869,4870,4871,4872,4873,4874,4875,4876,4877,4878,4879,4880,4881,4882,4883,4884,4885,4886,4887,4888,4890,4891,4892,4895)
-df_detail_clean = df_detail_clean[df_detail_clean['postcode'].isin(fnq_postcode_list)]
-
-# Set data types
-df_detail_clean = df_detail_clean.astype({'address_site_pid': str, 'locality_pid': str, 'street_locality_pid': str})
-
-# We now need to join all 4 tables together
-# We can join each table to the df_detail_clean table
-
-# Join df_locality_clean on locality_pid
-df_merge = pd.merge(df_detail_clean, df_locality_clean, on='locality_pid', how='inner') 
-
-# Join df_street_clean on street_locality_pid
-df_merge = pd.merge(df_merge, df_street_clean, on='street_locality_pid', how='inner') 
-
-# Join df_geocode_clean on address_site_pid
-df_merge = pd.merge(df_merge, df_geocode_clean, on='address_site_pid', how='inner') 
-
-# Add State column and merge number_first, street_name and street_type_code to one column
-df_merge['state'] = 'QLD'
-df_merge = df_merge.dropna(subset=['number_first'])
-df_merge['street'] = df_merge['number_first'].round(0).astype(int).astype(str) + ' ' + df_merge['street_name'] + ' ' + df_merge['street_type_code']
+# Import libraries
+import os
+import argparse
 
-# Keep columns required for address details and rename
-df_merge = df_merge[['address_detail_pid','street','locality_name','state','postcode','latitude','longitude']]
-df_merge = df_merge.rename(columns={'locality_name':'city', 'postcode':'zipcode'})
+from gnaf import FNQ_POSTCODES, SUPPORTED_STATES, clean_states
+from datasets import DATA_ROOT, dataset_exists
 
-# Export cleaned data to csv
-df_merge.to_csv('QLD_ADDRESS_DETAIL_CLEAN.csv', index = False)
+SOURCE = os.path.join('G-NAF_AUSTRALIAN_ADDRESS_DATA', 'G-NAF', 'G-NAF MAY 2025', 'Standard')
 
-# Create the GeoJSON 'location' field
-df_merge['location'] = df_merge.apply(lambda row: {
-    "type": "Point",
-    "coordinates": [row['longitude'], row['latitude']]
-}, axis=1)
+## G-NAF CLEANING
 
-# Convert to dictionary
-records = df_merge.to_dict(orient='records')
+def clean(source=SOURCE, root=DATA_ROOT, states=None, fnq=False, workers=None):
+    # Clean each state to its partition of the national_address_file Parquet dataset, e.g. clean_data/national_address_file/state=QLD
+    results = clean_states(source, root, states, FNQ_POSTCODES if fnq else None, workers)
+    for result in results:
+        print(f"{result['state']}: {result['rows']} addresses in {result['seconds']:.1f}s")
+    return sum(result['rows'] for result in results)
 
 ## INSERT TO MONGODB
 
-from pymongo import MongoClient
-
-# Define database username, password and connection string
-db_username = ''
-db_password = ''
-connect_str = 'mongodb+srv://' + db_username + ':' + db_password + '@buyinggood.jxdin83.mongodb.net/'
-
-# MongoDB connection
-client = MongoClient(connect_str)
-db = client['farm_details']
-collection = db['national_address_file']
-
-# Delete all documents in the collection
-delete = collection.delete_many({})
-
-# Loop through in batches to avoid a connection timeout error
-batch_size = 50000
-for i in range(0, len(records), batch_size):
-    batch = records[i:i + batch_size]
-    collection.insert_many(batch)
-
-# Create 2dsphere index to speed up performance
-collection.create_index([("location", "2dsphere")])
+def load(mongo_uri=None, root=DATA_ROOT, states=None, full=False):
+    from pymongo import MongoClient
+    from gnaf_load import refresh
+    from pipeline import connection_string
+
+    # MongoDB connection, the app's cluster unless another server is given
+    client = MongoClient(mongo_uri or connection_string())
+
+    # Every state that has been cleaned, unless only some are given
+    states = states or [state for state in SUPPORTED_STATES if dataset_exists('national_address_file', root, state=state)]
+
+    # Write only the addresses that changed since the last load, or on the first load build a staging
+    # collection and swap it in, so the API never sees an empty or partly loaded national_address_file
+    results = refresh(client, states, root, full=full)
+    print(results)
+    if 'full' in results:
+        return results['full']
+    return sum(sum(counts.values()) for counts in results.values())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source', default=SOURCE)
+    parser.add_argument('--states', nargs='+', choices=SUPPORTED_STATES, help='Default: every state found in --source')
+    parser.add_argument('--fnq', action='store_true', help='Only keep Far North Queensland postcodes')
+    parser.add_argument('--workers', type=int, help='Number of states cleaned at once, default: the number of CPUs')
+    parser.add_argument('--full', action='store_true', help='Reload every address instead of only the changes, see gnaf_load.py')
+    parser.add_argument('--root', default=DATA_ROOT, help='Where the cleaned datasets are written')
+    parser.add_argument('--mongo-uri', help="Default: the app's cluster, see pipeline.connection_string")
+    args = parser.parse_args()
+
+    clean(args.source, args.root, args.states, args.fnq, args.workers)
+    load(args.mongo_uri, args.root, args.states, args.full)
@@ -0,0 +1,119 @@
+""" Benchmark - CSV vs Parquet Outputs
+
+Writes the same cleaned data as the old csv outputs and as the Parquet datasets
+of datasets.py, and compares their size on disk and the time to read them:
+
+- full: every row and column
+- columns: two columns only
+- filtered: one postcode (G-NAF) or one industry in one state (business counts),
+  the csv is read whole and then filtered, the dataset pushes the filter down
+
+The G-NAF addresses are cleaned from a synthetic fixture, the business counts
+are generated in the shape of ABS_CABEE_BY_LGA_DATA_CLEANING.py's output.
+
+Usage:
+    python benchmarks/bench_formats.py [--addresses 1000000] [--business-counts 500000] [--repeat 3]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+from gnaf import clean_state
+from datasets import dataset_path, read_dataset, write_dataset
+from benchmarks.gnaf_fixture import write_fixture
+
+
+def directory_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(directory, name)) for directory, _, names in os.walk(path) for name in names)
+
+def timed(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = len(function())
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), rows
+
+def compare(name, csv_path, dataset, root, reads, repeat):
+    csv_size, parquet_size = directory_size(csv_path), directory_size(dataset_path(dataset, root))
+    print(f"{name}: csv {csv_size / 2**20:.1f}MB, parquet {parquet_size / 2**20:.1f}MB "
+          f"({csv_size / parquet_size:.1f}x smaller)")
+
+    for read, (read_csv, read_parquet) in reads.items():
+        csv_seconds, csv_rows = timed(read_csv, repeat)
+        parquet_seconds, parquet_rows = timed(read_parquet, repeat)
+        assert csv_rows == parquet_rows, (read, csv_rows, parquet_rows)
+        print(f"  {read:<10} {csv_rows:>9} rows  csv {csv_seconds * 1000:>8.1f}ms  parquet {parquet_seconds * 1000:>8.1f}ms  "
+              f"({csv_seconds / parquet_seconds:.1f}x faster)")
+
+
+def bench_addresses(tmp, addresses, repeat):
+    source, root = os.path.join(tmp, "source"), os.path.join(tmp, "clean_data")
+    write_fixture(source, ["QLD"], addresses)
+    clean_state(source, root, "QLD")
+
+    csv_path = os.path.join(tmp, "QLD_ADDRESS_DETAIL_CLEAN.csv")
+    addresses = read_dataset("national_address_file", root=root)
+    addresses.to_csv(csv_path, index=False)
+    zipcode = int(addresses["zipcode"].iloc[len(addresses) // 2])
+
+    compare("G-NAF addresses", csv_path, "national_address_file", root, {
+        "full": (lambda: pd.read_csv(csv_path),
+                 lambda: read_dataset("national_address_file", root=root)),
+        "columns": (lambda: pd.read_csv(csv_path, usecols=["street", "zipcode"]),
+                    lambda: read_dataset("national_address_file", ["street", "zipcode"], root=root)),
+        "filtered": (lambda: (lambda df: df[df["zipcode"] == zipcode])(pd.read_csv(csv_path)),
+                     lambda: read_dataset("national_address_file", filters=[("state", "==", "QLD"), ("zipcode", "==", zipcode)], root=root))
+    }, repeat)
+
+def bench_business_counts(tmp, rows, repeat):
+    rng = np.random.default_rng(0)
+    states = np.array(["Queensland", "New South Wales", "Victoria", "Western Australia", "South Australia", "Tasmania"])
+    df = pd.DataFrame({
+        "state": states[rng.integers(0, len(states), rows)],
+        "lga_code": rng.integers(10000, 70000, rows),
+        "lga_label": np.char.add("LGA ", rng.integers(0, 550, rows).astype(str)),
+        "industry_code": np.array(list("ABCDEFGHIJKLMNOPQRS"))[rng.integers(0, 19, rows)],
+        "industry_label": "Agriculture, Forestry and Fishing",
+        "date": pd.to_datetime("2022-06-30") + pd.to_timedelta(rng.integers(0, 3, rows) * 365, unit="D"),
+        "total_business_count": rng.integers(0, 5000, rows)
+    })
+    df["year"] = df["date"].dt.year
+
+    root = os.path.join(tmp, "clean_data")
+    csv_path = os.path.join(tmp, "ABS_CABEE_BY_LGA_CLEAN.csv")
+    df.to_csv(csv_path, index=False)
+    write_dataset(df, "business_count", root)
+
+    compare("Business counts", csv_path, "business_count", root, {
+        "full": (lambda: pd.read_csv(csv_path, parse_dates=["date"]),
+                 lambda: read_dataset("business_count", root=root)),
+        "columns": (lambda: pd.read_csv(csv_path, usecols=["lga_label", "total_business_count"]),
+                    lambda: read_dataset("business_count", ["lga_label", "total_business_count"], root=root)),
+        "filtered": (lambda: (lambda df: df[(df["industry_code"] == "A") & (df["state"] == "Queensland")])(pd.read_csv(csv_path)),
+                     lambda: read_dataset("business_count", filters=[("industry_code", "==", "A"), ("state", "==", "Queensland")], root=root))
+    }, repeat)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--addresses", type=int, default=1000000)
+    parser.add_argument("--business-counts", type=int, default=500000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_addresses(tmp, args.addresses, args.repeat)
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_business_counts(tmp, args.business_counts, args.repeat)
@@ -0,0 +1,111 @@
+""" Benchmark - G-NAF Cleaning
+
+Cleans a synthetic G-NAF fixture with the original in-memory cleaning (every
+table read whole with default dtypes, then merged) and with the streaming
+cleaning of gnaf.py, and reports rows/sec and peak RSS of each. Each run is
+made in a fresh process so its peak RSS is its own.
+
+With several --states the streaming cleaning runs them in parallel worker
+processes, the in-memory cleaning runs them one after another.
+
+Usage:
+    python benchmarks/bench_gnaf_cleaning.py [--addresses 1000000] [--states QLD NSW] [--bucket-mb 64] [--skip-in-memory]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from gnaf import CHUNK_SIZE, clean_state, clean_states, peak_rss_mb, table_path
+from benchmarks.gnaf_fixture import write_fixture
+
+
+def read_whole(source, state, table):
+    df = pd.read_csv(table_path(source, state, table), sep="|")
+    df.columns = df.columns.str.lower()
+    return df.drop_duplicates()
+
+def clean_in_memory(source, output, states):
+    """
+        The cleaning of the original G-NAF_DATA_CLEANING.py, without its postcode filter
+    """
+    start = time.perf_counter()
+    rows = 0
+    for state in states:
+        locality = read_whole(source, state, "LOCALITY").dropna(subset=["locality_pid"])
+        locality = locality[["locality_pid", "locality_name"]].astype({"locality_pid": str, "locality_name": str})
+
+        street = read_whole(source, state, "STREET_LOCALITY").dropna(subset=["street_locality_pid"])
+        street = street[["street_locality_pid", "street_name", "street_type_code"]].astype(str)
+
+        geocode = read_whole(source, state, "ADDRESS_SITE_GEOCODE").dropna(subset=["address_site_geocode_pid", "address_site_pid"])
+        geocode = geocode[["address_site_geocode_pid", "address_site_pid", "latitude", "longitude"]]
+        geocode = geocode.astype({"address_site_geocode_pid": str, "address_site_pid": str})
+
+        detail = read_whole(source, state, "ADDRESS_DETAIL").dropna(subset=["address_detail_pid", "address_site_pid",
+                                                                             "street_locality_pid", "locality_pid"])
+        detail = detail.astype({"address_site_pid": str, "locality_pid": str, "street_locality_pid": str})
+
+        merged = detail.merge(locality, on="locality_pid").merge(street, on="street_locality_pid")
+        merged = merged.merge(geocode, on="address_site_pid")
+        merged["state"] = state
+        merged = merged.dropna(subset=["number_first"])
+        merged["street"] = (merged["number_first"].round(0).astype(int).astype(str) + " "
+                            + merged["street_name"] + " " + merged["street_type_code"])
+        merged = merged[["address_detail_pid", "street", "locality_name", "state", "postcode", "latitude", "longitude"]]
+        merged = merged.rename(columns={"locality_name": "city", "postcode": "zipcode"})
+        merged.to_csv(os.path.join(output, f"{state}_ADDRESS_DETAIL_CLEAN.csv"), index=False)
+        rows += len(merged)
+
+    return {"rows": rows, "seconds": time.perf_counter() - start, "peak_rss_mb": peak_rss_mb()}
+
+def in_fresh_process(function, *args):
+    # Spawned rather than forked, as a forked child's peak RSS starts at the parent's
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(function, *args).result()
+
+def report(name, rows, seconds, peak_rss):
+    print(f"{name:<32} {rows:>10} rows  {seconds:>7.1f}s  {rows / seconds:>10.0f} rows/s  peak RSS {peak_rss or 0:>7.0f}MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--addresses", type=int, default=1000000, help="Addresses per state")
+    parser.add_argument("--states", nargs="+", default=["QLD"])
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--bucket-mb", type=int, default=64)
+    parser.add_argument("--skip-in-memory", action="store_true", help="Only run the streaming cleaning")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source, output = os.path.join(tmp, "source"), os.path.join(tmp, "output")
+        os.makedirs(output)
+
+        start = time.perf_counter()
+        expected = write_fixture(source, args.states, args.addresses)
+        size = sum(os.path.getsize(os.path.join(source, name)) for name in os.listdir(source))
+        print(f"Wrote {len(args.states)} state(s) of {args.addresses} addresses ({size / 2**20:.0f}MB) "
+              f"in {time.perf_counter() - start:.1f}s, {expected} addresses to keep")
+
+        if not args.skip_in_memory:
+            result = in_fresh_process(clean_in_memory, source, output, args.states)
+            report("in memory", result["rows"], result["seconds"], result["peak_rss_mb"])
+
+        if len(args.states) == 1:
+            result = in_fresh_process(clean_state, source, output, args.states[0], None, args.chunksize, args.bucket_mb)
+            report(f"streaming ({args.bucket_mb}MB buckets)", result["rows"], result["seconds"], result["peak_rss_mb"])
+        else:
+            start = time.perf_counter()
+            results = clean_states(source, output, args.states, None, None, args.chunksize, args.bucket_mb)
+            for result in results:
+                report(f"streaming {result['state']}", result["rows"], result["seconds"], result["peak_rss_mb"])
+            report(f"streaming ({len(args.states)} workers)", sum(r["rows"] for r in results),
+                   time.perf_counter() - start, max(r["peak_rss_mb"] or 0 for r in results))
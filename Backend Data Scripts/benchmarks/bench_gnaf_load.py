@@ -0,0 +1,144 @@
+""" Benchmark - G-NAF Loading
+
+Compares the original load of G-NAF_DATA_CLEANING.py (a GeoJSON location built
+with DataFrame.apply, every record materialized with to_dict, then sequential
+ordered insert_many batches of 50k) with the bulk load of gnaf_load.py
+(documents built column-wise per batch, BSON encoded in worker processes and
+inserted by concurrent unordered writers).
+
+Without --mongo-uri the inserts go to a collection that discards them, which
+measures building and encoding the documents. With --mongo-uri both loads
+insert into a scratch bench_gnaf_load database that is dropped afterwards.
+
+Each load runs in a fresh process. Peak RSS is the peak of the sum of that
+process and its encoder processes, sampled every 20ms (Linux only).
+
+Usage:
+    python benchmarks/bench_gnaf_load.py [--addresses 1000000] [--batch-size 10000] [--encoders 4] [--writers 4] [--mongo-uri mongodb://localhost:27017]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bson
+
+from gnaf import clean_state
+from gnaf_load import BATCH_SIZE, WRITERS, bulk_load, read_state_batches
+from datasets import read_dataset
+from benchmarks.gnaf_fixture import write_fixture
+
+
+class DiscardingCollection:
+    """
+        Stands in for a collection, encodes what it is given like pymongo would and drops it
+    """
+
+    def insert_many(self, documents, ordered=True):
+        for document in documents:
+            if not hasattr(document, "raw"):
+                bson.encode(document)
+
+
+def tree_rss_mb(pid):
+    """
+        Resident memory of a process and its children in MB
+    """
+    rss = 0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                parent = int(f.read().rsplit(")", 1)[1].split()[1])
+            if int(entry) != pid and parent != pid:
+                continue
+            with open(f"/proc/{entry}/status") as f:
+                rss += next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+        except (OSError, StopIteration):
+            continue
+    return rss / 2**10
+
+def with_peak_rss(function, *args):
+    """
+        Run function, returns its result, seconds and the peak RSS of this process and its children
+    """
+    peak, done = [0.0], threading.Event()
+
+    def sample():
+        while not done.wait(0.02):
+            peak[0] = max(peak[0], tree_rss_mb(os.getpid()))
+
+    if os.path.isdir("/proc"):
+        threading.Thread(target=sample, daemon=True).start()
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    done.set()
+    return result, seconds, peak[0] or None
+
+def scratch_collection(mongo_uri):
+    if mongo_uri is None:
+        return DiscardingCollection()
+    from pymongo import MongoClient
+    collection = MongoClient(mongo_uri).bench_gnaf_load.national_address_file
+    collection.drop()
+    return collection
+
+
+def original_load(root, state, mongo_uri):
+    collection = scratch_collection(mongo_uri)
+    df_merge = read_dataset("national_address_file", filters=[("state", "==", state)], root=root)
+
+    df_merge["location"] = df_merge.apply(lambda row: {
+        "type": "Point",
+        "coordinates": [row["longitude"], row["latitude"]]
+    }, axis=1)
+    records = df_merge.to_dict(orient="records")
+
+    batch_size = 50000
+    for i in range(0, len(records), batch_size):
+        collection.insert_many(records[i:i + batch_size])
+    return len(records)
+
+def bulk_loader(root, state, mongo_uri, batch_size, encoders, writers):
+    return bulk_load(scratch_collection(mongo_uri), read_state_batches(state, root, batch_size), encoders, writers)
+
+def run(function, *args):
+    # Spawned so the peak RSS is the load's own
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(with_peak_rss, function, *args).result()
+
+def report(name, rows, seconds, peak_rss):
+    print(f"{name:<36} {rows:>9} docs  {seconds:>7.1f}s  {rows / seconds:>9.0f} docs/s  peak RSS {peak_rss or 0:>7.0f}MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--addresses", type=int, default=1000000)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--encoders", type=int, default=4)
+    parser.add_argument("--writers", type=int, default=WRITERS)
+    parser.add_argument("--mongo-uri", help="Insert into a scratch database on this server instead of discarding")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source, root = os.path.join(tmp, "source"), os.path.join(tmp, "clean_data")
+        write_fixture(source, ["QLD"], args.addresses)
+        clean_state(source, root, "QLD")
+
+        target = args.mongo_uri or "discarded"
+        report(f"original ({target})", *run(original_load, root, "QLD", args.mongo_uri))
+        report(f"bulk {args.encoders} encoders {args.writers} writers ({target})",
+               *run(bulk_loader, root, "QLD", args.mongo_uri, args.batch_size, args.encoders, args.writers))
+
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        MongoClient(args.mongo_uri).drop_database("bench_gnaf_load")
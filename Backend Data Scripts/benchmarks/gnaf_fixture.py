@@ -0,0 +1,140 @@
+""" Synthetic G-NAF Fixture
+
+Writes G-NAF Standard shaped PSV tables (LOCALITY, STREET_LOCALITY,
+ADDRESS_SITE_GEOCODE and ADDRESS_DETAIL) for the data script benchmarks. Every
+table has all of its real columns, mostly empty like the release files, and
+the same quirks the cleaning has to handle: duplicate rows, sites with several
+geocodes, streets without a type and addresses without a number.
+
+Usage:
+    python benchmarks/gnaf_fixture.py <directory> [--addresses 1000000] [--states QLD NSW]
+"""
+
+import os
+import argparse
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = {
+    "LOCALITY": ["LOCALITY_PID", "DATE_CREATED", "DATE_RETIRED", "LOCALITY_NAME", "PRIMARY_POSTCODE",
+                 "LOCALITY_CLASS_CODE", "STATE_PID", "GNAF_LOCALITY_PID", "GNAF_RELIABILITY_CODE"],
+    "STREET_LOCALITY": ["STREET_LOCALITY_PID", "DATE_CREATED", "DATE_RETIRED", "STREET_CLASS_CODE", "STREET_NAME",
+                        "STREET_TYPE_CODE", "STREET_SUFFIX_CODE", "LOCALITY_PID", "GNAF_STREET_PID",
+                        "GNAF_STREET_CONFIDENCE", "GNAF_RELIABILITY_CODE"],
+    "ADDRESS_SITE_GEOCODE": ["ADDRESS_SITE_GEOCODE_PID", "DATE_CREATED", "DATE_RETIRED", "ADDRESS_SITE_PID",
+                             "GEOCODE_SITE_NAME", "GEOCODE_SITE_DESCRIPTION", "GEOCODE_TYPE_CODE", "RELIABILITY_CODE",
+                             "BOUNDARY_EXTENT", "PLANIMETRIC_ACCURACY", "ELEVATION", "LONGITUDE", "LATITUDE"],
+    "ADDRESS_DETAIL": ["ADDRESS_DETAIL_PID", "DATE_CREATED", "DATE_LAST_MODIFIED", "DATE_RETIRED", "BUILDING_NAME",
+                       "LOT_NUMBER_PREFIX", "LOT_NUMBER", "LOT_NUMBER_SUFFIX", "FLAT_TYPE_CODE", "FLAT_NUMBER_PREFIX",
+                       "FLAT_NUMBER", "FLAT_NUMBER_SUFFIX", "LEVEL_TYPE_CODE", "LEVEL_NUMBER_PREFIX", "LEVEL_NUMBER",
+                       "LEVEL_NUMBER_SUFFIX", "NUMBER_FIRST_PREFIX", "NUMBER_FIRST", "NUMBER_FIRST_SUFFIX",
+                       "NUMBER_LAST_PREFIX", "NUMBER_LAST", "NUMBER_LAST_SUFFIX", "STREET_LOCALITY_PID",
+                       "LOCATION_DESCRIPTION", "LOCALITY_PID", "ALIAS_PRINCIPAL", "POSTCODE", "PRIVATE_STREET",
+                       "LEGAL_PARCEL_ID", "CONFIDENCE", "ADDRESS_SITE_PID", "LEVEL_GEOCODED_CODE", "PROPERTY_PIN",
+                       "GNAF_PROPERTY_PID", "PRIMARY_SECONDARY"]
+}
+
+# First postcode and centre (longitude, latitude) of each state
+STATES = {
+    "QLD": (4000, 145.77, -16.92), "NSW": (2000, 151.21, -33.87), "ACT": (2600, 149.13, -35.28),
+    "VIC": (3000, 144.96, -37.81), "WA": (6000, 115.86, -31.95), "SA": (5000, 138.60, -34.93),
+    "NT": (800, 130.84, -12.46), "TAS": (7000, 147.33, -42.88)
+}
+
+STREET_WORDS = ["MAIN", "MILL", "RIVER", "STATION", "CREEK", "HILL", "MANGO", "CANE", "DAIRY", "ORCHARD",
+                "BANANA", "RANGE", "VALLEY", "BRIDGE", "SCHOOL", "CHURCH", "RAILWAY", "PALM", "COAST", "MULGRAVE"]
+STREET_TYPES = ["ROAD", "STREET", "LANE", "AVENUE", "DRIVE", "COURT", "HIGHWAY", "TRACK", "CLOSE", "PARADE"]
+
+
+def write_table(directory, state, table, columns):
+    """
+        Write the given columns of a table, every other column is left empty
+    """
+    rows = len(next(iter(columns.values())))
+    frame = pd.DataFrame({column: columns.get(column, np.full(rows, "", dtype=object)) for column in COLUMNS[table]})
+    frame.to_csv(os.path.join(directory, f"{state}_{table}_psv.psv"), sep="|", index=False)
+
+def write_state(directory, state, addresses, seed=0):
+    """
+        Write the four tables of a state with the given number of addresses.
+        Returns the number of addresses a correct cleaning keeps.
+    """
+    rng = np.random.default_rng(seed)
+    first_postcode, centre_longitude, centre_latitude = STATES[state]
+    localities = max(addresses // 2000, 10)
+    streets = max(addresses // 40, 50)
+
+    locality_pids = np.array([f"loc{state.lower()}{i:09d}" for i in range(localities)], dtype=object)
+    locality_postcodes = first_postcode + rng.integers(0, 900, localities)
+    write_table(directory, state, "LOCALITY", {
+        "LOCALITY_PID": locality_pids,
+        "DATE_CREATED": np.full(localities, "2021-07-05", dtype=object),
+        "LOCALITY_NAME": np.array([f"{rng.choice(STREET_WORDS)} {i}" for i in range(localities)], dtype=object),
+        "PRIMARY_POSTCODE": locality_postcodes,
+        "LOCALITY_CLASS_CODE": np.full(localities, "G", dtype=object)
+    })
+
+    street_pids = np.array([f"{state}{i}" for i in range(streets)], dtype=object)
+    # One street in 20 has no type, e.g. "THE ESPLANADE"
+    street_types = np.where(rng.random(streets) < 0.05, "", rng.choice(STREET_TYPES, streets)).astype(object)
+    write_table(directory, state, "STREET_LOCALITY", {
+        "STREET_LOCALITY_PID": street_pids,
+        "DATE_CREATED": np.full(streets, "2021-07-05", dtype=object),
+        "STREET_CLASS_CODE": np.full(streets, "C", dtype=object),
+        "STREET_NAME": np.array([f"{rng.choice(STREET_WORDS)} {i}" for i in range(streets)], dtype=object),
+        "STREET_TYPE_CODE": street_types,
+        "LOCALITY_PID": locality_pids[rng.integers(0, localities, streets)]
+    })
+
+    site_pids = np.array([str(700000000 + i) for i in range(addresses)], dtype=object)
+    # One site in 20 has a second geocode, and one geocode row in 1000 is written twice
+    geocoded_sites = np.concatenate([np.arange(addresses), np.flatnonzero(rng.random(addresses) < 0.05)])
+    geocoded_sites = np.concatenate([geocoded_sites, geocoded_sites[rng.random(len(geocoded_sites)) < 0.001]])
+    geocodes = len(geocoded_sites)
+    write_table(directory, state, "ADDRESS_SITE_GEOCODE", {
+        "ADDRESS_SITE_GEOCODE_PID": np.array([str(900000000 + i) for i in range(geocodes)], dtype=object),
+        "DATE_CREATED": np.full(geocodes, "2021-07-05", dtype=object),
+        "ADDRESS_SITE_PID": site_pids[geocoded_sites],
+        "GEOCODE_TYPE_CODE": np.full(geocodes, "PC", dtype=object),
+        "RELIABILITY_CODE": np.full(geocodes, 2),
+        "LONGITUDE": np.round(centre_longitude + rng.uniform(-2, 2, geocodes), 8),
+        "LATITUDE": np.round(centre_latitude + rng.uniform(-2, 2, geocodes), 8)
+    })
+
+    address_localities = rng.integers(0, localities, addresses)
+    # One address in 100 has no number, e.g. lots
+    numbers = rng.integers(1, 999, addresses).astype(object)
+    numbers[rng.random(addresses) < 0.01] = ""
+    write_table(directory, state, "ADDRESS_DETAIL", {
+        "ADDRESS_DETAIL_PID": np.array([f"GA{state}{i:09d}" for i in range(addresses)], dtype=object),
+        "DATE_CREATED": np.full(addresses, "2021-07-05", dtype=object),
+        "NUMBER_FIRST": numbers,
+        "STREET_LOCALITY_PID": street_pids[rng.integers(0, streets, addresses)],
+        "LOCALITY_PID": locality_pids[address_localities],
+        "ALIAS_PRINCIPAL": np.full(addresses, "P", dtype=object),
+        "POSTCODE": locality_postcodes[address_localities],
+        "CONFIDENCE": np.full(addresses, 2),
+        "ADDRESS_SITE_PID": site_pids,
+        "LEVEL_GEOCODED_CODE": np.full(addresses, 7),
+        "PRIMARY_SECONDARY": np.full(addresses, "P", dtype=object)
+    })
+    return int((numbers != "").sum())
+
+def write_fixture(directory, states, addresses, seed=0):
+    """
+        Write the tables of several states with the given number of addresses
+        each. Returns the number of addresses a correct cleaning keeps.
+    """
+    os.makedirs(directory, exist_ok=True)
+    return sum(write_state(directory, state, addresses, seed + i) for i, state in enumerate(states))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory")
+    parser.add_argument("--addresses", type=int, default=1000000, help="Addresses per state")
+    parser.add_argument("--states", nargs="+", default=["QLD"], choices=list(STATES))
+    args = parser.parse_args()
+
+    print(f"{write_fixture(args.directory, args.states, args.addresses)} addresses written to {args.directory}")
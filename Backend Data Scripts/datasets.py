@@ -0,0 +1,158 @@
+""" Cleaned Datasets
+
+The cleaning scripts write their outputs as typed, zstd compressed Parquet
+datasets, partitioned into hive style directories, and the Mongo loaders and
+plot scripts read them back with read_dataset instead of re-parsing csv text:
+
+    clean_data/national_address_file/state=QLD/part-0.parquet    G-NAF_DATA_CLEANING.py
+    clean_data/business_count/year=2024/part-0.parquet           ABS_CABEE_BY_LGA_DATA_CLEANING.py
+    clean_data/crop_production/financial_year=2024/part-0.parquet
+                                                                 ABS_HORTICULTURAL_CROPS_BY_STATE_DATA_CLEANING.py
+    clean_data/freight_cost/year=2021/part-0.parquet             ABARES_HISTORICAL_REGIONAL_ESTIMATES_DATA_CLEANING.py
+
+Reads only decode what they need:
+
+- Columns that are not asked for are never read.
+- Filters on a partition column skip whole directories. Filters on other
+  columns skip row groups by their min/max statistics, e.g. a zipcode within a
+  G-NAF state, whose rows are written sorted by zipcode.
+- Files are memory-mapped, so they are read through the OS page cache.
+
+Filters use the pandas/pyarrow list form, e.g.
+    read_dataset("national_address_file", ["street", "city"], [("state", "==", "QLD"), ("zipcode", "in", [4870, 4880])])
+"""
+
+import os
+import shutil
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+# Beside the scripts, wherever they are run from
+DATA_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "clean_data")
+
+# The partition columns of each dataset and their types, explicit so they read back as they were written
+DATASETS = {
+    "national_address_file": pa.schema([("state", pa.string())]),
+    "business_count": pa.schema([("year", pa.int32())]),
+    "crop_production": pa.schema([("financial_year", pa.string())]),
+    "freight_cost": pa.schema([("year", pa.int64())])
+}
+
+COMPRESSION = "zstd"
+ROW_GROUP_SIZE = 64 * 1024
+BATCH_SIZE = 64 * 1024
+
+
+def dataset_path(name, root=DATA_ROOT):
+    return os.path.abspath(os.path.join(root, name))
+
+def partition_path(name, root=DATA_ROOT, **values):
+    """
+        The directory of one partition, e.g. partition_path("national_address_file", state="QLD")
+    """
+    return os.path.join(dataset_path(name, root), *(f"{key}={value}" for key, value in values.items()))
+
+def partitioning(name):
+    return ds.partitioning(DATASETS[name], flavor="hive")
+
+def dataset_exists(name, root=DATA_ROOT, **values):
+    return os.path.isdir(partition_path(name, root, **values))
+
+
+""" Writing """
+
+def write_dataset(frame, name, root=DATA_ROOT):
+    """
+        Replace a dataset with a DataFrame, one file per partition. It is
+        written to a hidden directory beside the dataset and swapped in, so a
+        failed write leaves the previous dataset in place.
+    """
+    path = dataset_path(name, root)
+    partial_path = os.path.join(os.path.dirname(path), f".{name}.partial")
+    previous_path = os.path.join(os.path.dirname(path), f".{name}.previous")
+    shutil.rmtree(partial_path, ignore_errors=True)
+    try:
+        ds.write_dataset(pa.Table.from_pandas(frame, preserve_index=False), partial_path, format="parquet",
+                         partitioning=partitioning(name), basename_template="part-{i}.parquet",
+                         file_options=ds.ParquetFileFormat().make_write_options(compression=COMPRESSION),
+                         max_rows_per_group=ROW_GROUP_SIZE, min_rows_per_group=min(ROW_GROUP_SIZE, len(frame)))
+    except BaseException:
+        shutil.rmtree(partial_path, ignore_errors=True)
+        raise
+
+    # A directory can't be renamed over another one, the previous dataset is moved aside first
+    shutil.rmtree(previous_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, previous_path)
+    os.replace(partial_path, path)
+    shutil.rmtree(previous_path, ignore_errors=True)
+
+class PartitionWriter:
+    """
+        Writes one partition's file in parts, e.g. a G-NAF state one bucket at
+        a time. The file only replaces the partition's previous one on close,
+        so a failed write leaves the previous one in place.
+    """
+
+    def __init__(self, name, schema, root=DATA_ROOT, **values):
+        directory = partition_path(name, root, **values)
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "part-0.parquet")
+        # Hidden files are skipped when a dataset is read
+        self._partial_path = os.path.join(directory, ".part-0.parquet")
+        self._writer = pq.ParquetWriter(self._partial_path, schema, compression=COMPRESSION)
+        self.rows = 0
+
+    def write(self, frame):
+        table = pa.Table.from_pandas(frame, schema=self._writer.schema, preserve_index=False)
+        self._writer.write_table(table, row_group_size=ROW_GROUP_SIZE)
+        self.rows += len(frame)
+
+    def close(self):
+        self._writer.close()
+        os.replace(self._partial_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._writer.close()
+            os.remove(self._partial_path)
+
+
+""" Reading """
+
+def open_dataset(name, root=DATA_ROOT):
+    return ds.dataset(dataset_path(name, root), format="parquet", partitioning=partitioning(name),
+                      filesystem=fs.LocalFileSystem(use_mmap=True))
+
+def filter_expression(filters):
+    return pq.filters_to_expression(filters) if filters else None
+
+def read_dataset(name, columns=None, filters=None, root=DATA_ROOT):
+    """
+        Read a dataset into a DataFrame, with only the given columns and the
+        rows matching the filters
+    """
+    return open_dataset(name, root).to_table(columns=columns, filter=filter_expression(filters)).to_pandas()
+
+def iter_batches(name, columns=None, filters=None, root=DATA_ROOT, batch_size=BATCH_SIZE):
+    """
+        Read a dataset as Arrow record batches of at most batch_size rows, so
+        it is never held in memory at once
+    """
+    batches = open_dataset(name, root).to_batches(columns=columns, filter=filter_expression(filters), batch_size=batch_size)
+    return (batch for batch in batches if batch.num_rows)
+
+def iter_dataset(name, columns=None, filters=None, root=DATA_ROOT, batch_size=BATCH_SIZE):
+    """
+        Read a dataset as DataFrames of at most batch_size rows
+    """
+    for batch in iter_batches(name, columns, filters, root, batch_size):
+        yield batch.to_pandas()
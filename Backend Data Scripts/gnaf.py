@@ -0,0 +1,261 @@
+""" G-NAF Address Cleaning
+
+Cleans the G-NAF Standard PSV tables of each state into the address details
+stored in the national_address_file collection:
+
+    address_detail_pid, street, city, state, zipcode, latitude, longitude
+
+Memory stays bounded whatever the size of a state:
+
+- Only the columns that are needed are parsed, with explicit dtypes. Locality
+  names and street types are categoricals, so each row holds a small code.
+- LOCALITY and STREET_LOCALITY are held in memory, they have one row per
+  locality or street and are small next to the address tables.
+- ADDRESS_DETAIL and ADDRESS_SITE_GEOCODE are read in chunks and hash
+  partitioned on address_site_pid into bucket files, then each bucket is
+  joined on its own. The number of buckets grows with the size of the tables,
+  so a bucket holds about bucket_mb of source text.
+
+Each state is cleaned in its own worker process and written to its partition
+of the national_address_file Parquet dataset (see datasets.py), sorted by
+zipcode so reads of a postcode only decode its row groups.
+
+Usage:
+    python gnaf.py --source "G-NAF_AUSTRALIAN_ADDRESS_DATA/G-NAF/G-NAF MAY 2025/Standard" [--states QLD NSW] [--fnq] [--workers 4]
+"""
+
+import os
+import sys
+import math
+import time
+import pickle
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+
+from datasets import DATA_ROOT, PartitionWriter
+
+SUPPORTED_STATES = ["QLD", "NSW", "ACT", "VIC", "WA", "SA", "NT", "TAS"]
+
+# Far North Queensland postcodes, the addresses the site was first launched with
+FNQ_POSTCODES = (4680, 4814, 4823, 4825, 4830, 4852, 4854, 4855, 4856, 4857, 4858, 4859, 4860, 4865, 4868, 4869,
+                 4870, 4871, 4872, 4873, 4874, 4875, 4876, 4877, 4878, 4879, 4880, 4881, 4882, 4883, 4884, 4885,
+                 4886, 4887, 4888, 4890, 4891, 4892, 4895)
+
+# The columns read from each table and their dtypes, every other column is skipped by the parser
+TABLE_COLUMNS = {
+    "LOCALITY": {"locality_pid": str, "locality_name": "category"},
+    "STREET_LOCALITY": {"street_locality_pid": str, "street_name": str, "street_type_code": "category"},
+    "ADDRESS_SITE_GEOCODE": {"address_site_pid": str, "longitude": "float64", "latitude": "float64"},
+    "ADDRESS_DETAIL": {"address_detail_pid": str, "street_locality_pid": str, "locality_pid": str,
+                       "number_first": "Int32", "postcode": "Int32", "address_site_pid": str}
+}
+
+OUTPUT_COLUMNS = ["address_detail_pid", "street", "city", "state", "zipcode", "latitude", "longitude"]
+
+# The columns of a state's file, state is its partition
+ADDRESS_SCHEMA = pa.schema([("address_detail_pid", pa.string()), ("street", pa.string()), ("city", pa.string()),
+                           ("zipcode", pa.int32()), ("latitude", pa.float64()), ("longitude", pa.float64())])
+
+# Postcode districts (the first two digits), the joined addresses are sorted one district at a time
+DISTRICTS = 100
+
+CHUNK_SIZE = 200000
+BUCKET_MB = 256
+
+
+def table_path(source, state, table):
+    return os.path.join(source, f"{state}_{table}_psv.psv")
+
+def available_states(source):
+    """
+        The supported states with an ADDRESS_DETAIL table in the source directory
+    """
+    return [state for state in SUPPORTED_STATES if os.path.exists(table_path(source, state, "ADDRESS_DETAIL"))]
+
+def read_table(source, state, table, chunksize=None):
+    """
+        Read the projected columns of a G-NAF table, whole or as an iterator of
+        chunks. Column names are lowercased.
+    """
+    columns = TABLE_COLUMNS[table]
+    reader = pd.read_csv(table_path(source, state, table), sep="|",
+                         usecols=[column.upper() for column in columns],
+                         dtype={column.upper(): dtype for column, dtype in columns.items()},
+                         chunksize=chunksize)
+    if chunksize is None:
+        return reader.rename(columns=str.lower)
+    return (chunk.rename(columns=str.lower) for chunk in reader)
+
+def peak_rss_mb():
+    """
+        Peak resident memory of this process in MB, None where it can't be read (Windows)
+    """
+    # On Linux ru_maxrss carries over the parent's peak through fork and exec, VmHWM doesn't
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+""" Partitioning """
+
+def partition(chunks, key, buckets, path):
+    """
+        Split chunks into bucket files by the hash of the key column, so rows
+        with the same key always land in the same bucket, or by a function of
+        the chunk giving each row's bucket. Returns the bucket file paths.
+    """
+    paths = [f"{path}_{bucket}.pkl" for bucket in range(buckets)]
+    files = [open(bucket_path, "wb") for bucket_path in paths]
+    try:
+        for chunk in chunks:
+            if callable(key):
+                bucket_of_row = key(chunk)
+            else:
+                bucket_of_row = pd.util.hash_pandas_object(chunk[key], index=False).to_numpy() % buckets
+            for bucket, rows in chunk.groupby(bucket_of_row):
+                pickle.dump(rows, files[bucket], protocol=pickle.HIGHEST_PROTOCOL)
+    finally:
+        for f in files:
+            f.close()
+    return paths
+
+def read_bucket(path):
+    parts = []
+    with open(path, "rb") as f:
+        while True:
+            try:
+                parts.append(pickle.load(f))
+            except EOFError:
+                break
+    return pd.concat(parts, ignore_index=True) if parts else None
+
+def address_chunks(source, state, localities, streets, postcodes=None, chunksize=CHUNK_SIZE):
+    """
+        Read ADDRESS_DETAIL in chunks and join each chunk to its locality and
+        street, keeping only the columns needed after the geocode join
+    """
+    for chunk in read_table(source, state, "ADDRESS_DETAIL", chunksize):
+        chunk = chunk.dropna(subset=["address_detail_pid", "address_site_pid", "street_locality_pid",
+                                     "locality_pid", "number_first", "postcode"])
+        if postcodes is not None:
+            chunk = chunk[chunk["postcode"].isin(postcodes)]
+
+        chunk = chunk.merge(localities, on="locality_pid", how="inner")
+        chunk = chunk.merge(streets, on="street_locality_pid", how="inner")
+
+        # e.g. "12 MULGRAVE ROAD", the street type may be missing
+        street_type = (" " + chunk["street_type_code"].astype(object)).fillna("")
+        chunk["street"] = chunk["number_first"].astype(str) + " " + chunk["street_name"] + street_type
+
+        yield chunk[["address_detail_pid", "address_site_pid", "street", "locality_name", "postcode"]]
+
+def geocode_chunks(source, state, chunksize=CHUNK_SIZE):
+    for chunk in read_table(source, state, "ADDRESS_SITE_GEOCODE", chunksize):
+        yield chunk.dropna()
+
+def joined_buckets(address_buckets, geocode_buckets):
+    """
+        Join each address bucket to the geocodes of the same bucket
+    """
+    for address_bucket, geocode_bucket in zip(address_buckets, geocode_buckets):
+        addresses, geocodes = read_bucket(address_bucket), read_bucket(geocode_bucket)
+        if addresses is None or geocodes is None:
+            continue
+
+        # A site can have several geocodes, keep one so every address is one row
+        geocodes = geocodes.drop_duplicates("address_site_pid")
+        addresses = addresses.merge(geocodes, on="address_site_pid", how="inner")
+        addresses = addresses.drop_duplicates("address_detail_pid")
+        yield addresses.rename(columns={"locality_name": "city", "postcode": "zipcode"})
+
+def postcode_district(addresses):
+    return addresses["zipcode"].to_numpy(dtype="int64") // 100
+
+
+""" Cleaning """
+
+def clean_state(source, output, state, postcodes=None, chunksize=CHUNK_SIZE, bucket_mb=BUCKET_MB, work_dir=None):
+    """
+        Clean the G-NAF tables of one state into its national_address_file
+        partition under output. Returns the state, output path, row count,
+        seconds and peak RSS.
+    """
+    start = time.perf_counter()
+    postcodes = set(postcodes) if postcodes is not None else None
+
+    localities = read_table(source, state, "LOCALITY").dropna(subset=["locality_pid"])
+    localities = localities.drop_duplicates("locality_pid")
+
+    streets = read_table(source, state, "STREET_LOCALITY").dropna(subset=["street_locality_pid", "street_name"])
+    streets = streets.drop_duplicates("street_locality_pid")
+
+    size = sum(os.path.getsize(table_path(source, state, table)) for table in ("ADDRESS_DETAIL", "ADDRESS_SITE_GEOCODE"))
+    buckets = max(1, math.ceil(size / (bucket_mb * 2**20)))
+
+    with tempfile.TemporaryDirectory(prefix=f"gnaf_{state}_", dir=work_dir) as tmp:
+        address_buckets = partition(address_chunks(source, state, localities, streets, postcodes, chunksize),
+                                    "address_site_pid", buckets, os.path.join(tmp, "address"))
+        geocode_buckets = partition(geocode_chunks(source, state, chunksize),
+                                    "address_site_pid", buckets, os.path.join(tmp, "geocode"))
+        del localities, streets
+
+        district_buckets = partition(joined_buckets(address_buckets, geocode_buckets), postcode_district,
+                                     DISTRICTS, os.path.join(tmp, "district"))
+
+        with PartitionWriter("national_address_file", ADDRESS_SCHEMA, output, state=state) as writer:
+            for district_bucket in district_buckets:
+                addresses = read_bucket(district_bucket)
+                if addresses is not None:
+                    writer.write(addresses.sort_values(["zipcode", "city", "street"])[ADDRESS_SCHEMA.names])
+
+    return {"state": state, "path": writer.path, "rows": writer.rows,
+            "seconds": time.perf_counter() - start, "peak_rss_mb": peak_rss_mb()}
+
+def clean_states(source, output, states=None, postcodes=None, workers=None, chunksize=CHUNK_SIZE, bucket_mb=BUCKET_MB):
+    """
+        Clean every state in its own worker process, by default every supported
+        state found in source. Returns the result of clean_state for each state.
+    """
+    states = states or available_states(source)
+    os.makedirs(output, exist_ok=True)
+
+    # A fresh process per state, so one state's memory is returned before the next starts.
+    # Spawned as on Windows, so workers don't inherit the memory of the calling script
+    with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1,
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(clean_state, source, output, state, postcodes, chunksize, bucket_mb) for state in states]
+        return [future.result() for future in futures]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", required=True, help="The G-NAF Standard directory with the <STATE>_<TABLE>_psv.psv files")
+    parser.add_argument("--output", default=DATA_ROOT)
+    parser.add_argument("--states", nargs="+", choices=SUPPORTED_STATES, help="Default: every state found in --source")
+    parser.add_argument("--fnq", action="store_true", help="Only keep Far North Queensland postcodes")
+    parser.add_argument("--workers", type=int, help="Number of states cleaned at once, default: the number of CPUs")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--bucket-mb", type=int, default=BUCKET_MB)
+    args = parser.parse_args()
+
+    for result in clean_states(args.source, args.output, args.states, FNQ_POSTCODES if args.fnq else None,
+                               args.workers, args.chunksize, args.bucket_mb):
+        print(f"{result['state']:<4} {result['rows']:>10} rows in {result['seconds']:.1f}s, "
+              f"peak RSS {result['peak_rss_mb'] or 0:.0f}MB -> {result['path']}")
@@ -0,0 +1,291 @@
+""" G-NAF Loading
+
+Loads the cleaned G-NAF addresses (the national_address_file dataset, see
+gnaf.py and datasets.py) into farm_details.national_address_file. The API
+geocodes farms against this collection, so it is never left empty or partly
+loaded:
+
+- Refresh: the new release of each state is diffed by address_detail_pid
+  against the state's partition of the last load, kept in the loaded
+  directory. Only new, changed and retired addresses are written, with
+  unordered bulk writes, new and changed ones before retired ones are deleted. The database
+  work is proportional to the changes. Every write is idempotent, so a failed
+  refresh is made good by running it again.
+- Full load: the addresses are loaded into a staging collection, the live
+  addresses of the other states are copied to it, its indexes are built (see
+  API/indexes.py), and it is renamed over the live collection in one step.
+  Batches are BSON encoded in encoder processes and inserted by several
+  concurrent unordered writers, retrying transient errors. Used when
+  no state has been loaded before, when a loaded state is missing from the
+  collection, or with --full, e.g. the first time after the collection was
+  loaded by another script.
+
+After a successful load the partitions are copied to the loaded directory for
+the next refresh. Both only touch the states they are given.
+
+Usage:
+    python gnaf_load.py --mongo-uri <uri> --states QLD NSW [--root clean_data] [--loaded <dir>] [--full] [--batch-size 10000] [--encoders 4] [--writers 4]
+"""
+
+import os
+import sys
+import math
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import bson
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from bson import ObjectId
+from bson.raw_bson import RawBSONDocument
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, PyMongoError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "API"))
+
+from gnaf import BUCKET_MB, OUTPUT_COLUMNS, SUPPORTED_STATES, partition, read_bucket
+from datasets import DATA_ROOT, dataset_exists, iter_batches, iter_dataset, partition_path
+from indexes import INDEXES, ensure_indexes
+
+DATABASE = "farm_details"
+COLLECTION = "national_address_file"
+LOADED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "national_address_file_loaded")
+
+BATCH_SIZE = 10000
+WRITERS = 4
+RETRIES = 5
+
+DUPLICATE_KEY = 11000
+
+
+def location_column(table):
+    """
+        The GeoJSON points of the longitude and latitude columns, as an Arrow struct column
+    """
+    coordinates = np.column_stack([table["longitude"].to_numpy(), table["latitude"].to_numpy()]).ravel()
+    return pa.StructArray.from_arrays([pa.repeat("Point", table.num_rows),
+                                       pa.FixedSizeListArray.from_arrays(pa.array(coordinates), 2)],
+                                      ["type", "coordinates"])
+
+def documents(addresses):
+    """
+        The national_address_file documents of cleaned addresses (an Arrow
+        batch or a DataFrame), with a GeoJSON location. Built column by
+        column and turned into dicts in one pass by Arrow.
+    """
+    if isinstance(addresses, pd.DataFrame):
+        table = pa.Table.from_pandas(addresses[OUTPUT_COLUMNS], preserve_index=False)
+    else:
+        table = pa.Table.from_batches([addresses]).select(OUTPUT_COLUMNS)
+    return table.append_column("location", location_column(table)).to_pylist()
+
+def write_batches(collection, requests, batch_size=BATCH_SIZE):
+    """
+        Send write requests as unordered bulk writes of batch_size
+    """
+    for i in range(0, len(requests), batch_size):
+        collection.bulk_write(requests[i:i + batch_size], ordered=False)
+
+
+""" Refresh """
+
+def read_state(state, root):
+    """
+        The addresses of a state in the dataset under root, in batches
+    """
+    return iter_dataset("national_address_file", OUTPUT_COLUMNS, [("state", "==", state)], root)
+
+def read_state_batches(state, root, batch_size=BATCH_SIZE):
+    return iter_batches("national_address_file", OUTPUT_COLUMNS, [("state", "==", state)], root, batch_size)
+
+def diff(state, previous_root, current_root, work_dir=None, bucket_mb=BUCKET_MB):
+    """
+        Compare a state's addresses in two datasets by address_detail_pid, one
+        hash bucket at a time. Yields (new, changed, retired) per bucket: the
+        rows of new and changed addresses, and the pids of retired ones. A
+        state missing from the previous dataset has no addresses.
+    """
+    roots = [root for root in (previous_root, current_root) if dataset_exists("national_address_file", root, state=state)]
+    size = sum(os.path.getsize(os.path.join(directory, name))
+               for directory in (partition_path("national_address_file", root, state=state) for root in roots)
+               for name in os.listdir(directory))
+    # Parquet is compressed several times over, bucket by its decoded size
+    buckets = max(1, math.ceil(size * 4 / (bucket_mb * 2**20)))
+
+    with tempfile.TemporaryDirectory(prefix="gnaf_diff_", dir=work_dir) as tmp:
+        current_buckets = partition(read_state(state, current_root), "address_detail_pid",
+                                    buckets, os.path.join(tmp, "current"))
+        previous_batches = read_state(state, previous_root) if previous_root in roots else []
+        previous_buckets = partition(previous_batches, "address_detail_pid", buckets, os.path.join(tmp, "previous"))
+
+        empty = pd.DataFrame({column: pd.Series(dtype=object) for column in OUTPUT_COLUMNS})
+        for previous_bucket, current_bucket in zip(previous_buckets, current_buckets):
+            previous = read_bucket(previous_bucket)
+            current = read_bucket(current_bucket)
+            previous = empty if previous is None else previous
+            current = empty if current is None else current
+
+            merged = current.merge(previous, on="address_detail_pid", how="outer", suffixes=("", "_previous"), indicator=True)
+            both = merged[merged["_merge"] == "both"]
+            changed = pd.Series(False, index=both.index)
+            for column in OUTPUT_COLUMNS[1:]:
+                changed |= both[column].to_numpy(dtype=object) != both[f"{column}_previous"].to_numpy(dtype=object)
+
+            # The outer join makes the columns of missing rows nullable, the written rows have their own types
+            dtypes = current[OUTPUT_COLUMNS].dtypes.to_dict()
+            yield (merged.loc[merged["_merge"] == "left_only", OUTPUT_COLUMNS].astype(dtypes),
+                   both.loc[changed, OUTPUT_COLUMNS].astype(dtypes),
+                   merged.loc[merged["_merge"] == "right_only", "address_detail_pid"].tolist())
+
+def refresh_state(collection, state, loaded, root, batch_size=BATCH_SIZE, work_dir=None):
+    """
+        Write the differences between the last loaded and the new addresses of
+        a state. Returns the number of new, changed and retired addresses.
+    """
+    counts = {"new": 0, "changed": 0, "retired": 0}
+    retired = []
+    for new, changed, retired_pids in diff(state, loaded, root, work_dir):
+        upserts = pd.concat([new, changed], ignore_index=True)
+        write_batches(collection, [ReplaceOne({"address_detail_pid": doc["address_detail_pid"]}, doc, upsert=True)
+                                   for doc in documents(upserts)], batch_size)
+        retired += retired_pids
+        counts["new"] += len(new)
+        counts["changed"] += len(changed)
+
+    # Retired last, so an address that moved to a new pid is never missing
+    for i in range(0, len(retired), batch_size):
+        collection.delete_many({"address_detail_pid": {"$in": retired[i:i + batch_size]}})
+    counts["retired"] = len(retired)
+    return counts
+
+
+""" Full Load """
+
+def encode_documents(batch):
+    """
+        BSON encode the documents of a batch, in an encoder process. Each gets
+        its _id here, so a failed insert can be sent again without duplicates.
+    """
+    return [bson.encode({"_id": ObjectId(), **document}) for document in documents(batch)]
+
+def insert_encoded(collection, encoded, retries=RETRIES):
+    """
+        Insert BSON encoded documents with an unordered insert_many, retrying
+        connection and retryable errors with backoff. Returns the number inserted.
+    """
+    batch = [RawBSONDocument(document) for document in encoded]
+    for attempt in range(retries + 1):
+        try:
+            collection.insert_many(batch, ordered=False)
+            return len(batch)
+        except BulkWriteError as e:
+            # Documents inserted by an earlier attempt fail on their _id, every other error is real
+            if e.details.get("writeConcernErrors") or any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+                raise
+            return len(batch)
+        except PyMongoError as e:
+            if attempt == retries or not (isinstance(e, ConnectionFailure) or e.has_error_label("RetryableWriteError")):
+                raise
+            time.sleep(min(0.1 * 2**attempt, 5))
+
+def bulk_load(collection, batches, encoders=None, writers=WRITERS, retries=RETRIES):
+    """
+        Insert Arrow batches of addresses, encoding them in encoder processes
+        and inserting them from writer threads. Only a few batches are in
+        flight at once, so memory is bounded by the batch size. Returns the
+        number of addresses inserted.
+    """
+    encoders = encoders or os.cpu_count()
+    inserted = 0
+    encoding, writing = deque(), deque()
+
+    # Spawned as on Windows, so encoders don't inherit the memory of the calling script
+    with ProcessPoolExecutor(encoders, mp_context=multiprocessing.get_context("spawn")) as encode_pool, \
+            ThreadPoolExecutor(writers) as write_pool:
+        def write_next():
+            nonlocal inserted
+            writing.append(write_pool.submit(insert_encoded, collection, encoding.popleft().result(), retries))
+            while len(writing) > writers * 2:
+                inserted += writing.popleft().result()
+
+        for batch in batches:
+            encoding.append(encode_pool.submit(encode_documents, batch))
+            if len(encoding) > encoders * 2:
+                write_next()
+        while encoding:
+            write_next()
+        while writing:
+            inserted += writing.popleft().result()
+
+    return inserted
+
+def full_load(client, states, root, batch_size=BATCH_SIZE, encoders=None, writers=WRITERS):
+    """
+        Load the states into a staging collection with the live addresses of
+        the other states, build its indexes and rename it over the live
+        collection. Returns the number of addresses loaded.
+    """
+    db = client[DATABASE]
+    staging = db[f"{COLLECTION}_staging"]
+    staging.drop()
+
+    batches = (batch for state in states for batch in read_state_batches(state, root, batch_size))
+    loaded = bulk_load(staging, batches, encoders, writers)
+
+    # Only the given states are replaced, the live addresses of the others are copied over
+    if COLLECTION in db.list_collection_names():
+        db[COLLECTION].aggregate([{"$match": {"state": {"$nin": list(states)}}}, {"$merge": {"into": staging.name}}])
+
+    # Built before the swap, so the API never queries the new collection without them
+    staging.create_indexes(INDEXES[(DATABASE, COLLECTION)])
+    staging.rename(COLLECTION, dropTarget=True)
+    return loaded
+
+
+def refresh(client, states, root=DATA_ROOT, loaded=LOADED_DIR, full=False, batch_size=BATCH_SIZE, work_dir=None,
+            encoders=None, writers=WRITERS):
+    """
+        Refresh the collection from the states' cleaned addresses, diffing
+        against the loaded directory when any of the states was loaded before
+        and is still in the collection, otherwise with a full load. Returns the counts of each state, or of
+        the full load.
+    """
+    collection = client[DATABASE][COLLECTION]
+    previous = [state for state in states if dataset_exists("national_address_file", loaded, state=state)]
+    # A state whose last load is missing from the collection, e.g. after the database was dropped or
+    # when loading into another server, would be diffed as unchanged, so it is loaded in full
+    if full or not previous or any(collection.find_one({"state": state}, {"_id": 1}) is None for state in previous):
+        results = {"full": full_load(client, states, root, batch_size, encoders, writers)}
+    else:
+        ensure_indexes(collection)
+        results = {state: refresh_state(collection, state, loaded, root, batch_size, work_dir) for state in states}
+
+    # Only recorded once loaded, so a failed load is diffed from the same partitions again
+    for state in states:
+        previous = partition_path("national_address_file", loaded, state=state)
+        shutil.rmtree(previous, ignore_errors=True)
+        shutil.copytree(partition_path("national_address_file", root, state=state), previous)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mongo-uri", required=True)
+    parser.add_argument("--states", nargs="+", required=True, choices=SUPPORTED_STATES)
+    parser.add_argument("--root", default=DATA_ROOT, help="Where the cleaned datasets are")
+    parser.add_argument("--loaded", default=LOADED_DIR, help="Where the partitions of the last load are kept")
+    parser.add_argument("--full", action="store_true", help="Load into a staging collection and swap it in")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Documents per insert or bulk write")
+    parser.add_argument("--encoders", type=int, help="BSON encoder processes of a full load, default: the number of CPUs")
+    parser.add_argument("--writers", type=int, default=WRITERS, help="Concurrent inserts of a full load")
+    args = parser.parse_args()
+
+    from pymongo import MongoClient
+    print(refresh(MongoClient(args.mongo_uri), args.states, args.root, args.loaded, args.full, args.batch_size,
+                  encoders=args.encoders, writers=args.writers))
@@ -0,0 +1,261 @@
+""" ETL Pipeline
+
+Runs the data scripts as one graph of stages, instead of each by hand and in
+order. The clean stage of a dataset extracts its source, cleans it and exports
+it to its Parquet dataset (see datasets.py), which its load and plot stages
+read:
+
+    clean:freight_cost             ABARES_HISTORICAL_REGIONAL_ESTIMATES_DATA_CLEANING.py
+    clean:business_count           ABS_CABEE_BY_LGA_DATA_CLEANING.py
+    clean:crop_production          ABS_HORTICULTURAL_CROPS_BY_STATE_DATA_CLEANING.py
+    clean:national_address_file    G-NAF_DATA_CLEANING.py
+    load:<dataset>                 the same scripts, into MongoDB
+    plot:crop_production           CROP_PRODUCTION_TRENDS_PLOT.py
+    plot:business_count            FNQ_BUSINESS_TRENDS_PLOT.py
+
+- Each stage runs in its own process as soon as the stages it reads from
+  have finished, so the branches of different datasets run at once.
+- A clean or plot stage is skipped when the content hash of its inputs
+  matches the one of its last successful run, kept in <root>/.pipeline.json,
+  and its outputs are still there. The hash covers the files it reads (its
+  source files or dataset), the code of its script and the modules it uses,
+  and its settings.
+- A load stage always runs, as the pipeline can't see what is in the
+  database, e.g. after it was dropped. Loading an unchanged dataset again is
+  cheap: the G-NAF load only writes the addresses that changed, see
+  gnaf_load.py.
+- Each stage prints whether it ran or was skipped, its time and its rows.
+- A stage that fails skips the stages after it, the other branches carry on.
+
+The loads write to the app's cluster, from the same environment variables as
+API/app.py, unless --mongo-uri gives another server, e.g. a local mongod so
+the whole pipeline runs offline.
+
+The sources, datasets and figures are beside the scripts by default, wherever
+the pipeline is run from.
+
+Usage:
+    python pipeline.py [--sources .] [--root clean_data] [--plots .] [--mongo-uri mongodb://localhost:27017] [--stages clean plot business_count] [--states QLD NSW] [--fnq] [--force] [--workers 4]
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import traceback
+import importlib.util
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from datasets import DATA_ROOT, dataset_path
+from gnaf import SUPPORTED_STATES, TABLE_COLUMNS, available_states, table_path
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(os.path.dirname(SCRIPTS_DIR), "API")
+
+MANIFEST = ".pipeline.json"
+
+
+def connection_string():
+    """
+        The app's MongoDB connection string, from the environment variables of API/app.py
+    """
+    if os.getenv("mongodb_url"):
+        return os.getenv("mongodb_url")
+    if not os.getenv("mongodb_uri"):
+        sys.exit("Set mongodb_url (e.g. mongodb://localhost:27017), or mongodb_user, mongodb_pass and mongodb_uri, "
+                 "or pass --mongo-uri")
+    return f"mongodb+srv://{os.getenv('mongodb_user')}:{os.getenv('mongodb_pass')}@{os.getenv('mongodb_uri')}/"
+
+def load_script(script):
+    """
+        Import a script of this directory by its file name, e.g. G-NAF_DATA_CLEANING.py
+    """
+    name = os.path.splitext(script)[0].replace("-", "_").lower()
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPTS_DIR, script))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def stage(script, function, kwargs, after=(), inputs=(), code=(), outputs=(), always=False):
+    return {"script": script, "function": function, "kwargs": kwargs, "after": list(after),
+            "inputs": list(inputs), "code": [os.path.join(SCRIPTS_DIR, path) for path in (script, "datasets.py", *code)],
+            "outputs": list(outputs), "always": always}
+
+def stages(sources=SCRIPTS_DIR, root=DATA_ROOT, plots=SCRIPTS_DIR, mongo_uri=None, states=None, fnq=False):
+    """
+        Every stage by name, with the script function it runs and its keyword
+        arguments, the stages it runs after, the files it reads (inputs and
+        code), the ones it writes (outputs) and whether it always runs
+    """
+    graph = {}
+    for dataset, script in (("freight_cost", "ABARES_HISTORICAL_REGIONAL_ESTIMATES_DATA_CLEANING.py"),
+                            ("business_count", "ABS_CABEE_BY_LGA_DATA_CLEANING.py"),
+                            ("crop_production", "ABS_HORTICULTURAL_CROPS_BY_STATE_DATA_CLEANING.py")):
+        source = os.path.join(sources, load_script(script).SOURCE)
+        graph[f"clean:{dataset}"] = stage(script, "clean", {"source": source, "root": root},
+                                          inputs=[source], outputs=[dataset_path(dataset, root)])
+        graph[f"load:{dataset}"] = stage(script, "load", {"mongo_uri": mongo_uri, "root": root},
+                                         after=[f"clean:{dataset}"], inputs=[dataset_path(dataset, root)], always=True)
+
+    script = "G-NAF_DATA_CLEANING.py"
+    source = os.path.join(sources, load_script(script).SOURCE)
+    graph["clean:national_address_file"] = stage(
+        script, "clean", {"source": source, "root": root, "states": states, "fnq": fnq},
+        inputs=[table_path(source, state, table) for state in states or available_states(source) for table in TABLE_COLUMNS],
+        code=["gnaf.py"], outputs=[dataset_path("national_address_file", root)])
+    graph["load:national_address_file"] = stage(
+        script, "load", {"mongo_uri": mongo_uri, "root": root, "states": states},
+        after=["clean:national_address_file"], inputs=[dataset_path("national_address_file", root)],
+        code=["gnaf.py", "gnaf_load.py", os.path.join(API_DIR, "indexes.py")], always=True)
+
+    for dataset, script, figures in (("crop_production", "CROP_PRODUCTION_TRENDS_PLOT.py",
+                                      ["plot_1_crop_production_by_tonne.html", "plot_2_crop_production_value.html"]),
+                                     ("business_count", "FNQ_BUSINESS_TRENDS_PLOT.py",
+                                      ["plot_3_fnq_business_counts.html"])):
+        graph[f"plot:{dataset}"] = stage(script, "plot", {"root": root, "output": plots},
+                                         after=[f"clean:{dataset}"], inputs=[dataset_path(dataset, root)],
+                                         outputs=[os.path.join(plots, figure) for figure in figures])
+    return graph
+
+def select(graph, names):
+    """
+        The stages matching any of the names, a stage name (load:freight_cost),
+        a kind of stage (load) or a dataset (freight_cost)
+    """
+    return {name: stage for name, stage in graph.items()
+            if not names or any(selected in (name, *name.split(":")) for selected in names)}
+
+
+""" Content Hashes """
+
+def files(path):
+    """
+        The files of an input, itself or the files under it, without hidden ones such as partly written parts
+    """
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(os.path.join(directory, name) for directory, directories, names in os.walk(path)
+                  for name in names if not name.startswith("."))
+
+def content_hash(stage):
+    """
+        A hash of what a stage's result depends on: its settings and the
+        names and contents of its input and code files
+    """
+    digest = hashlib.sha256(json.dumps([stage["function"], stage["kwargs"]], sort_keys=True).encode())
+    for path in stage["inputs"] + stage["code"]:
+        for file in files(path):
+            digest.update(os.path.relpath(file, path).encode() + b"\0")
+            if not os.path.exists(file):
+                digest.update(b"missing\0")
+                continue
+            with open(file, "rb") as f:
+                for block in iter(lambda: f.read(2**20), b""):
+                    digest.update(block)
+    return digest.hexdigest()
+
+def read_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def write_manifest(path, manifest):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+""" Running """
+
+def run_stage(stage, previous, force=False):
+    """
+        Run a stage in a worker process unless it may be skipped and its
+        inputs are unchanged since its last run (previous, from the manifest). Returns its hash, rows and
+        seconds, and whether it was skipped.
+    """
+    start = time.perf_counter()
+    digest = content_hash(stage)
+    if not (force or stage["always"]) and previous.get("hash") == digest and all(os.path.exists(path) for path in stage["outputs"]):
+        return {"hash": digest, "rows": previous.get("rows"), "seconds": time.perf_counter() - start, "skipped": True}
+
+    rows = getattr(load_script(stage["script"]), stage["function"])(**stage["kwargs"])
+    return {"hash": digest, "rows": rows, "seconds": time.perf_counter() - start, "skipped": False}
+
+def report(name, status, rows=None, seconds=None):
+    rows = "" if rows is None else f"{rows:>10} rows"
+    seconds = "" if seconds is None else f"{seconds:>8.1f}s"
+    print(f"{name:<30} {status:<8} {rows:>15} {seconds:>9}", flush=True)
+
+def run(graph, root=DATA_ROOT, workers=None, force=False):
+    """
+        Run the stages of a graph in dependency order, at most workers at
+        once. Stages it runs after that are not in the graph are taken as
+        done. Returns the status of each stage: ran, skipped, failed or blocked.
+    """
+    manifest_path = os.path.join(root, MANIFEST)
+    manifest = read_manifest(manifest_path)
+    pending, running, statuses = dict(graph), {}, {}
+
+    # Spawned as on Windows, and stages that start their own worker processes start them from a clean process
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                after = [dependency for dependency in stage["after"] if dependency in graph]
+                if any(dependency in pending or dependency in running.values() for dependency in after):
+                    continue
+                del pending[name]
+                if any(statuses[dependency] in ("failed", "blocked") for dependency in after):
+                    statuses[name] = "blocked"
+                    report(name, "blocked")
+                else:
+                    running[pool.submit(run_stage, stage, manifest.get(name, {}), force)] = name
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception:
+                    statuses[name] = "failed"
+                    report(name, "failed")
+                    traceback.print_exc()
+                    continue
+                statuses[name] = "skipped" if result["skipped"] else "ran"
+                report(name, statuses[name], result["rows"], result["seconds"])
+                if not result["skipped"]:
+                    manifest[name] = {"hash": result["hash"], "rows": result["rows"], "seconds": result["seconds"]}
+                    write_manifest(manifest_path, manifest)
+    return statuses
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sources", default=SCRIPTS_DIR, help="Where the source csv, xlsx and G-NAF files are")
+    parser.add_argument("--root", default=DATA_ROOT, help="Where the cleaned datasets are written")
+    parser.add_argument("--plots", default=SCRIPTS_DIR, help="Where the html figures are written")
+    parser.add_argument("--mongo-uri", help="Load into this server instead of the app's cluster")
+    parser.add_argument("--stages", nargs="+", help="Only these stages, by name, kind (clean, load, plot) or dataset")
+    parser.add_argument("--states", nargs="+", choices=SUPPORTED_STATES, help="G-NAF states, default: every state found in --sources")
+    parser.add_argument("--fnq", action="store_true", help="Only keep Far North Queensland addresses")
+    parser.add_argument("--force", action="store_true", help="Run every stage, even if its inputs are unchanged")
+    parser.add_argument("--workers", type=int, help="Stages run at once, default: the number of CPUs")
+    args = parser.parse_args()
+
+    graph = select(stages(args.sources, args.root, args.plots, args.mongo_uri, args.states, args.fnq), args.stages)
+    # Resolved here, so the hash of a load changes with the server it writes to
+    if not args.mongo_uri and any(name.startswith("load:") for name in graph):
+        graph = select(stages(args.sources, args.root, args.plots, connection_string(), args.states, args.fnq), args.stages)
+
+    start = time.perf_counter()
+    statuses = run(graph, args.root, args.workers, args.force)
+    print(f"{len(statuses)} stages in {time.perf_counter() - start:.1f}s: " +
+          ", ".join(f"{sum(status == s for status in statuses.values())} {s}" for s in ("ran", "skipped", "failed", "blocked")))
+    sys.exit(1 if any(status in ("failed", "blocked") for status in statuses.values()) else 0)